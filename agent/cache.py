@@ -0,0 +1,161 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from dotenv import load_dotenv
+
+from agent import tools, model_router, preprocess, local_classifier, markings, resistor_bands, schemas
+
+# --- 1. Configuration ---
+
+# The cache lives on disk so repeat scans survive a restart of the app.
+
+load_dotenv()
+
+CACHE_ENABLED = os.environ.get("ANALYSIS_CACHE_ENABLED", "1") != "0"
+CACHE_PATH = os.environ.get("ANALYSIS_CACHE_PATH", os.path.join("cache", "analysis_cache.sqlite3"))
+CACHE_MAX_ENTRIES = int(os.environ.get("ANALYSIS_CACHE_MAX_ENTRIES", "512"))
+CACHE_TTL_SECONDS = float(os.environ.get("ANALYSIS_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+
+# The state fields we keep for a cached analysis.
+CACHED_FIELDS = ("component_type", "raw_analysis", "analysis_fields", "analysis_result")
+
+
+def cache_fingerprint():
+    """
+    Returns a short hash of everything that influences an analysis result:
+    the prompts, the output schemas, the model routes, the image
+    normalisation profiles, the local classifier model, the local OCR/parts
+    index settings and the colour-band decoder settings. Changing any of them produces a new
+    fingerprint, which invalidates every previously cached entry.
+    """
+    material = json.dumps(
+        {
+            "prompts": tools.PROMPTS, "schemas": schemas.schemas_fingerprint(), "model_routes": model_router.routes_fingerprint(),
+            "image_profiles": preprocess.PROFILES if preprocess.PREPROCESS_ENABLED else None,
+            "local_classifier": local_classifier.model_fingerprint(),
+            "markings": markings.fingerprint(),
+            "resistor_bands": resistor_bands.fingerprint(),
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()[:16]
+
+
+class AnalysisCache:
+    """
+    A persistent, content-addressed cache of analysis results.
+
+    Entries are keyed by the SHA-256 of the decoded image bytes together with
+    the prompt/model fingerprint. The cache is bounded to `max_entries` using
+    least-recently-used eviction, and entries older than `ttl_seconds` are
+    treated as misses and purged.
+    """
+    def __init__(self, path=CACHE_PATH, max_entries=CACHE_MAX_ENTRIES, ttl_seconds=CACHE_TTL_SECONDS):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.fingerprint = cache_fingerprint()
+        self.lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS analyses (
+                   key TEXT PRIMARY KEY,
+                   fingerprint TEXT NOT NULL,
+                   payload TEXT NOT NULL,
+                   created_at REAL NOT NULL,
+                   last_access REAL NOT NULL
+               )"""
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_analyses_last_access ON analyses(last_access)")
+        # Entries produced by other prompts or models can never hit again.
+        self.conn.execute("DELETE FROM analyses WHERE fingerprint != ?", (self.fingerprint,))
+        self.conn.commit()
+
+    def key_for(self, image_bytes):
+        """Returns the cache key for a decoded image."""
+        digest = hashlib.sha256()
+        digest.update(self.fingerprint.encode("utf-8"))
+        digest.update(image_bytes)
+        return digest.hexdigest()
+
+    def get(self, image_bytes):
+        """Returns the cached state fields for an image, or None on a miss."""
+        key = self.key_for(image_bytes)
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT payload, created_at FROM analyses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            payload, created_at = row
+            if now - created_at > self.ttl_seconds:
+                self.conn.execute("DELETE FROM analyses WHERE key = ?", (key,))
+                self.conn.commit()
+                return None
+            self.conn.execute("UPDATE analyses SET last_access = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+        return json.loads(payload)
+
+    def put(self, image_bytes, state):
+        """Stores the cacheable fields of a finished analysis state."""
+        payload = json.dumps({field: state.get(field) for field in CACHED_FIELDS})
+        key = self.key_for(image_bytes)
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO analyses (key, fingerprint, payload, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, self.fingerprint, payload, now, now),
+            )
+            self._evict(now)
+            self.conn.commit()
+
+    def _evict(self, now):
+        """Drops expired entries, then the least recently used ones above the size bound."""
+        self.conn.execute("DELETE FROM analyses WHERE created_at < ?", (now - self.ttl_seconds,))
+        self.conn.execute(
+            """DELETE FROM analyses WHERE key IN (
+                   SELECT key FROM analyses ORDER BY last_access DESC LIMIT -1 OFFSET ?
+               )""",
+            (self.max_entries,),
+        )
+
+    def clear(self):
+        """Removes every entry from the cache."""
+        with self.lock:
+            self.conn.execute("DELETE FROM analyses")
+            self.conn.commit()
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM analyses").fetchone()[0]
+
+
+def is_cacheable(state):
+    """Only successful analyses are worth caching; errors should be retried."""
+    if state.get("error"):
+        return False
+    result = state.get("analysis_result") or ""
+    raw = state.get("raw_analysis") or ""
+    if not result or not raw:
+        return False
+    return "API_ERROR" not in result and "API_ERROR" not in raw and not result.startswith("Failed to process")
+
+
+analysis_cache = None
+
+if CACHE_ENABLED:
+    try:
+        analysis_cache = AnalysisCache()
+        print(f"Analysis cache ready at {CACHE_PATH} ({len(analysis_cache)} entries).")
+    except Exception as e:
+        print(f"Error initializing analysis cache, continuing without it: {e}")
@@ -0,0 +1,118 @@
+import os
+from dotenv import load_dotenv
+
+# --- 1. Configuration ---
+# Chat requests are kept to a fixed token budget: a slice of the initial
+# analysis, a rolling summary of older turns, and the most recent turns
+# verbatim. Token counts are estimated (about 4 characters per token), which
+# is close enough for budgeting without a tokenizer dependency.
+
+load_dotenv()
+
+CHAT_CONTEXT_TOKENS = int(os.environ.get("CHAT_CONTEXT_TOKENS", "3000"))
+CHAT_ANALYSIS_TOKENS = int(os.environ.get("CHAT_ANALYSIS_TOKENS", "800"))
+# Most recent messages that are never folded into the rolling summary.
+CHAT_RECENT_MESSAGES = int(os.environ.get("CHAT_RECENT_MESSAGES", "6"))
+
+# The role used for the rolling summary entry in a session's history.
+SUMMARY_ROLE = "summary"
+
+
+def estimate_tokens(text):
+    return (len(text) + 3) // 4
+
+
+def _truncate(text, max_tokens):
+    max_chars = max_tokens * 4
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars].rsplit(" ", 1)[0] + " ..."
+
+
+def split_history(chat_history):
+    """
+    Splits a session history into (initial_analysis, key_specs, rolling_summary, turns).
+
+    The first entry is always the raw analysis and the second the summarized
+    analysis shown to the user (key_specs). A ("summary", ...) entry, if
+    present, holds the compacted earlier conversation; everything after that
+    is a chat turn.
+    """
+    initial_analysis = chat_history[0][1]
+    key_specs = None
+    rest = chat_history[1:]
+    if rest and rest[0][0] == "ai":
+        key_specs = rest[0][1]
+        rest = rest[1:]
+
+    rolling_summary = None
+    turns = []
+    for role, content in rest:
+        if role == SUMMARY_ROLE:
+            rolling_summary = content
+        else:
+            turns.append((role, content))
+    return initial_analysis, key_specs, rolling_summary, turns
+
+
+def essential_analysis(chat_history, max_tokens=CHAT_ANALYSIS_TOKENS):
+    """
+    Returns the part of the initial analysis sent with every chat turn. Short
+    analyses are sent whole; long ones are cut to the budget, led by the
+    user-facing summary, since it already holds the key specs.
+    """
+    initial_analysis, key_specs, _, _ = split_history(chat_history)
+    if estimate_tokens(initial_analysis) <= max_tokens:
+        return initial_analysis
+
+    key_specs = key_specs or ""
+    remaining = max_tokens - estimate_tokens(key_specs)
+    if remaining <= 0:
+        return _truncate(key_specs, max_tokens)
+    return f"{key_specs}\n\nDetails: {_truncate(initial_analysis, remaining)}".strip()
+
+
+def recent_turns(turns, max_tokens):
+    """Returns the longest suffix of turns that fits in max_tokens (at least the last one)."""
+    selected = []
+    used = 0
+    for role, content in reversed(turns):
+        cost = estimate_tokens(content)
+        if selected and used + cost > max_tokens:
+            break
+        selected.append((role, content))
+        used += cost
+    return list(reversed(selected))
+
+
+def needs_compaction(chat_history, budget=CHAT_CONTEXT_TOKENS, analysis_tokens=CHAT_ANALYSIS_TOKENS):
+    """True when the turns plus rolling summary no longer fit beside the analysis slice."""
+    _, key_specs, rolling_summary, turns = split_history(chat_history)
+    if len(turns) <= CHAT_RECENT_MESSAGES:
+        return False
+    used = sum(estimate_tokens(text or "") for text in (key_specs, rolling_summary))
+    used += sum(estimate_tokens(content) for _, content in turns)
+    return used > budget - analysis_tokens
+
+
+def compaction_plan(chat_history):
+    """
+    Returns (rolling_summary, turns_to_fold, turns_to_keep) for compacting a
+    history: every turn but the most recent CHAT_RECENT_MESSAGES is folded
+    into the rolling summary.
+    """
+    _, _, rolling_summary, turns = split_history(chat_history)
+    keep = max(CHAT_RECENT_MESSAGES, 1)
+    return rolling_summary, turns[:-keep], turns[-keep:]
+
+
+def compacted_history(chat_history, new_summary, kept_turns):
+    """Builds the history that replaces a session's history after compaction."""
+    _, key_specs, _, _ = split_history(chat_history)
+    head = [chat_history[0]] + ([("ai", key_specs)] if key_specs is not None else [])
+    return head + [(SUMMARY_ROLE, new_summary)] + list(kept_turns)
+
+
+def format_turns(turns):
+    names = {"human": "User", "ai": "Assistant"}
+    return "\n".join(f"{names.get(role, role)}: {content}" for role, content in turns)
@@ -0,0 +1,464 @@
+import os
+import math
+import time
+import uuid
+import heapq
+import asyncio
+import threading
+import traceback
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from dotenv import load_dotenv
+
+from agent import tracing
+from agent.model_client import MODEL_DEADLINE_SECONDS
+
+# --- 1. Configuration ---
+# /analyze runs each analysis as a job on a bounded, prioritised queue served
+# by a fixed pool of workers, so a burst of scans from a whole workstation
+# floor waits in line instead of starting one graph execution per request.
+# Clients either wait for the result as before, or get a job ID back at once
+# and poll /jobs/<id> or subscribe to /jobs/<id>/events. When the queue is
+# full, new jobs are refused with 429 and a Retry-After estimated from how
+# long recent jobs took.
+
+load_dotenv()
+
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "8"))
+JOB_QUEUE_SIZE = int(os.environ.get("JOB_QUEUE_SIZE", "64"))
+# How long finished jobs stay available at /jobs/<id>.
+JOB_TTL_SECONDS = float(os.environ.get("JOB_TTL_SECONDS", "600"))
+# How long a synchronous /analyze waits for its job before answering 202 with
+# the job ID instead. An analysis makes up to three model calls, each bounded
+# by MODEL_DEADLINE_SECONDS.
+JOB_WAIT_SECONDS = float(os.environ.get("JOB_WAIT_SECONDS", str(3 * MODEL_DEADLINE_SECONDS)))
+
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+CANCELLED_MESSAGE = "The analysis was cancelled."
+
+
+class QueueFullError(Exception):
+    """Raised by submit() when the queue is full; retry_after is the suggested wait in seconds."""
+    def __init__(self, retry_after):
+        super().__init__(f"The analysis queue is full. Please retry in {retry_after} s.")
+        self.retry_after = retry_after
+
+
+class Job:
+    """One queued analysis. `payload` is whatever the server's run function needs (the image)."""
+    def __init__(self, payload, priority, sequence):
+        self.id = uuid.uuid4().hex
+        self.payload = payload
+        self.priority = priority
+        self.sequence = sequence
+        self.state = QUEUED
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        self.cancel_requested = False
+        self.cancel_task = None  # Set by async workers: cancels the running analysis
+        # Stage events so far, ending with "done", "error" or "cancelled".
+        self.events = []
+        self.changed = threading.Condition()
+        self.subscribers = []  # (loop, asyncio.Event) per await_events() call waiting on this job
+        # Resolved with the job itself once it has finished.
+        self.future = Future()
+
+    def wait_events(self, after, timeout=None):
+        """Waits for events past index `after`; returns (new_events, finished)."""
+        with self.changed:
+            self.changed.wait_for(lambda: len(self.events) > after or self.state in FINISHED, timeout)
+            return self.events[after:], self.state in FINISHED
+
+    async def await_events(self, after, timeout=None):
+        """wait_events() for the async server: waits on the event loop instead of holding a thread."""
+        wakeup = asyncio.Event()
+        subscriber = (asyncio.get_running_loop(), wakeup)
+        with self.changed:
+            if len(self.events) > after or self.state in FINISHED:
+                return self.events[after:], self.state in FINISHED
+            self.subscribers.append(subscriber)
+        try:
+            await asyncio.wait_for(wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self.changed:
+                self.subscribers.remove(subscriber)
+        with self.changed:
+            return self.events[after:], self.state in FINISHED
+
+    def notify(self):
+        """Wakes everything waiting for this job's events. Call with `changed` held."""
+        self.changed.notify_all()
+        for loop, wakeup in self.subscribers:
+            loop.call_soon_threadsafe(wakeup.set)
+
+
+# --- 2. Queue ---
+
+class JobQueue:
+    """
+    Queued jobs are taken highest priority first, then oldest first. A job's
+    `run(job)` is a generator (or async generator) of the same (event,
+    payload) pairs as stream_analysis, ending with "done" and the response
+    body or "error" and {"error": message}. Every event is kept on the job
+    for /jobs/<id>/events and /analyze/stream, which replay them to
+    subscribers; status polling reports only the stages.
+    """
+    def __init__(self, workers=JOB_WORKERS, max_queued=JOB_QUEUE_SIZE, ttl=JOB_TTL_SECONDS):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.ttl = ttl
+        self.lock = threading.Condition()
+        self.heap = []  # (priority rank, sequence, job)
+        self.jobs = {}  # job_id -> Job, until ttl seconds after it finished
+        self.sequence = 0
+        self.queued = 0
+        self.running = 0
+        self.durations = deque(maxlen=50)
+        self.counts = {"submitted": 0, "rejected": 0, DONE: 0, FAILED: 0, CANCELLED: 0}
+        self.async_wakeups = []  # (loop, asyncio.Event) per event loop running async workers
+
+    def submit(self, payload, priority="normal"):
+        """Queues a job and returns it. Raises ValueError for an unknown priority and QueueFullError when full."""
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority '{priority}'. Expected one of: {', '.join(PRIORITIES)}.")
+        with self.lock:
+            self._prune()
+            if self.queued >= self.max_queued:
+                self.counts["rejected"] += 1
+                retry_after = self._retry_after()
+            else:
+                self.sequence += 1
+                job = Job(payload, priority, self.sequence)
+                heapq.heappush(self.heap, (PRIORITIES[priority], job.sequence, job))
+                self.jobs[job.id] = job
+                self.queued += 1
+                self.counts["submitted"] += 1
+                self.lock.notify()
+                for loop, wakeup in self.async_wakeups:
+                    loop.call_soon_threadsafe(wakeup.set)
+                retry_after = None
+        if retry_after is not None:
+            tracing.count("jobs_rejected")
+            raise QueueFullError(retry_after)
+        tracing.count("jobs_submitted", priority=priority)
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def cancel(self, job):
+        """
+        Cancels a job. A queued job is dropped at once; a running one stops at
+        its next stage (async workers cancel it immediately). Returns False if
+        it had already finished.
+        """
+        with self.lock:
+            if job.state in FINISHED or job.cancel_requested:
+                return job.state not in FINISHED
+            job.cancel_requested = True
+            queued = job.state == QUEUED
+            if queued:
+                self.queued -= 1
+                self.heap.remove((PRIORITIES[job.priority], job.sequence, job))
+                heapq.heapify(self.heap)
+            cancel_task = job.cancel_task
+        if queued:
+            self._finish(job, CANCELLED, error=CANCELLED_MESSAGE)
+        elif cancel_task is not None:
+            cancel_task()
+        return True
+
+    def take(self, timeout=None):
+        """Removes and returns the next queued job, marking it running; None if none arrives within timeout."""
+        with self.lock:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while True:
+                if self.heap:
+                    _, _, job = heapq.heappop(self.heap)
+                    job.state = RUNNING
+                    job.started_at = time.time()
+                    self.queued -= 1
+                    self.running += 1
+                    return job
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self.lock.wait(remaining)
+
+    def position(self, job):
+        """How many queued jobs will be taken before this one (0 is next)."""
+        with self.lock:
+            if job.state != QUEUED:
+                return None
+            key = (PRIORITIES[job.priority], job.sequence)
+            return sum(1 for rank, sequence, _ in self.heap if (rank, sequence) < key)
+
+    def _retry_after(self):
+        """Seconds until a queue slot is likely to free up: a slot frees each time one of the workers finishes a job."""
+        typical = sum(self.durations) / len(self.durations) if self.durations else 5.0
+        return max(1, math.ceil(typical / max(1, self.workers)))
+
+    def _prune(self):
+        cutoff = time.time() - self.ttl
+        for job_id in [job_id for job_id, job in self.jobs.items() if job.finished_at and job.finished_at < cutoff]:
+            del self.jobs[job_id]
+
+    def _publish(self, job, event, payload):
+        with job.changed:
+            job.events.append((event, payload))
+            job.notify()
+
+    def _finish(self, job, state, result=None, error=None):
+        with self.lock:
+            if job.state in FINISHED:
+                return
+            if job.state == RUNNING:
+                self.running -= 1
+                if state != CANCELLED:
+                    self.durations.append(time.time() - job.started_at)
+            self.counts[state] += 1
+            with job.changed:
+                job.state, job.result, job.error = state, result, error
+                job.finished_at = time.time()
+                job.payload = None  # The image isn't needed once the job has finished
+                if state == DONE:
+                    job.events.append(("done", result))
+                else:
+                    job.events.append(("cancelled" if state == CANCELLED else "error", {"error": error}))
+                job.notify()
+        tracing.count("jobs_finished", state=state)
+        if not job.future.done():
+            job.future.set_result(job)
+
+    def _handle(self, job, event, payload):
+        """Applies one event from a job's run; returns True once the job has finished."""
+        if job.cancel_requested:
+            self._finish(job, CANCELLED, error=CANCELLED_MESSAGE)
+        elif event == "done":
+            self._finish(job, DONE, result=payload)
+        elif event == "error":
+            self._finish(job, FAILED, error=payload["error"])
+        else:
+            self._publish(job, event, payload)
+        return job.state in FINISHED
+
+    def _failed(self, job, error):
+        print("--- UNHANDLED EXCEPTION IN ANALYSIS JOB ---")
+        traceback.print_exc()
+        print("------------------------------------")
+        self._finish(job, FAILED, error=f"An unexpected server error occurred: {error}")
+
+    # --- 3. Workers ---
+
+    def start_threads(self, run):
+        """Starts the worker pool as daemon threads (for the Flask servers)."""
+        for index in range(self.workers):
+            threading.Thread(target=self._thread_worker, args=(run,), name=f"job-worker-{index}", daemon=True).start()
+        print(f"Job queue started: {self.workers} workers, up to {self.max_queued} queued jobs.")
+
+    def _thread_worker(self, run):
+        while True:
+            job = self.take()
+            with tracing.span("job", priority=job.priority) as span:
+                span.set(job_id=job.id, wait_ms=round((job.started_at - job.created_at) * 1000, 1))
+                events = run(job)
+                try:
+                    for event, payload in events:
+                        if self._handle(job, event, payload):
+                            break
+                    else:
+                        self._finish(job, FAILED, error="The analysis ended without a result.")
+                except Exception as e:
+                    self._failed(job, e)
+                finally:
+                    events.close()
+                span.set(state=job.state)
+
+    def start_tasks(self, run):
+        """Starts the worker pool as tasks on the running event loop (for the async server)."""
+        loop = asyncio.get_running_loop()
+        wakeup = asyncio.Event()
+        with self.lock:
+            self.async_wakeups.append((loop, wakeup))
+        print(f"Job queue started: {self.workers} async workers, up to {self.max_queued} queued jobs.")
+        return [loop.create_task(self._task_worker(run, wakeup)) for _ in range(self.workers)]
+
+    async def _task_worker(self, run, wakeup):
+        while True:
+            wakeup.clear()
+            job = self.take(timeout=0)
+            if job is None:
+                await wakeup.wait()
+                continue
+            task = asyncio.ensure_future(self._run_async(job, run))
+            loop = asyncio.get_running_loop()
+            job.cancel_task = lambda: loop.call_soon_threadsafe(task.cancel)
+            if job.cancel_requested:
+                task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                if not (task.cancelled() and job.cancel_requested):
+                    raise
+            # A job cancelled before its task started never reached _run_async.
+            self._finish(job, CANCELLED, error=CANCELLED_MESSAGE)
+
+    async def _run_async(self, job, run):
+        with tracing.span("job", priority=job.priority) as span:
+            span.set(job_id=job.id, wait_ms=round((job.started_at - job.created_at) * 1000, 1))
+            events = run(job)
+            try:
+                async for event, payload in events:
+                    if self._handle(job, event, payload):
+                        break
+                else:
+                    self._finish(job, FAILED, error="The analysis ended without a result.")
+            except asyncio.CancelledError:
+                self._finish(job, CANCELLED, error=CANCELLED_MESSAGE)
+                if not job.cancel_requested:
+                    raise
+            except Exception as e:
+                self._failed(job, e)
+            finally:
+                await events.aclose()
+            span.set(state=job.state)
+
+    # --- 4. Reporting ---
+
+    def describe(self, job):
+        """The job's status as returned by /jobs/<id>."""
+        status = {"job_id": job.id, "status": job.state, "priority": job.priority,
+                  "stages": [payload for event, payload in job.events if event == "stage"]}
+        if job.state == QUEUED:
+            status["position"] = self.position(job)
+        elif job.state == RUNNING and job.cancel_requested:
+            status["cancel_requested"] = True
+        if job.started_at:
+            status["wait_ms"] = round((job.started_at - job.created_at) * 1000, 1)
+        if job.finished_at and job.started_at:
+            status["run_ms"] = round((job.finished_at - job.started_at) * 1000, 1)
+        if job.state == DONE:
+            status["result"] = job.result
+        elif job.error:
+            status["error"] = job.error
+        return status
+
+    def stats(self):
+        with self.lock:
+            durations = sorted(self.durations)
+            return {
+                "workers": self.workers,
+                "queued": self.queued,
+                "running": self.running,
+                "max_queued": self.max_queued,
+                **self.counts,
+                "run_ms_p50": round(durations[len(durations) // 2] * 1000, 1) if durations else None,
+            }
+
+
+def job_response(job):
+    """(body, status, headers) for a finished job, matching what /analyze returned before jobs."""
+    if job.state == DONE:
+        return job.result, 200, {}
+    if job.state == CANCELLED:
+        return {"error": job.error}, 409, {}
+    from agent.pipeline import analysis_error_status  # Imported here: the pipeline loads LangChain and OpenCV
+    status, headers = analysis_error_status(job.error)
+    return {"error": job.error}, status, headers
+
+
+def wants_async(data, headers):
+    """Whether an /analyze client asked for a job ID instead of waiting for the result."""
+    return bool(data.get("async")) or "respond-async" in headers.get("Prefer", "")
+
+
+# --- 5. Batches ---
+
+class JobBatch:
+    """
+    Runs a batch request's items as jobs on a JobQueue instead of beside it,
+    so a tray shares the workers, the priorities and the queue limit with
+    single scans. At most `window` of its items are queued or running at
+    once; the rest are submitted as those finish. Iterate it (with for or
+    async for) to get (index, job) as each item finishes; close() cancels
+    whatever hasn't run yet.
+    """
+    def __init__(self, queue, payloads, priority="low", window=8):
+        self.queue = queue
+        self.payloads = list(payloads)
+        self.priority = priority
+        self.window = max(1, window)
+        self.submitted = 0
+        self.pending = {}  # job.future -> (index, job)
+        self.retry_after = 1
+        self.closed = False
+
+    def start(self):
+        """Queues the first items. Raises QueueFullError (or ValueError for an unknown priority) if not even one fits."""
+        self._submit()
+        self._fill()
+        return self
+
+    def _submit(self):
+        job = self.queue.submit(self.payloads[self.submitted], self.priority)
+        self.pending[job.future] = (self.submitted, job)
+        self.submitted += 1
+
+    def _fill(self):
+        """Tops the window up. A full queue isn't an error here: the rest waits until a slot frees up."""
+        while not self.closed and self.submitted < len(self.payloads) and len(self.pending) < self.window:
+            try:
+                self._submit()
+            except QueueFullError as e:
+                self.retry_after = e.retry_after
+                return
+
+    def _collect(self, done):
+        finished = [self.pending.pop(future) for future in done]
+        self._fill()
+        return sorted(finished, key=lambda item: item[0])
+
+    def _unfinished(self):
+        return not self.closed and (self.pending or self.submitted < len(self.payloads))
+
+    def __iter__(self):
+        try:
+            while self._unfinished():
+                if not self.pending:  # The queue was full before any of ours got in
+                    time.sleep(self.retry_after)
+                    self._fill()
+                    continue
+                done, _ = wait(list(self.pending), return_when=FIRST_COMPLETED)
+                yield from self._collect(done)
+        finally:
+            self.close()
+
+    async def __aiter__(self):
+        try:
+            while self._unfinished():
+                if not self.pending:
+                    await asyncio.sleep(self.retry_after)
+                    self._fill()
+                    continue
+                waiters = {asyncio.wrap_future(future): future for future in self.pending}
+                done, _ = await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+                for item in self._collect(waiters[waiter] for waiter in done):
+                    yield item
+        finally:
+            self.close()
+
+    def close(self):
+        """Stops submitting and cancels the items still queued or running (a client that went away)."""
+        self.closed = True
+        for _, job in list(self.pending.values()):
+            self.queue.cancel(job)
+
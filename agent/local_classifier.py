@@ -0,0 +1,172 @@
+import os
+import json
+import time
+import base64
+import binascii
+import threading
+
+import cv2
+import numpy as np
+from dotenv import load_dotenv
+
+# --- 1. Configuration ---
+# An optional on-device classifier for the identify step. When a model file
+# is present and its top prediction is confident enough, the component type
+# is taken from it and the remote identify call is skipped entirely; below
+# the threshold the vision model decides as before. Train and export one
+# with train_classifier.py.
+
+load_dotenv()
+
+LOCAL_CLASSIFIER_ENABLED = os.environ.get("LOCAL_CLASSIFIER_ENABLED", "1") != "0"
+LOCAL_CLASSIFIER_PATH = os.environ.get("LOCAL_CLASSIFIER_PATH", os.path.join("models", "component_classifier.onnx"))
+# Minimum softmax probability for the local prediction to be used.
+LOCAL_CLASSIFIER_THRESHOLD = float(os.environ.get("LOCAL_CLASSIFIER_THRESHOLD", "0.85"))
+# "onnxruntime", "opencv", or "auto" (onnxruntime when installed). Quantised
+# models need onnxruntime; OpenCV's DNN module only runs float models.
+LOCAL_CLASSIFIER_BACKEND = os.environ.get("LOCAL_CLASSIFIER_BACKEND", "auto")
+
+# Defaults for the model's input, overridden by the metadata file written
+# next to the model (<model>.json) by train_classifier.py.
+DEFAULT_METADATA = {
+    "labels": ["Resistor", "Capacitor", "IC", "Transistor", "Diode", "LED", "PCB", "Other"],
+    "input_size": 224,
+    "mean": [0.485, 0.456, 0.406],
+    "std": [0.229, 0.224, 0.225],
+}
+
+
+# --- 2. Model ---
+
+def to_input(image, input_size=224, mean=DEFAULT_METADATA["mean"], std=DEFAULT_METADATA["std"]):
+    """
+    Converts a BGR image to the model's input: an RGB float32 NCHW batch of
+    one, resized to input_size and normalised per channel. Training uses this
+    same function, so the model sees identical pixels at both stages.
+    """
+    image = cv2.resize(image, (input_size, input_size), interpolation=cv2.INTER_AREA)
+    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB).astype(np.float32) / 255.0
+    image = (image - np.array(mean, dtype=np.float32)) / np.array(std, dtype=np.float32)
+    return image.transpose(2, 0, 1)[np.newaxis]
+
+
+def _softmax(logits):
+    exp = np.exp(logits - logits.max())
+    return exp / exp.sum()
+
+
+class LocalClassifier:
+    """
+    Runs an exported ONNX classifier on the CPU. The model takes one
+    normalised 3xNxN image and returns one logit per label.
+    """
+    def __init__(self, path=LOCAL_CLASSIFIER_PATH, backend=LOCAL_CLASSIFIER_BACKEND):
+        self.path = path
+        self.metadata = dict(DEFAULT_METADATA)
+        metadata_path = os.path.splitext(path)[0] + ".json"
+        if os.path.exists(metadata_path):
+            with open(metadata_path) as f:
+                self.metadata.update(json.load(f))
+        self.labels = self.metadata["labels"]
+        self.lock = threading.Lock()
+
+        if backend == "auto":
+            try:
+                import onnxruntime  # noqa: F401
+                backend = "onnxruntime"
+            except ImportError:
+                backend = "opencv"
+        self.backend = backend
+
+        if backend == "onnxruntime":
+            import onnxruntime
+            self.session = onnxruntime.InferenceSession(path, providers=["CPUExecutionProvider"])
+            self.input_name = self.session.get_inputs()[0].name
+        elif backend == "opencv":
+            self.net = cv2.dnn.readNetFromONNX(path)
+        else:
+            raise ValueError(f"Unknown local classifier backend '{backend}'. Expected 'onnxruntime', 'opencv' or 'auto'.")
+
+    def predict(self, image):
+        """Returns (label, probability) for a BGR image."""
+        blob = to_input(image, self.metadata["input_size"], self.metadata["mean"], self.metadata["std"])
+        if self.backend == "onnxruntime":
+            logits = self.session.run(None, {self.input_name: blob})[0][0]
+        else:
+            # cv2.dnn.Net keeps per-call state, so calls are serialised.
+            with self.lock:
+                self.net.setInput(blob)
+                logits = self.net.forward()[0]
+        probabilities = _softmax(logits.astype(np.float64))
+        best = int(probabilities.argmax())
+        return self.labels[best], float(probabilities[best])
+
+
+_classifier = None
+_classifier_lock = threading.Lock()
+_classifier_failed = False
+
+
+def get_classifier():
+    """Loads the classifier on first use. Returns None when disabled, missing or broken."""
+    global _classifier, _classifier_failed
+    if not LOCAL_CLASSIFIER_ENABLED or _classifier_failed:
+        return None
+    if _classifier is None:
+        with _classifier_lock:
+            if _classifier is None and not _classifier_failed:
+                if not os.path.exists(LOCAL_CLASSIFIER_PATH):
+                    _classifier_failed = True
+                    return None
+                try:
+                    _classifier = LocalClassifier()
+                    print(f"Local classifier loaded from {LOCAL_CLASSIFIER_PATH} ({_classifier.backend}, {len(_classifier.labels)} labels).")
+                except Exception as e:
+                    _classifier_failed = True
+                    print(f"Error loading local classifier: {e}")
+    return _classifier
+
+
+def model_fingerprint():
+    """Identifies the model file in use (for the analysis cache), or None without one."""
+    if not LOCAL_CLASSIFIER_ENABLED or not os.path.exists(LOCAL_CLASSIFIER_PATH):
+        return None
+    stat = os.stat(LOCAL_CLASSIFIER_PATH)
+    return f"{stat.st_size}-{int(stat.st_mtime)}-{LOCAL_CLASSIFIER_THRESHOLD}"
+
+
+def predict_component(base64_image):
+    """
+    Returns the local classifier's (label, confidence) for an image, however
+    unsure, or None when there is no classifier or the image can't be read.
+    """
+    classifier = get_classifier()
+    if classifier is None or not base64_image:
+        return None
+    try:
+        image = cv2.imdecode(np.frombuffer(base64.b64decode(base64_image), dtype=np.uint8), cv2.IMREAD_COLOR)
+    except (binascii.Error, ValueError):
+        return None
+    if image is None:
+        return None
+
+    start = time.perf_counter()
+    label, confidence = classifier.predict(image)
+    elapsed = (time.perf_counter() - start) * 1000
+    if confidence < LOCAL_CLASSIFIER_THRESHOLD:
+        print(f"Local classifier unsure ({label}, {confidence:.2f}, {elapsed:.1f} ms); asking the vision model.")
+    else:
+        print(f"Local classifier: {label} ({confidence:.2f}, {elapsed:.1f} ms).")
+    return label, confidence
+
+
+def classify_component(base64_image):
+    """
+    Returns the component type predicted by the local classifier, or None
+    when there is no classifier or its confidence is below the threshold,
+    in which case the remote identify call should be made.
+    """
+    prediction = predict_component(base64_image)
+    if prediction is None or prediction[1] < LOCAL_CLASSIFIER_THRESHOLD:
+        return None
+    return prediction[0]
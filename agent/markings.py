@@ -0,0 +1,187 @@
+import os
+import re
+import time
+import base64
+import binascii
+import threading
+
+import cv2
+import numpy as np
+from dotenv import load_dotenv
+
+from agent.parts_db import PartsDB
+from agent.schemas import ComponentAnalysis
+
+try:
+    import pytesseract
+except ImportError:
+    pytesseract = None
+
+# --- 1. Configuration ---
+# A local fast path for marked parts. The frame is read with Tesseract; an IC
+# whose marking resolves to a known part, or a capacitor with its value and
+# voltage printed on it, is analyzed without the detailed vision call.
+# Anything less certain goes to the vision model as before.
+
+load_dotenv()
+
+OCR_ENABLED = os.environ.get("OCR_ENABLED", "1") != "0"
+# Minimum Tesseract word confidence (0-100) for a word to be used.
+OCR_MIN_CONFIDENCE = float(os.environ.get("OCR_MIN_CONFIDENCE", "60"))
+# Minimum part-number match score (0-1) for a lookup to replace the vision call.
+PART_LOOKUP_MIN_SCORE = float(os.environ.get("PART_LOOKUP_MIN_SCORE", "0.9"))
+
+# Etched markings are upper-case letters, digits and a little punctuation.
+OCR_CONFIG = "--psm 6 -c tessedit_char_whitelist=ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-/.,unp"
+
+_CAPACITANCE = re.compile(r"(\d+(?:[.,]\d+)?)\s*([µu]F|nF|pF)", re.IGNORECASE)
+_VOLTAGE = re.compile(r"(\d+(?:[.,]\d+)?)\s*V(?![A-Z])", re.IGNORECASE)
+
+
+# --- 2. OCR ---
+
+_ocr_available = None
+
+
+def ocr_available():
+    """True when OCR is enabled and both pytesseract and the tesseract binary are installed."""
+    global _ocr_available
+    if _ocr_available is None:
+        _ocr_available = False
+        if OCR_ENABLED and pytesseract is not None:
+            try:
+                pytesseract.get_tesseract_version()
+                _ocr_available = True
+            except Exception as e:
+                print(f"Local OCR disabled: {e}")
+    return _ocr_available
+
+
+def _ocr_variants(image):
+    """
+    Yields grayscale versions of the frame to read. Laser-etched text is low
+    contrast and may be light-on-dark or dark-on-light, and ICs are often
+    placed upside down, so both polarities and both orientations are tried.
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    if gray.shape[0] < 600:
+        scale = 600 / gray.shape[0]
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)
+    gray = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8)).apply(gray)
+    for variant in (gray, cv2.bitwise_not(gray)):
+        yield variant
+        yield cv2.rotate(variant, cv2.ROTATE_180)
+
+
+def read_markings(image):
+    """
+    Reads the text on a component. Returns a list of (word, confidence)
+    pairs from the most confident reading, or [] when OCR is unavailable.
+    """
+    if not ocr_available():
+        return []
+
+    best, best_confidence = [], 0.0
+    for variant in _ocr_variants(image):
+        data = pytesseract.image_to_data(variant, config=OCR_CONFIG, output_type=pytesseract.Output.DICT)
+        words = [
+            (text.strip(), float(confidence))
+            for text, confidence in zip(data["text"], data["conf"])
+            if text.strip() and float(confidence) >= OCR_MIN_CONFIDENCE
+        ]
+        if words:
+            mean_confidence = sum(confidence for _, confidence in words) / len(words)
+            if mean_confidence * len(words) > best_confidence:
+                best, best_confidence = words, mean_confidence * len(words)
+    return best
+
+
+# --- 3. Marking Analysis ---
+
+_parts_db = None
+_parts_db_lock = threading.Lock()
+
+
+def get_parts_db():
+    global _parts_db
+    if _parts_db is None:
+        with _parts_db_lock:
+            if _parts_db is None:
+                _parts_db = PartsDB()
+    return _parts_db
+
+
+def fingerprint():
+    """Identifies what the local fast path would answer with (for the analysis cache)."""
+    if not ocr_available():
+        return None
+    return f"{get_parts_db().source_version()}-{PART_LOOKUP_MIN_SCORE}-{OCR_MIN_CONFIDENCE}"
+
+
+def _ic_analysis(words):
+    match = get_parts_db().lookup([word for word, _ in words])
+    if match is None:
+        return None
+    part, score, token = match
+    if score < PART_LOOKUP_MIN_SCORE:
+        print(f"Part lookup unsure ({token} ~ {part['part_number']}, {score:.2f}); asking the vision model.")
+        return None
+
+    print(f"Part lookup: {token} -> {part['part_number']} ({score:.2f}).")
+    other_words = [word for word, _ in words if word != token]
+    description = f"Identified from the marking '{token}' by local OCR and the parts index. {part.get('description') or ''}".strip()
+    if part.get("datasheet"):
+        description += f"\nDatasheet: {part['datasheet']}"
+    return ComponentAnalysis(
+        category="IC",
+        part_number=part["part_number"],
+        manufacturer=part.get("manufacturer"),
+        package=part.get("package"),
+        secondary_markings=" ".join(other_words) or None,
+        description=description,
+    )
+
+
+def _capacitor_analysis(words):
+    text = " ".join(word for word, _ in words)
+    capacitance, voltage = _CAPACITANCE.search(text), _VOLTAGE.search(text)
+    if not capacitance or not voltage:
+        return None
+
+    value = capacitance.group(1).replace(",", ".")
+    unit = capacitance.group(2)
+    unit = "µF" if unit[0] in "uUµ" else unit[0].lower() + "F"
+    print(f"Capacitor marking read locally: {value} {unit}, {voltage.group(1)} V.")
+    return ComponentAnalysis(
+        category="Capacitor",
+        capacitance=f"{value} {unit}",
+        voltage_rating=f"{voltage.group(1).replace(',', '.')} V",
+        secondary_markings=text,
+        description=f"Capacitance and voltage rating read from the printed marking '{text}' by local OCR.",
+    )
+
+
+# The analysis tools this fast path can stand in for.
+MARKING_ANALYZERS = {"analyze_ic": _ic_analysis, "analyze_capacitor": _capacitor_analysis}
+
+
+def analyze_markings(tool_name, base64_image):
+    """
+    Tries to analyze a component from its markings alone. Returns a
+    ComponentAnalysis when the result is confident enough to skip the vision
+    call for `tool_name`, otherwise None.
+    """
+    analyzer = MARKING_ANALYZERS.get(tool_name)
+    if analyzer is None or not base64_image or not ocr_available():
+        return None
+    try:
+        image = cv2.imdecode(np.frombuffer(base64.b64decode(base64_image), dtype=np.uint8), cv2.IMREAD_COLOR)
+    except (binascii.Error, ValueError):
+        return None
+    if image is None:
+        return None
+
+    start = time.perf_counter()
+    words = read_markings(image)
+    print(f"Local OCR read {[word for word, _ in words]} in {(time.perf_counter() - start) * 1000:.0f} ms.")
+    return analyzer(words) if words else None
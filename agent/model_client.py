@@ -0,0 +1,390 @@
+import os
+import time
+import random
+import asyncio
+import threading
+import contextvars
+from concurrent.futures import Future
+from dotenv import load_dotenv
+
+import httpx
+
+from agent import tracing
+
+# --- 1. Configuration ---
+# Every model call goes through a ResilientModel: an ordered list of
+# providers (Gemini and the DigitalOcean endpoint), each behind its own
+# circuit breaker. A call is retried with jittered exponential backoff on
+# timeouts, connection errors, 429s and 5xx responses, fails over to the
+# next provider when one is exhausted or its breaker is open, and never runs
+# past an overall deadline, so a provider hiccup costs bounded time instead
+# of hanging a worker.
+
+load_dotenv()
+
+# Per-attempt timeout handed to the HTTP clients.
+MODEL_TIMEOUT_SECONDS = float(os.environ.get("MODEL_TIMEOUT_SECONDS", "30"))
+# Overall budget for one call, across retries and providers.
+MODEL_DEADLINE_SECONDS = float(os.environ.get("MODEL_DEADLINE_SECONDS", "60"))
+# Retries per provider after the first attempt.
+MODEL_MAX_RETRIES = int(os.environ.get("MODEL_MAX_RETRIES", "2"))
+MODEL_BACKOFF_SECONDS = float(os.environ.get("MODEL_BACKOFF_SECONDS", "0.5"))
+MODEL_BACKOFF_MAX_SECONDS = float(os.environ.get("MODEL_BACKOFF_MAX_SECONDS", "8"))
+# Consecutive failures that open a provider's breaker, and how long it stays open.
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_SECONDS = float(os.environ.get("CIRCUIT_RESET_SECONDS", "30"))
+# Connections kept per pooled HTTP client (the OpenAI-compatible endpoint).
+MODEL_POOL_CONNECTIONS = int(os.environ.get("MODEL_POOL_CONNECTIONS", "20"))
+
+# Appears in the error of a call no provider could answer; the servers map it to 503.
+UNAVAILABLE_MESSAGE = "No model provider is available"
+
+
+class ModelUnavailableError(Exception):
+    """Raised when every provider failed, was skipped by its breaker, or the deadline ran out."""
+
+
+def is_retryable(error):
+    """
+    True for errors worth retrying: timeouts, connection errors, 408/409/425/429
+    and 5xx. Only these count against a provider's breaker; other errors move
+    straight on to the next provider.
+    """
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError, ConnectionError, httpx.TransportError)):
+        return True
+    if isinstance(error, (ValueError, TypeError, KeyError)):
+        return False  # A reply that couldn't be parsed: retrying won't help and the provider is up.
+    status = getattr(error, "status_code", None) or getattr(error, "code", None)
+    if not isinstance(status, int):
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return status in (408, 409, 425, 429) or status >= 500
+    # Unknown errors (SDK-specific network failures) are treated as transient.
+    return True
+
+
+def backoff_delay(attempt):
+    """Full-jitter exponential backoff: a random delay up to base * 2^attempt, capped."""
+    return random.uniform(0, min(MODEL_BACKOFF_MAX_SECONDS, MODEL_BACKOFF_SECONDS * 2 ** attempt))
+
+
+# --- 2. Circuit Breaker ---
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive failures and skips the provider for
+    `reset_seconds`; then lets one trial call through (half-open), which
+    closes it on success or re-opens it on failure.
+    """
+    def __init__(self, name, threshold=CIRCUIT_FAILURE_THRESHOLD, reset_seconds=CIRCUIT_RESET_SECONDS):
+        self.name = name
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.times_opened = 0
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.reset_seconds else "open"
+
+    def allow(self):
+        with self.lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            if self.opened_at is not None:
+                print(f"Circuit for {self.name} closed.")
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_in_flight or (self.opened_at is None and self.failures >= self.threshold):
+                if self.opened_at is None:
+                    self.times_opened += 1
+                print(f"Circuit for {self.name} opened after {self.failures} consecutive failures.")
+                self.opened_at = time.monotonic()
+            self.trial_in_flight = False
+
+    def release(self):
+        """Ends a half-open trial that failed for reasons unrelated to the provider's health."""
+        with self.lock:
+            self.trial_in_flight = False
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name):
+    """One breaker per provider, shared by every model built on it (e.g. plain and structured output)."""
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+
+# --- 3. Pooled HTTP Clients ---
+
+_http_clients = None
+_http_clients_lock = threading.Lock()
+
+
+def http_clients():
+    """
+    Returns the (sync, async) httpx clients shared by the OpenAI-compatible
+    models, so connections to the endpoint are kept alive and reused across
+    calls and threads up to MODEL_POOL_CONNECTIONS.
+    """
+    global _http_clients
+    if _http_clients is None:
+        with _http_clients_lock:
+            if _http_clients is None:
+                limits = httpx.Limits(max_connections=MODEL_POOL_CONNECTIONS, max_keepalive_connections=MODEL_POOL_CONNECTIONS)
+                timeout = httpx.Timeout(MODEL_TIMEOUT_SECONDS, connect=min(10.0, MODEL_TIMEOUT_SECONDS))
+                _http_clients = (httpx.Client(limits=limits, timeout=timeout), httpx.AsyncClient(limits=limits, timeout=timeout))
+    return _http_clients
+
+
+# --- 4. Resilient Model ---
+
+class ProviderStats:
+    def __init__(self):
+        self.calls = 0
+        self.successes = 0
+        self.failures = 0
+        self.retries = 0
+        self.failovers = 0
+
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def _provider_stats(name):
+    with _stats_lock:
+        if name not in _stats:
+            _stats[name] = ProviderStats()
+        return _stats[name]
+
+
+def _call_with_timeout(function, timeout):
+    """
+    Runs function() in its own thread and raises TimeoutError if it hasn't
+    returned within `timeout` seconds. Used when less of the deadline is left
+    than the HTTP client's own timeout; the abandoned call ends in the
+    background when that timeout fires.
+    """
+    future = Future()
+    context = contextvars.copy_context()
+
+    def run():
+        try:
+            future.set_result(context.run(function))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name="model-attempt", daemon=True).start()
+    try:
+        return future.result(timeout)
+    except TimeoutError:
+        if future.done():
+            raise
+        raise TimeoutError(f"Model call did not finish within the {timeout:.1f} s left before the deadline.") from None
+
+
+class ResilientModel:
+    """
+    Wraps LangChain chat models with retries, breakers, deadlines and
+    failover. Offers the subset of the chat model interface the agent uses:
+    invoke, ainvoke, stream, astream and with_structured_output.
+    `providers` is an ordered list of (name, chat_model) pairs.
+    """
+    def __init__(self, role, providers):
+        self.role = role
+        self.providers = [(name, model, get_breaker(name)) for name, model in providers]
+        if not self.providers:
+            raise ValueError(f"No providers configured for the {role} model.")
+
+    def with_structured_output(self, schema, **kwargs):
+        return ResilientModel(self.role, [(name, model.with_structured_output(schema, **kwargs)) for name, model, _ in self.providers])
+
+    def _start(self, index, name, breaker, attempt, deadline):
+        """Returns the time left for an attempt, or None if the provider should be skipped."""
+        if deadline - time.monotonic() <= 0 or not breaker.allow():
+            return None
+        stats = _provider_stats(name)
+        with _stats_lock:
+            stats.calls += 1
+            stats.retries += attempt > 0
+            stats.failovers += index > 0 and attempt == 0
+        tracing.count("provider_retries", attempt > 0, provider=name)
+        tracing.count("provider_failovers", index > 0 and attempt == 0, provider=name)
+        return deadline - time.monotonic()
+
+    def _succeeded(self, name, breaker):
+        breaker.record_success()
+        stats = _provider_stats(name)
+        with _stats_lock:
+            stats.successes += 1
+
+    def _failed(self, name, breaker, attempt, error, deadline):
+        """Records a failed attempt. Returns the backoff before retrying this provider, or None to move on."""
+        stats = _provider_stats(name)
+        with _stats_lock:
+            stats.failures += 1
+        retryable = is_retryable(error)
+        if retryable:
+            breaker.record_failure()
+        else:
+            breaker.release()
+        print(f"{self.role.capitalize()} model {name} failed (attempt {attempt + 1}): {type(error).__name__}: {error}")
+        if not retryable or attempt >= MODEL_MAX_RETRIES:
+            return None
+        delay = backoff_delay(attempt)
+        return delay if time.monotonic() + delay < deadline else None
+
+    def _unavailable(self, last_error):
+        detail = f"{type(last_error).__name__}: {last_error}" if last_error else "every circuit is open or the deadline passed"
+        return ModelUnavailableError(f"{UNAVAILABLE_MESSAGE} for the {self.role} model ({detail}).")
+
+    def invoke(self, messages, **kwargs):
+        deadline = time.monotonic() + MODEL_DEADLINE_SECONDS
+        last_error = None
+        for index, (name, model, breaker) in enumerate(self.providers):
+            for attempt in range(MODEL_MAX_RETRIES + 1):
+                remaining = self._start(index, name, breaker, attempt, deadline)
+                if remaining is None:
+                    break
+                try:
+                    with tracing.span("provider_attempt", provider=name) as span:
+                        span.set(attempt=attempt)
+                        if remaining < MODEL_TIMEOUT_SECONDS:
+                            result = _call_with_timeout(lambda: model.invoke(messages, **kwargs), remaining)
+                        else:
+                            result = model.invoke(messages, **kwargs)
+                except Exception as e:
+                    last_error = e
+                    delay = self._failed(name, breaker, attempt, e, deadline)
+                    if delay is None:
+                        break
+                    time.sleep(delay)
+                else:
+                    self._succeeded(name, breaker)
+                    return result
+        raise self._unavailable(last_error)
+
+    async def ainvoke(self, messages, **kwargs):
+        deadline = time.monotonic() + MODEL_DEADLINE_SECONDS
+        last_error = None
+        for index, (name, model, breaker) in enumerate(self.providers):
+            for attempt in range(MODEL_MAX_RETRIES + 1):
+                remaining = self._start(index, name, breaker, attempt, deadline)
+                if remaining is None:
+                    break
+                try:
+                    with tracing.span("provider_attempt", provider=name) as span:
+                        span.set(attempt=attempt)
+                        result = await asyncio.wait_for(model.ainvoke(messages, **kwargs), timeout=min(MODEL_TIMEOUT_SECONDS, remaining))
+                except asyncio.CancelledError:
+                    breaker.release()
+                    raise
+                except Exception as e:
+                    last_error = e
+                    delay = self._failed(name, breaker, attempt, e, deadline)
+                    if delay is None:
+                        break
+                    await asyncio.sleep(delay)
+                else:
+                    self._succeeded(name, breaker)
+                    return result
+        raise self._unavailable(last_error)
+
+    def stream(self, messages, **kwargs):
+        """Streams from the first provider that answers. Once chunks have been yielded, a failure is raised, not retried."""
+        deadline = time.monotonic() + MODEL_DEADLINE_SECONDS
+        last_error = None
+        for index, (name, model, breaker) in enumerate(self.providers):
+            for attempt in range(MODEL_MAX_RETRIES + 1):
+                if self._start(index, name, breaker, attempt, deadline) is None:
+                    break
+                started = False
+                try:
+                    with tracing.span("provider_attempt", provider=name) as span:
+                        span.set(attempt=attempt)
+                        for chunk in model.stream(messages, **kwargs):
+                            started = True
+                            yield chunk
+                except GeneratorExit:
+                    # The caller stopped reading; that says nothing about the provider.
+                    breaker.release()
+                    raise
+                except Exception as e:
+                    last_error = e
+                    delay = self._failed(name, breaker, attempt, e, deadline)
+                    if started:
+                        raise
+                    if delay is None:
+                        break
+                    time.sleep(delay)
+                else:
+                    self._succeeded(name, breaker)
+                    return
+        raise self._unavailable(last_error)
+
+    async def astream(self, messages, **kwargs):
+        deadline = time.monotonic() + MODEL_DEADLINE_SECONDS
+        last_error = None
+        for index, (name, model, breaker) in enumerate(self.providers):
+            for attempt in range(MODEL_MAX_RETRIES + 1):
+                if self._start(index, name, breaker, attempt, deadline) is None:
+                    break
+                started = False
+                try:
+                    with tracing.span("provider_attempt", provider=name) as span:
+                        span.set(attempt=attempt)
+                        async for chunk in model.astream(messages, **kwargs):
+                            started = True
+                            yield chunk
+                except (asyncio.CancelledError, GeneratorExit):
+                    breaker.release()
+                    raise
+                except Exception as e:
+                    last_error = e
+                    delay = self._failed(name, breaker, attempt, e, deadline)
+                    if started:
+                        raise
+                    if delay is None:
+                        break
+                    await asyncio.sleep(delay)
+                else:
+                    self._succeeded(name, breaker)
+                    return
+        raise self._unavailable(last_error)
+
+
+def model_client_stats():
+    """Per-provider call, failure, retry and failover counts, and each breaker's state."""
+    with _stats_lock:
+        stats = {name: dict(vars(s)) for name, s in _stats.items()}
+    with _breakers_lock:
+        breakers = dict(_breakers)
+    for name, breaker in breakers.items():
+        stats.setdefault(name, dict(vars(ProviderStats())))
+        stats[name]["circuit"] = breaker.state
+        stats[name]["times_opened"] = breaker.times_opened
+    return stats
@@ -0,0 +1,394 @@
+import os
+import re
+import json
+import time
+import threading
+from collections import deque
+from dotenv import load_dotenv
+
+from langchain_core.messages import BaseMessage
+
+from agent import tracing
+from agent.model_client import MODEL_TIMEOUT_SECONDS, ModelUnavailableError, ResilientModel, http_clients
+from agent.schemas import ComponentAnalysis, missing_fields, to_component_analysis
+
+# --- 1. Configuration ---
+# Each graph step has a route: models from cheapest to most capable, written
+# "<provider>:<model>" with provider "gemini" or "do" (the DigitalOcean
+# OpenAI-compatible endpoint, see models.txt). A step uses the first model and
+# escalates to the next only when the reply fails that step's validation
+# (wrong format, missing values, hedging). Chat routes can be specialised per
+# component category as "chat:<Category>". Override any route with the
+# MODEL_ROUTES JSON setting, e.g. {"summary": ["do:llama3.3-70b-instruct"]}.
+# Chat stays on DO_CHAT_MODEL unless a cheaper first model is routed in there,
+# e.g. {"chat": ["do:openai-gpt-4o-mini", "do:<DO_CHAT_MODEL>"]}.
+# Every call's latency, tokens and estimated cost are recorded per model.
+
+load_dotenv()
+
+api_base = os.environ.get("DO_API_BASE")
+do_api_key = os.environ.get("DO_API_KEY")
+gemini_api_key = os.environ.get("GOOGLE_API_KEY")
+chat_model = os.environ.get("DO_CHAT_MODEL")
+# Failover models on the other provider; set either to an empty string to disable failover.
+vision_fallback_model = os.environ.get("DO_VISION_MODEL", "openai-gpt-4o")
+chat_fallback_model = os.environ.get("CHAT_FALLBACK_MODEL", "gemini-1.5-flash")
+
+DEFAULT_ROUTES = {
+    "identify": ["gemini:gemini-1.5-flash", "do:openai-gpt-4o"],
+    "resistor": ["gemini:gemini-1.5-flash", "do:openai-gpt-4o"],
+    "capacitor": ["gemini:gemini-1.5-flash", "do:openai-gpt-4o"],
+    "ic": ["gemini:gemini-1.5-flash", "do:openai-gpt-4o"],
+    "generic": ["gemini:gemini-1.5-flash", "do:openai-gpt-4o"],
+    "combined": ["gemini:gemini-1.5-flash", "do:openai-gpt-4o"],
+    "summary": ["do:llama3-8b-instruct", "do:openai-gpt-4o-mini"],
+    "chat_summary": ["do:llama3-8b-instruct", "do:openai-gpt-4o-mini"],
+    "chat": [f"do:{chat_model}"],
+    "chat:IC": [f"do:{chat_model}"],
+    "chat:PCB": [f"do:{chat_model}"],
+}
+ROUTES = {**DEFAULT_ROUTES, **json.loads(os.environ.get("MODEL_ROUTES", "{}"))}
+
+# Steps that send an image; their models fail over to the vision model on the
+# other provider, and text steps to the chat fallback.
+VISION_STEPS = ("identify", "resistor", "capacitor", "ic", "generic", "combined")
+
+# Estimated USD per million (input, output) tokens, used for cost accounting
+# only. Override or extend with the MODEL_COSTS JSON setting.
+DEFAULT_COSTS = {
+    "gemini-1.5-flash": (0.075, 0.30),
+    "openai-gpt-4o": (2.50, 10.00),
+    "openai-gpt-4o-mini": (0.15, 0.60),
+    "openai-o3": (10.00, 40.00),
+    "openai-o3-mini": (1.10, 4.40),
+    "llama3-8b-instruct": (0.198, 0.198),
+    "llama3.3-70b-instruct": (0.65, 0.65),
+    "mistral-nemo-instruct-2407": (0.30, 0.30),
+    "alibaba-qwen3-32b": (0.25, 0.55),
+    "deepseek-r1-distill-llama-70b": (0.99, 0.99),
+    "anthropic-claude-3.5-haiku": (0.80, 4.00),
+    "anthropic-claude-3.5-sonnet": (3.00, 15.00),
+    "anthropic-claude-3.7-sonnet": (3.00, 15.00),
+    "anthropic-claude-3-opus": (15.00, 75.00),
+}
+MODEL_COSTS = {**DEFAULT_COSTS, **{name: tuple(cost) for name, cost in json.loads(os.environ.get("MODEL_COSTS", "{}")).items()}}
+
+CATEGORIES = ('Resistor', 'Capacitor', 'IC', 'Transistor', 'Diode', 'LED', 'PCB', 'Other')
+
+
+# --- 2. Validation ---
+# A step's reply is escalated to the next model in its route when its
+# validator returns a reason; None means the reply is good enough.
+
+_HEDGES = re.compile(r"cannot (?:be )?determine|can't determine|unable to|not possible to|not (?:clearly )?visible|unclear|illegible|too blurry", re.IGNORECASE)
+_ANALYSIS_VALUES = {
+    "resistor": re.compile(r"\d\s*(?:[kKmM]?\s*Ω|[kKmM]?\s*ohm)", re.IGNORECASE),
+    "capacitor": re.compile(r"\d\s*(?:[µunp]F|farad)", re.IGNORECASE),
+    "ic": re.compile(r"\b(?=[A-Z0-9-]*\d)(?=[A-Z0-9-]*[A-Z])[A-Z0-9-]{4,}\b"),
+}
+
+
+def _text(response):
+    return response.content if isinstance(getattr(response, "content", None), str) else ""
+
+
+def _validate_identify(response):
+    cleaned = _text(response).strip().replace("'", "").replace(".", "")
+    return None if cleaned.lower() in (c.lower() for c in CATEGORIES) else f"not a category: {cleaned[:40]!r}"
+
+
+def _validate_analysis(step):
+    def validate(response):
+        if not isinstance(response, BaseMessage):  # A parsed structured result (or None)
+            return _validate_structured(response if response is None else to_component_analysis(step, response))
+        text = _text(response)
+        if len(text) < 80:
+            return "reply too short"
+        pattern = _ANALYSIS_VALUES.get(step)
+        if pattern is not None and not pattern.search(text):
+            return f"no {step} value in the reply"
+        if len(_HEDGES.findall(text)) >= 2:
+            return "the reply hedges on the key values"
+        return None
+    return validate
+
+
+def _validate_structured(result: ComponentAnalysis):
+    if result is None:
+        return "no structured result"
+    missing = missing_fields(result)
+    if missing:
+        return f"missing {', '.join(missing)}"
+    return "the description hedges on the key values" if len(_HEDGES.findall(result.description)) >= 2 else None
+
+
+def _validate_summary(response):
+    text = _text(response)
+    return None if re.search(r"^\s*[-*•] ", text, re.MULTILINE) else "no bullet list"
+
+
+VALIDATORS = {
+    "identify": _validate_identify,
+    "resistor": _validate_analysis("resistor"),
+    "capacitor": _validate_analysis("capacitor"),
+    "ic": _validate_analysis("ic"),
+    "generic": _validate_analysis("generic"),
+    "combined": _validate_structured,
+    "summary": _validate_summary,
+}
+
+
+# --- 3. Models ---
+
+_models = {}
+_models_lock = threading.Lock()
+
+
+def _build_client(spec, **kwargs):
+    # The provider SDKs take most of the agent's import time, so each is only
+    # imported when the first model of that provider is built.
+    provider, _, name = spec.partition(":")
+    if provider == "gemini":
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        # Retries are handled by ResilientModel, so the client's own are turned off.
+        return ChatGoogleGenerativeAI(model=name, api_key=gemini_api_key, timeout=MODEL_TIMEOUT_SECONDS, max_retries=0, **kwargs)
+    if provider == "do":
+        from langchain_openai import ChatOpenAI
+        http_client, http_async_client = http_clients()
+        return ChatOpenAI(model=name, api_key=do_api_key, base_url=api_base, timeout=MODEL_TIMEOUT_SECONDS, max_retries=0,
+                          http_client=http_client, http_async_client=http_async_client, **kwargs)
+    raise ValueError(f"Unknown model provider in '{spec}'. Expected 'gemini:<model>' or 'do:<model>'.")
+
+
+def get_model(spec, vision):
+    """Returns the ResilientModel for a route entry, built on first use, with failover to the other provider."""
+    key = (spec, vision)
+    # A local, not _models[key] at the end: set_routes() may clear the dict meanwhile.
+    model = _models.get(key)
+    if model is None:
+        with _models_lock:
+            model = _models.get(key)
+            if model is None:
+                kwargs = {} if vision else {"temperature": 0.5}
+                failover = f"do:{vision_fallback_model}" if vision and vision_fallback_model else (
+                    f"gemini:{chat_fallback_model}" if not vision and chat_fallback_model else None)
+                providers = [(spec, _build_client(spec, **kwargs))]
+                if failover and failover != spec:
+                    providers.append((failover, _build_client(failover, **kwargs)))
+                model = _models[key] = ResilientModel("vision" if vision else "chat", providers)
+                print(f"Model {spec} initialized successfully.")
+    return model
+
+
+def route(step):
+    """The model list for a step, e.g. 'chat:IC' falls back to 'chat'."""
+    models = ROUTES.get(step) or ROUTES.get(step.split(":")[0])
+    if not models:
+        raise ValueError(f"No model route for step '{step}'.")
+    return models
+
+
+def set_routes(routes):
+    """Replaces the routing table (e.g. to point every step at a test server) and drops the built models."""
+    global ROUTES
+    with _models_lock:
+        ROUTES = dict(routes)
+        _models.clear()
+
+
+def routes_fingerprint():
+    """The routing table, for the analysis cache: changing a step's models invalidates its cached results."""
+    return {step: route(step) for step in sorted(ROUTES)}
+
+
+# --- 4. Accounting ---
+
+class ModelStats:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.escalations = 0  # Replies from this model that failed validation and were escalated
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cost_usd = 0.0
+        self.latencies = deque(maxlen=1000)
+
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def _usage(response):
+    usage = getattr(response, "usage_metadata", None) or {}
+    return usage.get("input_tokens", 0) or 0, usage.get("output_tokens", 0) or 0
+
+
+def _payload_bytes(messages):
+    """Approximate request size: the text and base64 image data sent."""
+    total = 0
+    for message in messages:
+        for part in message.content if isinstance(message.content, list) else [message.content]:
+            if isinstance(part, str):
+                total += len(part.encode("utf-8"))
+            elif isinstance(part, dict):
+                total += len(part.get("text", "").encode("utf-8")) + len(part.get("image_url", {}).get("url", ""))
+    return total
+
+
+def _record(step, spec, seconds, response=None, error=False, escalated=False):
+    model_name = spec.partition(":")[2]
+    input_tokens, output_tokens = _usage(response) if response is not None else (0, 0)
+    tracing.current_span().set(input_tokens=input_tokens, output_tokens=output_tokens, escalated=escalated, failed=error)
+    tracing.count("model_tokens", input_tokens, model=spec, direction="input")
+    tracing.count("model_tokens", output_tokens, model=spec, direction="output")
+    price_in, price_out = MODEL_COSTS.get(model_name, (0.0, 0.0))
+    with _stats_lock:
+        for key in (spec, f"step:{step}"):
+            stats = _stats.setdefault(key, ModelStats())
+            stats.calls += 1
+            stats.errors += error
+            stats.escalations += escalated
+            stats.input_tokens += input_tokens
+            stats.output_tokens += output_tokens
+            stats.cost_usd += (input_tokens * price_in + output_tokens * price_out) / 1e6
+            stats.latencies.append(seconds)
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else None
+
+
+def model_router_stats():
+    """Per-model and per-step calls, escalations, latency percentiles, tokens and estimated cost."""
+    with _stats_lock:
+        items = [(key, stats, list(stats.latencies)) for key, stats in _stats.items()]
+    report = {"models": {}, "steps": {}}
+    for key, stats, latencies in items:
+        entry = {
+            "calls": stats.calls, "errors": stats.errors, "escalations": stats.escalations,
+            "input_tokens": stats.input_tokens, "output_tokens": stats.output_tokens,
+            "cost_usd": round(stats.cost_usd, 6),
+            "latency_p50_ms": round(_percentile(latencies, 0.5) * 1000) if latencies else None,
+            "latency_p95_ms": round(_percentile(latencies, 0.95) * 1000) if latencies else None,
+        }
+        if key.startswith("step:"):
+            report["steps"][key[5:]] = entry
+        else:
+            report["models"][key] = entry
+    report["routes"] = routes_fingerprint()
+    return report
+
+
+# --- 5. Routed Calls ---
+
+def _routed(step, structured_schema=None):
+    """Yields (spec, model, validator, is_last) along a step's route."""
+    models = route(step)
+    vision = step.split(":")[0] in VISION_STEPS
+    validator = VALIDATORS.get(step.split(":")[0])
+    for index, spec in enumerate(models):
+        model = get_model(spec, vision)
+        if structured_schema is not None:
+            # Tool calling works the same on both providers, and a model that answers
+            # in prose instead leaves `parsed` empty rather than failing the call.
+            model = model.with_structured_output(structured_schema, method="function_calling", include_raw=True)
+        yield spec, model, validator, index == len(models) - 1
+
+
+def _accept(step, spec, seconds, response, validator, is_last):
+    """Records a reply and decides whether to keep it or escalate."""
+    reply = response["parsed"] if isinstance(response, dict) and "raw" in response else response
+    raw = response["raw"] if isinstance(response, dict) and "raw" in response else response
+    reason = validator(reply) if validator else None
+    _record(step, spec, seconds, raw, escalated=reason is not None and not is_last)
+    if reason is None or is_last:
+        return True, reply
+    print(f"Escalating {step} from {spec}: {reason}.")
+    return False, reply
+
+
+def invoke(step, messages, structured_schema=None, include_raw=False):
+    """
+    Runs `messages` on the step's route and returns the first reply that
+    passes validation (or the last model's reply). With `structured_schema`,
+    returns the parsed object (or None) instead of a message, or with
+    `include_raw` LangChain's {"raw", "parsed", "parsing_error"} dict, so a
+    reply that couldn't be parsed can still be used as text.
+    """
+    last_error = None
+    payload_bytes = _payload_bytes(messages)
+    for spec, model, validator, is_last in _routed(step, structured_schema):
+        with tracing.span("model_call", step=step, model=spec) as span:
+            span.set(payload_bytes=payload_bytes)
+            tracing.count("model_payload_bytes", payload_bytes, model=spec)
+            start = time.perf_counter()
+            try:
+                response = model.invoke(messages)
+            except ModelUnavailableError as e:
+                _record(step, spec, time.perf_counter() - start, error=True)
+                last_error = e
+                continue
+            accepted, reply = _accept(step, spec, time.perf_counter() - start, response, validator, is_last)
+        if accepted:
+            return response if include_raw and structured_schema is not None else reply
+    raise last_error
+
+
+async def ainvoke(step, messages, structured_schema=None, include_raw=False):
+    """Async counterpart of invoke."""
+    last_error = None
+    payload_bytes = _payload_bytes(messages)
+    for spec, model, validator, is_last in _routed(step, structured_schema):
+        with tracing.span("model_call", step=step, model=spec) as span:
+            span.set(payload_bytes=payload_bytes)
+            tracing.count("model_payload_bytes", payload_bytes, model=spec)
+            start = time.perf_counter()
+            try:
+                response = await model.ainvoke(messages)
+            except ModelUnavailableError as e:
+                _record(step, spec, time.perf_counter() - start, error=True)
+                last_error = e
+                continue
+            accepted, reply = _accept(step, spec, time.perf_counter() - start, response, validator, is_last)
+        if accepted:
+            return response if include_raw and structured_schema is not None else reply
+    raise last_error
+
+
+def stream(step, messages):
+    """Streams the reply of the step's first model; streamed replies can't be validated before they are shown."""
+    spec, model, _, _ = next(_routed(step))
+    with tracing.span("model_call", step=step, model=spec) as span:
+        payload_bytes = _payload_bytes(messages)
+        span.set(payload_bytes=payload_bytes, streamed=True)
+        tracing.count("model_payload_bytes", payload_bytes, model=spec)
+        start = time.perf_counter()
+        last = None
+        try:
+            for chunk in model.stream(messages):
+                last = chunk if last is None else last + chunk
+                yield chunk
+        except Exception:
+            _record(step, spec, time.perf_counter() - start, error=True)
+            raise
+        _record(step, spec, time.perf_counter() - start, last)
+
+
+async def astream(step, messages):
+    """Async counterpart of stream."""
+    spec, model, _, _ = next(_routed(step))
+    with tracing.span("model_call", step=step, model=spec) as span:
+        payload_bytes = _payload_bytes(messages)
+        span.set(payload_bytes=payload_bytes, streamed=True)
+        tracing.count("model_payload_bytes", payload_bytes, model=spec)
+        start = time.perf_counter()
+        last = None
+        try:
+            async for chunk in model.astream(messages):
+                last = chunk if last is None else last + chunk
+                yield chunk
+        except Exception:
+            _record(step, spec, time.perf_counter() - start, error=True)
+            raise
+        _record(step, spec, time.perf_counter() - start, last)
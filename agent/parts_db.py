@@ -0,0 +1,135 @@
+import os
+import csv
+import re
+import sqlite3
+import threading
+from difflib import SequenceMatcher
+from dotenv import load_dotenv
+
+# --- 1. Configuration ---
+# A local index of known part numbers, used to resolve OCR'd IC markings to a
+# manufacturer, description and datasheet without asking the vision model.
+# The index is an SQLite FTS5 table with the trigram tokenizer, so a lookup
+# finds candidates that share any three characters with the marking and a
+# similarity score picks the best. It is rebuilt from PARTS_CSV whenever the
+# CSV changes; add your own parts there.
+
+load_dotenv()
+
+PARTS_CSV = os.environ.get("PARTS_CSV", os.path.join("data", "parts.csv"))
+PARTS_DB_PATH = os.environ.get("PARTS_DB_PATH", os.path.join("cache", "parts.sqlite3"))
+# Candidates fetched from the index per OCR token before scoring.
+PARTS_CANDIDATES = 20
+
+# Characters OCR commonly confuses on etched text are folded together, on
+# both the marking and the stored part numbers, before comparing them.
+_CONFUSABLE = str.maketrans({"O": "0", "Q": "0", "D": "0", "I": "1", "L": "1", "S": "5", "B": "8", "Z": "2"})
+
+
+def normalize_part(text):
+    """Upper-cases, strips everything but letters and digits, and folds OCR look-alikes."""
+    return re.sub(r"[^A-Z0-9]", "", text.upper()).translate(_CONFUSABLE)
+
+
+def match_score(token, part):
+    """
+    Scores how well a normalised OCR token matches a normalised part number,
+    from 0 to 1. Markings usually carry a package or grade suffix (NE555P,
+    LM358N), so a token that starts with the whole part number scores high.
+    """
+    score = SequenceMatcher(None, token, part).ratio()
+    if len(part) >= 4 and token.startswith(part) and len(token) - len(part) <= 3:
+        score = max(score, 0.9 + 0.1 * len(part) / len(token))
+    return score
+
+
+class PartsDB:
+    """A read-mostly SQLite FTS5 index of part numbers. One connection per thread."""
+    def __init__(self, path=PARTS_DB_PATH, csv_path=PARTS_CSV):
+        self.path = path
+        self.csv_path = csv_path
+        self.local = threading.local()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._build_if_stale()
+
+    def _conn(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            self.local.conn = conn
+        return conn
+
+    def source_version(self):
+        """Identifies the CSV the index is built from (size and mtime)."""
+        if not os.path.exists(self.csv_path):
+            return "missing"
+        stat = os.stat(self.csv_path)
+        return f"{stat.st_size}-{int(stat.st_mtime)}"
+
+    def _build_if_stale(self):
+        conn = self._conn()
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        row = conn.execute("SELECT value FROM meta WHERE key = 'source_version'").fetchone()
+        version = self.source_version()
+        if row is not None and row[0] == version:
+            return
+
+        parts = []
+        if os.path.exists(self.csv_path):
+            with open(self.csv_path, newline="", encoding="utf-8") as f:
+                parts = list(csv.DictReader(f))
+        with conn:
+            conn.execute("DROP TABLE IF EXISTS parts")
+            conn.execute(
+                """CREATE VIRTUAL TABLE parts USING fts5(
+                       normalized, part_number UNINDEXED, manufacturer UNINDEXED, category UNINDEXED,
+                       package UNINDEXED, description UNINDEXED, datasheet UNINDEXED,
+                       tokenize = 'trigram'
+                   )"""
+            )
+            conn.executemany(
+                "INSERT INTO parts (normalized, part_number, manufacturer, category, package, description, datasheet) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (normalize_part(p["part_number"]), p["part_number"], p.get("manufacturer") or None, p.get("category") or None,
+                     p.get("package") or None, p.get("description") or None, p.get("datasheet") or None)
+                    for p in parts if p.get("part_number")
+                ],
+            )
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('source_version', ?)", (version,))
+        print(f"Parts index built from {self.csv_path} ({len(parts)} parts).")
+
+    def candidates(self, token):
+        """Returns index rows sharing at least one trigram with a normalised token."""
+        trigrams = {token[i:i + 3] for i in range(len(token) - 2)}
+        if not trigrams:
+            return []
+        query = " OR ".join(f'"{trigram}"' for trigram in sorted(trigrams))
+        return self._conn().execute(
+            "SELECT * FROM parts WHERE normalized MATCH ? ORDER BY rank LIMIT ?", (query, PARTS_CANDIDATES)
+        ).fetchall()
+
+    def lookup(self, tokens):
+        """
+        Finds the best-matching part for a list of OCR tokens. Returns
+        (part, score, token), where part is a dict of the part's fields, or
+        None if no token shares anything with the index.
+        """
+        best = None
+        for token in tokens:
+            normalized = normalize_part(token)
+            if len(normalized) < 3:
+                continue
+            for row in self.candidates(normalized):
+                score = match_score(normalized, row["normalized"])
+                if best is None or score > best[1]:
+                    best = (dict(row), score, token)
+        if best is not None:
+            best[0].pop("normalized", None)
+        return best
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM parts").fetchone()[0]
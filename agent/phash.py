@@ -0,0 +1,214 @@
+import os
+import base64
+import binascii
+import inspect
+import threading
+import functools
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+from dotenv import load_dotenv
+
+# --- 1. Configuration ---
+# A 64-bit dHash tolerates re-encoding and small shifts, but also can't tell
+# apart parts that differ only in colour bands or printed markings. Reusing a
+# near-duplicate's result is therefore only safe for the component type, so
+# only the identify tool is decorated; value-reading tools use the exact
+# content-hash analysis cache instead.
+
+load_dotenv()
+
+PHASH_ENABLED = os.environ.get("PHASH_ENABLED", "1") != "0"
+# Maximum Hamming distance (out of 64 bits) for two frames to count as the same part.
+PHASH_MAX_DISTANCE = int(os.environ.get("PHASH_MAX_DISTANCE", "6"))
+# Number of remembered frames per tool before the oldest are forgotten.
+PHASH_MAX_ENTRIES = int(os.environ.get("PHASH_MAX_ENTRIES", "256"))
+
+
+# --- 2. Perceptual Hashing ---
+
+def dhash(image, hash_size=8):
+    """
+    Computes a difference hash of an image as a Python int.
+
+    The image is converted to grayscale and shrunk to (hash_size + 1) x hash_size;
+    each bit records whether a pixel is brighter than its right-hand neighbour.
+    Re-encoding, small shifts and sensor noise barely change the result, so
+    two captures of the same part end up a few bits apart.
+    """
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(image, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int(np.packbits(bits).tobytes().hex(), 16)
+
+
+@functools.lru_cache(maxsize=16)
+def dhash_base64(base64_image, hash_size=8):
+    """
+    Computes the dHash of a base64-encoded image, or None if it cannot be decoded.
+    Memoised, because the identify and analyze tools see the same string.
+    """
+    try:
+        data = np.frombuffer(base64.b64decode(base64_image), dtype=np.uint8)
+    except (binascii.Error, ValueError, TypeError):
+        return None
+    image = cv2.imdecode(data, cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        return None
+    return dhash(image, hash_size)
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+# --- 3. BK-Tree Index ---
+
+class BKTree:
+    """
+    A Burkhard-Keller tree over integer hashes using Hamming distance.
+
+    A radius query only descends into children whose edge distance lies within
+    [d - radius, d + radius], so lookups touch a small fraction of the stored
+    hashes instead of scanning them all.
+    """
+    def __init__(self):
+        self.root = None  # [hash, {distance: child_node}]
+        self.size = 0
+
+    def add(self, value):
+        if self.root is None:
+            self.root = [value, {}]
+            self.size = 1
+            return
+        node = self.root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                return
+            child = node[1].get(distance)
+            if child is None:
+                node[1][distance] = [value, {}]
+                self.size += 1
+                return
+            node = child
+
+    def nearest(self, value, radius):
+        """Returns (hash, distance) of the closest stored hash within radius, or None."""
+        if self.root is None:
+            return None
+        best = None
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= radius and (best is None or distance < best[1]):
+                best = (node[0], distance)
+                if distance == 0:
+                    break
+            for edge, child in node[1].items():
+                if distance - radius <= edge <= distance + radius:
+                    stack.append(child)
+        return best
+
+
+class NearDuplicateIndex:
+    """
+    Maps perceptual hashes to previous results and answers "have we seen a
+    frame like this before?" within a Hamming distance.
+
+    Entries are kept in insertion order and the oldest are dropped above
+    `max_entries`. BK-trees don't support deletion, so the tree is rebuilt
+    from the surviving entries whenever that happens.
+    """
+    def __init__(self, max_distance=PHASH_MAX_DISTANCE, max_entries=PHASH_MAX_ENTRIES):
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.tree = BKTree()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, value):
+        with self.lock:
+            match = self.tree.nearest(value, self.max_distance)
+            if match is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(match[0])
+            return self.entries[match[0]]
+
+    def add(self, value, result):
+        with self.lock:
+            self.entries[value] = result
+            self.entries.move_to_end(value)
+            if len(self.entries) > self.max_entries:
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+                self.tree = BKTree()
+                for stored in self.entries:
+                    self.tree.add(stored)
+            else:
+                self.tree.add(value)
+
+
+# --- 4. Tool Decorator ---
+
+indexes = {}
+
+
+def near_duplicate_lookup(tool_name):
+    """
+    Decorates an image tool (sync or async) taking `base64_image` so that a frame
+    perceptually close to one seen before returns the earlier result without
+    calling the vision model. Each tool keeps its own index, shared by its sync
+    and async variants; API errors are never stored.
+    """
+    def decorator(func):
+        if not PHASH_ENABLED:
+            return func
+        index = indexes.setdefault(tool_name, NearDuplicateIndex())
+
+        def should_store(result):
+            failed = result is None or isinstance(result, dict) or (isinstance(result, str) and result.startswith("API_ERROR:"))
+            return not failed
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(base64_image, *args, **kwargs):
+                frame_hash = dhash_base64(base64_image)
+                if frame_hash is None:
+                    return await func(base64_image, *args, **kwargs)
+
+                previous = index.lookup(frame_hash)
+                if previous is not None:
+                    print(f"Near-duplicate frame found for '{tool_name}', reusing previous result.")
+                    return previous
+
+                result = await func(base64_image, *args, **kwargs)
+                if should_store(result):
+                    index.add(frame_hash, result)
+                return result
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(base64_image, *args, **kwargs):
+            frame_hash = dhash_base64(base64_image)
+            if frame_hash is None:
+                return func(base64_image, *args, **kwargs)
+
+            previous = index.lookup(frame_hash)
+            if previous is not None:
+                print(f"Near-duplicate frame found for '{tool_name}', reusing previous result.")
+                return previous
+
+            result = func(base64_image, *args, **kwargs)
+            if should_store(result):
+                index.add(frame_hash, result)
+            return result
+        return wrapper
+    return decorator
@@ -0,0 +1,377 @@
+import os
+import math
+import time
+import base64
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import cv2
+import numpy as np
+
+from agent import tracing
+from agent.cache import analysis_cache, is_cacheable
+from agent.model_client import CIRCUIT_RESET_SECONDS, UNAVAILABLE_MESSAGE
+from agent.single_flight import SINGLE_FLIGHT_ENABLED, flights, image_digest
+
+# Upper bound on graph executions running at once for a single batch request.
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", "8"))
+# Largest number of images accepted by one batch request.
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", "100"))
+
+
+def initial_state(image_data, image_b64=None):
+    """
+    Builds the graph's starting state. The image stays in memory and is
+    base64-encoded at most once; pass `image_b64` when the caller already has
+    the encoded form (e.g. straight from the request body) to skip even that.
+    """
+    if image_b64 is None:
+        image_b64 = base64.b64encode(image_data).decode('utf-8')
+    return {"image_bytes": image_data, "image_b64": image_b64}
+
+
+def run_analysis(langgraph_app, image_data, image_b64=None):
+    """
+    Runs one decoded image through the LangGraph agent and returns the final state.
+
+    Results are looked up in the analysis cache first, so re-scanning an
+    identical image returns immediately without contacting any model.
+    """
+    with tracing.span("analysis", path="invoke") as span:
+        if analysis_cache is not None:
+            start = time.perf_counter()
+            with tracing.span("cache_lookup"):
+                cached = analysis_cache.get(image_data)
+            span.set(cache_hit=cached is not None)
+            if cached is not None:
+                print(f"Analysis cache hit ({(time.perf_counter() - start) * 1000:.1f} ms).")
+                return cached
+
+        def execute():
+            final_state = langgraph_app.invoke(initial_state(image_data, image_b64))
+            if analysis_cache is not None and is_cacheable(final_state):
+                with tracing.span("cache_store"):
+                    analysis_cache.put(image_data, final_state)
+            return final_state
+
+        if SINGLE_FLIGHT_ENABLED:
+            final_state = flights.run(_flight_key(langgraph_app, image_data), execute)
+        else:
+            final_state = execute()
+        span.set(component_type=final_state.get("component_type"))
+        return final_state
+
+
+async def arun_analysis(langgraph_app, image_data, image_b64=None):
+    """
+    Async counterpart of run_analysis for graphs built with create_graph(use_async=True).
+    Cache I/O runs in worker threads so the event loop stays free while the
+    model calls are awaited.
+    """
+    with tracing.span("analysis", path="invoke") as span:
+        if analysis_cache is not None:
+            start = time.perf_counter()
+            with tracing.span("cache_lookup"):
+                cached = await asyncio.to_thread(analysis_cache.get, image_data)
+            span.set(cache_hit=cached is not None)
+            if cached is not None:
+                print(f"Analysis cache hit ({(time.perf_counter() - start) * 1000:.1f} ms).")
+                return cached
+
+        async def execute():
+            final_state = await langgraph_app.ainvoke(initial_state(image_data, image_b64))
+            if analysis_cache is not None and is_cacheable(final_state):
+                with tracing.span("cache_store"):
+                    await asyncio.to_thread(analysis_cache.put, image_data, final_state)
+            return final_state
+
+        if SINGLE_FLIGHT_ENABLED:
+            final_state = await flights.arun(_flight_key(langgraph_app, image_data), execute)
+        else:
+            final_state = await execute()
+        span.set(component_type=final_state.get("component_type"))
+        return final_state
+
+
+# --- Batch Analysis ---
+
+def crop_regions(image_data, boxes):
+    """
+    Cuts the regions given as [x, y, width, height] boxes out of one encoded
+    image and returns each crop re-encoded as JPEG bytes. Boxes are clipped to
+    the image; a box with no area after clipping raises ValueError.
+    """
+    image = cv2.imdecode(np.frombuffer(image_data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Could not decode the image.")
+
+    height, width = image.shape[:2]
+    crops = []
+    for box in boxes:
+        x, y, w, h = (int(v) for v in box)
+        x0, y0 = max(0, x), max(0, y)
+        x1, y1 = min(width, x + w), min(height, y + h)
+        if x1 <= x0 or y1 <= y0:
+            raise ValueError(f"Bounding box {box} lies outside the image.")
+        with tracing.span("jpeg_encode", source="crop"):
+            ok, buffer = cv2.imencode('.jpg', image[y0:y1, x0:x1])
+        if not ok:
+            raise ValueError(f"Could not encode the crop for bounding box {box}.")
+        crops.append(buffer.tobytes())
+    return crops
+
+
+def parse_batch_request(data):
+    """
+    Validates a batch request body and returns (images, boxes), where images
+    is a list of (image_bytes, image_b64) pairs ready for run_analysis.
+
+    The body is either {"images": [base64, ...]} or one image with regions,
+    {"image": base64, "boxes": [[x, y, width, height], ...]}. `boxes` is None
+    for the first form. Raises ValueError with a user-facing message.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("Request body must be a JSON object.")
+
+    if data.get("images") is not None:
+        encoded = data["images"]
+        if not isinstance(encoded, list) or not all(isinstance(image, str) and image for image in encoded):
+            raise ValueError("'images' must be a list of base64-encoded images.")
+        boxes = None
+    elif data.get("image") and data.get("boxes") is not None:
+        encoded, boxes = data["image"], data["boxes"]
+        if not isinstance(encoded, str):
+            raise ValueError("'image' must be a base64-encoded image.")
+        if not isinstance(boxes, list) or not all(_is_box(box) for box in boxes):
+            raise ValueError("'boxes' must be a list of [x, y, width, height] boxes of numbers.")
+    else:
+        raise ValueError("Provide either 'images' or 'image' together with 'boxes'.")
+
+    count = len(encoded) if boxes is None else len(boxes)
+    if not count:
+        raise ValueError("The batch is empty.")
+    if count > BATCH_MAX_ITEMS:
+        raise ValueError(f"A batch can contain at most {BATCH_MAX_ITEMS} images.")
+
+    if boxes is None:
+        images = [(base64.b64decode(image), image) for image in encoded]
+    else:
+        images = [(crop, None) for crop in crop_regions(base64.b64decode(encoded), boxes)]
+    return images, boxes
+
+
+def _is_box(box):
+    """True for [x, y, width, height] with four finite numbers (booleans and null don't count)."""
+    return (isinstance(box, (list, tuple)) and len(box) == 4
+            and all(isinstance(v, (int, float)) and not isinstance(v, bool) and math.isfinite(v) for v in box))
+
+
+def analysis_error_status(message):
+    """
+    Returns (status, headers) for a failed analysis: 503 with Retry-After when
+    no model provider could be reached, so clients back off, otherwise 500.
+    """
+    if UNAVAILABLE_MESSAGE in message:
+        return 503, {"Retry-After": str(int(CIRCUIT_RESET_SECONDS))}
+    return 500, {}
+
+
+def batch_item_result(index, final_state, error, boxes=None):
+    """Builds the per-item record streamed back by the batch endpoints."""
+    item = {"index": index}
+    if boxes is not None:
+        item["box"] = boxes[index]
+    if error is not None:
+        item["error"] = f"An unexpected server error occurred: {error}"
+        return item
+
+    summarized_analysis = final_state.get("analysis_result", "Error: No summary was generated.")
+    if "API_ERROR" in summarized_analysis or "Analysis Failed" in summarized_analysis:
+        item["error"] = summarized_analysis
+        return item
+
+    item["component_type"] = final_state.get("component_type")
+    item["raw_analysis"] = final_state.get("raw_analysis", "No detailed analysis was generated.")
+    item["analysis"] = summarized_analysis
+    return item
+
+
+def iter_batch(langgraph_app, images, max_workers=BATCH_CONCURRENCY):
+    """
+    Runs many (image_bytes, image_b64) pairs through the agent with at most `max_workers` graph
+    executions in flight and yields (index, final_state, error) as each one
+    finishes, in completion order. Closing the generator early (a client that
+    disconnected) drops the analyses that haven't started instead of waiting
+    for all of them.
+    """
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        futures = {
+            executor.submit(run_analysis, langgraph_app, image_data, image_b64): index
+            for index, (image_data, image_b64) in enumerate(images)
+        }
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except Exception as e:
+                yield futures[future], None, e
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def aiter_batch(langgraph_app, images, max_workers=BATCH_CONCURRENCY):
+    """Async counterpart of iter_batch; closing it early cancels the analyses still running or waiting."""
+    semaphore = asyncio.Semaphore(max_workers)
+
+    async def run_one(index, image_data, image_b64):
+        async with semaphore:
+            try:
+                return index, await arun_analysis(langgraph_app, image_data, image_b64), None
+            except Exception as e:
+                return index, None, e
+
+    tasks = [asyncio.ensure_future(run_one(index, image_data, image_b64)) for index, (image_data, image_b64) in enumerate(images)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+# --- Streaming Analysis ---
+# These generators yield (event, data) pairs: "stage" events as graph nodes
+# finish, "token" events while the summary is generated, then one "done"
+# event carrying the final state (or an "error" event).
+
+# Graph nodes whose completion is reported to the client, and what to say.
+STAGE_NODES = ("identifier", "single_call", "analyzer")
+# The node whose model tokens are forwarded to the client as they arrive.
+STREAMED_NODE = "summarizer"
+
+
+def _stage_event(node, update):
+    stage = {"stage": node}
+    if update.get("component_type"):
+        stage["component_type"] = update["component_type"]
+    if update.get("raw_analysis"):
+        stage["raw_analysis_ready"] = True
+    return stage
+
+
+def _token_text(message_chunk):
+    content = getattr(message_chunk, "content", "")
+    if isinstance(content, list):
+        content = "".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content)
+    return content
+
+
+def _flight_key(langgraph_app, image_data):
+    """Requests coalesce only when they would run the same graph (sync and async servers build their own)."""
+    return id(langgraph_app), image_digest(image_data)
+
+
+def stream_analysis(langgraph_app, image_data, image_b64=None):
+    """
+    Streaming counterpart of run_analysis. Summary tokens come from LangGraph's
+    "messages" stream mode, which switches the summarizer's chat model call
+    onto the provider's streaming API.
+    """
+    with tracing.span("analysis", path="stream") as span:
+        if analysis_cache is not None:
+            with tracing.span("cache_lookup"):
+                cached = analysis_cache.get(image_data)
+            span.set(cache_hit=cached is not None)
+            if cached is not None:
+                print("Analysis cache hit.")
+                yield "stage", {"stage": "cache", "component_type": cached.get("component_type")}
+                yield "done", cached
+                return
+
+        flight_key = _flight_key(langgraph_app, image_data)
+        flight, leader = flights.join(flight_key) if SINGLE_FLIGHT_ENABLED else (None, True)
+        if not leader:
+            # An identical image is already being analyzed; wait for its result instead of running the graph again.
+            yield "stage", {"stage": "coalesced"}
+            final_state = flights.wait(flight)
+            span.set(component_type=final_state.get("component_type"))
+            yield "done", final_state
+            return
+
+        try:
+            state = initial_state(image_data, image_b64)
+            final_state = dict(state)
+            for mode, chunk in langgraph_app.stream(state, stream_mode=["updates", "messages"]):
+                if mode == "messages":
+                    message_chunk, metadata = chunk
+                    if metadata.get("langgraph_node") == STREAMED_NODE:
+                        text = _token_text(message_chunk)
+                        if text:
+                            yield "token", {"text": text}
+                    continue
+                for node, update in chunk.items():
+                    final_state.update(update or {})
+                    if node in STAGE_NODES and update:
+                        yield "stage", _stage_event(node, update)
+            if analysis_cache is not None and is_cacheable(final_state):
+                with tracing.span("cache_store"):
+                    analysis_cache.put(image_data, final_state)
+        except BaseException as e:
+            if flight is not None:
+                flights.finish(flight_key, flight, error=e)
+            raise
+        if flight is not None:
+            flights.finish(flight_key, flight, result=final_state)
+        span.set(component_type=final_state.get("component_type"))
+        yield "done", final_state
+
+
+async def astream_analysis(langgraph_app, image_data, image_b64=None):
+    """Async counterpart of stream_analysis for graphs built with create_graph(use_async=True)."""
+    with tracing.span("analysis", path="stream") as span:
+        if analysis_cache is not None:
+            with tracing.span("cache_lookup"):
+                cached = await asyncio.to_thread(analysis_cache.get, image_data)
+            span.set(cache_hit=cached is not None)
+            if cached is not None:
+                print("Analysis cache hit.")
+                yield "stage", {"stage": "cache", "component_type": cached.get("component_type")}
+                yield "done", cached
+                return
+
+        flight_key = _flight_key(langgraph_app, image_data)
+        flight, leader = flights.join(flight_key) if SINGLE_FLIGHT_ENABLED else (None, True)
+        if not leader:
+            # An identical image is already being analyzed; wait for its result instead of running the graph again.
+            yield "stage", {"stage": "coalesced"}
+            final_state = await flights.await_result(flight)
+            span.set(component_type=final_state.get("component_type"))
+            yield "done", final_state
+            return
+
+        try:
+            state = initial_state(image_data, image_b64)
+            final_state = dict(state)
+            async for mode, chunk in langgraph_app.astream(state, stream_mode=["updates", "messages"]):
+                if mode == "messages":
+                    message_chunk, metadata = chunk
+                    if metadata.get("langgraph_node") == STREAMED_NODE:
+                        text = _token_text(message_chunk)
+                        if text:
+                            yield "token", {"text": text}
+                    continue
+                for node, update in chunk.items():
+                    final_state.update(update or {})
+                    if node in STAGE_NODES and update:
+                        yield "stage", _stage_event(node, update)
+            if analysis_cache is not None and is_cacheable(final_state):
+                with tracing.span("cache_store"):
+                    await asyncio.to_thread(analysis_cache.put, image_data, final_state)
+        except BaseException as e:
+            if flight is not None:
+                flights.finish(flight_key, flight, error=e)
+            raise
+        if flight is not None:
+            flights.finish(flight_key, flight, result=final_state)
+        span.set(component_type=final_state.get("component_type"))
+        yield "done", final_state
@@ -0,0 +1,148 @@
+import os
+import json
+import time
+import base64
+import binascii
+import functools
+
+import cv2
+import numpy as np
+from dotenv import load_dotenv
+
+from agent import tracing
+
+# --- 1. Configuration ---
+# Images are normalised before every vision call: cropped to the component,
+# shrunk to a maximum edge and re-encoded as JPEG. Webcam frames and phone
+# uploads are far larger than the model needs, and every extra byte costs
+# upload time and model latency.
+
+load_dotenv()
+
+PREPROCESS_ENABLED = os.environ.get("IMAGE_PREPROCESS_ENABLED", "1") != "0"
+
+# One profile per vision step. `max_edge` caps the longer side after cropping,
+# `quality` is the JPEG quality of the re-encode, and `crop` trims the frame to
+# the component plus `margin` (a fraction of the component's size) on each side.
+# Cropping happens before resizing, so a small SMD part keeps its native pixels
+# instead of being scaled down together with the empty background around it.
+PROFILES = {
+    "identify": {"max_edge": 768, "quality": 80, "crop": True, "margin": 0.25},
+    "resistor": {"max_edge": 1024, "quality": 85, "crop": True, "margin": 0.15},
+    "capacitor": {"max_edge": 1024, "quality": 85, "crop": True, "margin": 0.15},
+    "ic": {"max_edge": 1536, "quality": 90, "crop": True, "margin": 0.1},
+    "generic": {"max_edge": 1024, "quality": 85, "crop": True, "margin": 0.15},
+    "combined": {"max_edge": 1536, "quality": 90, "crop": True, "margin": 0.1},
+}
+# Per-profile overrides as JSON, e.g. IMAGE_PROFILES='{"ic": {"max_edge": 2048}}'.
+for _name, _overrides in json.loads(os.environ.get("IMAGE_PROFILES", "{}")).items():
+    PROFILES[_name] = {**PROFILES.get(_name, PROFILES["generic"]), **_overrides}
+
+# Crops covering more than this fraction of the frame are not worth making.
+CROP_MAX_AREA = 0.85
+# Crops with a side shorter than this many pixels are treated as noise.
+CROP_MIN_SIDE = 32
+
+
+# --- 2. Normalisation ---
+
+def component_box(image, margin=0.15):
+    """
+    Finds the component in a frame and returns its (x, y, width, height) box
+    with `margin` added on every side, or None if there is nothing worth cropping.
+
+    Edges are found with Canny and dilated so a part's body, leads and
+    markings merge into a few blobs; the box covers the largest blob and any
+    blob at least a fifth of its size, so leads are not cut off.
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    gray = cv2.GaussianBlur(gray, (5, 5), 0)
+    edges = cv2.dilate(cv2.Canny(gray, 50, 150), None, iterations=2)
+    contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return None
+
+    areas = [cv2.contourArea(contour) for contour in contours]
+    largest = max(areas)
+    points = np.concatenate([contour for contour, area in zip(contours, areas) if area >= largest / 5])
+    x, y, w, h = cv2.boundingRect(points)
+
+    height, width = image.shape[:2]
+    pad_x, pad_y = int(w * margin), int(h * margin)
+    x0, y0 = max(0, x - pad_x), max(0, y - pad_y)
+    x1, y1 = min(width, x + w + pad_x), min(height, y + h + pad_y)
+    if min(x1 - x0, y1 - y0) < CROP_MIN_SIDE or (x1 - x0) * (y1 - y0) > CROP_MAX_AREA * width * height:
+        return None
+    return x0, y0, x1 - x0, y1 - y0
+
+
+def normalize_image(image_data, max_edge=1024, quality=85, crop=True, margin=0.15):
+    """
+    Crops, resizes and re-encodes one encoded image. Returns (jpeg_bytes, info),
+    where info records the sizes before and after. Images are never upscaled,
+    and the original bytes are returned when the re-encode would not be smaller.
+    Raises ValueError if the image cannot be decoded.
+    """
+    image = cv2.imdecode(np.frombuffer(image_data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Could not decode the image.")
+
+    height, width = image.shape[:2]
+    info = {"bytes_in": len(image_data), "size_in": (width, height), "cropped": False}
+
+    box = component_box(image, margin) if crop else None
+    if box is not None:
+        x, y, w, h = box
+        image = image[y:y + h, x:x + w]
+        info["cropped"] = True
+
+    h, w = image.shape[:2]
+    scale = max_edge / max(h, w)
+    if scale < 1:
+        image = cv2.resize(image, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+
+    with tracing.span("jpeg_encode", source="normalize"):
+        ok, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError("Could not encode the image.")
+    output = buffer.tobytes()
+    if len(output) >= len(image_data) and box is None and scale >= 1:
+        output = image_data
+        image = None
+
+    info["bytes_out"] = len(output)
+    info["size_out"] = (image.shape[1], image.shape[0]) if image is not None else info["size_in"]
+    return output, info
+
+
+@functools.lru_cache(maxsize=16)
+def _prepare_cached(base64_image, profile):
+    start = time.perf_counter()
+    try:
+        with tracing.span("image_normalize", profile=profile):
+            image_data = base64.b64decode(base64_image)
+            output, info = normalize_image(image_data, **PROFILES[profile])
+    except (binascii.Error, ValueError) as e:
+        print(f"Image normalisation skipped ({profile}): {e}")
+        return base64_image
+
+    elapsed = (time.perf_counter() - start) * 1000
+    print(f"Image normalised for {profile}: {info['bytes_in'] / 1024:.1f} KB -> {info['bytes_out'] / 1024:.1f} KB, "
+          f"{info['size_in'][0]}x{info['size_in'][1]} -> {info['size_out'][0]}x{info['size_out'][1]}"
+          f"{' (cropped)' if info['cropped'] else ''}, {elapsed:.1f} ms")
+    if output is image_data:
+        return base64_image
+    return base64.b64encode(output).decode('utf-8')
+
+
+def prepare_image(base64_image, profile="generic"):
+    """
+    Returns the base64 image normalised with the named profile. Memoised,
+    because each node of one analysis asks for the same image, and retries of
+    the same request ask for the same profile.
+    """
+    if not PREPROCESS_ENABLED or not base64_image:
+        return base64_image
+    if profile not in PROFILES:
+        profile = "generic"
+    return _prepare_cached(base64_image, profile)
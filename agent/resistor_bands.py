@@ -0,0 +1,294 @@
+import os
+import base64
+import binascii
+
+import cv2
+import numpy as np
+from dotenv import load_dotenv
+
+from agent import tracing
+from agent.schemas import ComponentAnalysis
+
+# --- 1. Configuration ---
+# A local decoder for through-hole resistor colour bands. The body is found
+# against the background, straightened, and read as one row of colours: the
+# bands are the runs of columns that differ from the body colour. Readings
+# that are clear and land on a standard E-series value are used directly;
+# anything else goes to the vision model.
+
+load_dotenv()
+
+RESISTOR_DECODER_ENABLED = os.environ.get("RESISTOR_DECODER_ENABLED", "1") != "0"
+# Minimum decoder confidence (0-1) for the reading to replace the vision call.
+RESISTOR_DECODER_MIN_CONFIDENCE = float(os.environ.get("RESISTOR_DECODER_MIN_CONFIDENCE", "0.6"))
+
+# Working size of the longer image edge; bands stay several pixels wide.
+WORK_EDGE = 480
+# Lab distance from the background colour for a pixel to count as the part.
+BACKGROUND_DISTANCE = 28.0
+# Lab distance from the body colour for a column to count as a band.
+BAND_DISTANCE = 20.0
+
+# name: (reference BGR, digit, multiplier, tolerance)
+BAND_COLOURS = {
+    "black":  ((25, 25, 25), 0, 1, None),
+    "brown":  ((30, 55, 110), 1, 10, "±1%"),
+    "red":    ((40, 40, 200), 2, 100, "±2%"),
+    "orange": ((20, 120, 240), 3, 1e3, None),
+    "yellow": ((30, 215, 235), 4, 1e4, None),
+    "green":  ((50, 150, 40), 5, 1e5, "±0.5%"),
+    "blue":   ((200, 90, 30), 6, 1e6, "±0.25%"),
+    "violet": ((150, 50, 130), 7, 1e7, "±0.1%"),
+    "grey":   ((125, 125, 125), 8, 1e8, "±0.05%"),
+    "white":  ((240, 240, 240), 9, 1e9, None),
+    "gold":   ((50, 150, 195), None, 0.1, "±5%"),
+    "silver": ((185, 185, 185), None, 0.01, "±10%"),
+}
+_NAMES = list(BAND_COLOURS)
+_REFERENCE_LAB = cv2.cvtColor(
+    np.array([[colour for colour, _, _, _ in BAND_COLOURS.values()]], dtype=np.uint8), cv2.COLOR_BGR2LAB
+)[0].astype(np.float32)
+
+# Standard resistor values (mantissas). Four-band parts use E24; five-band
+# parts are usually E96, with E24 values also common.
+E24 = (10, 11, 12, 13, 15, 16, 18, 20, 22, 24, 27, 30, 33, 36, 39, 43, 47, 51, 56, 62, 68, 75, 82, 91)
+E96 = (100, 102, 105, 107, 110, 113, 115, 118, 121, 124, 127, 130, 133, 137, 140, 143, 147, 150, 154, 158,
+       162, 165, 169, 174, 178, 182, 187, 191, 196, 200, 205, 210, 215, 221, 226, 232, 237, 243, 249, 255,
+       261, 267, 274, 280, 287, 294, 301, 309, 316, 324, 332, 340, 348, 357, 365, 374, 383, 392, 402, 412,
+       422, 432, 442, 453, 464, 475, 487, 499, 511, 523, 536, 549, 562, 576, 590, 604, 619, 634, 649, 665,
+       681, 698, 715, 732, 750, 768, 787, 806, 825, 845, 866, 887, 909, 931, 953, 976)
+_STANDARD_2 = set(E24)
+_STANDARD_3 = set(E96) | {value * 10 for value in E24}
+
+
+# --- 2. Body Segmentation ---
+
+def _white_balance(image):
+    """Grey-world correction using the frame border, which is assumed to be background."""
+    border = np.concatenate([image[:4].reshape(-1, 3), image[-4:].reshape(-1, 3),
+                             image[:, :4].reshape(-1, 3), image[:, -4:].reshape(-1, 3)]).astype(np.float32)
+    background = np.median(border, axis=0)
+    gains = background.mean() / np.maximum(background, 1.0)
+    if gains.max() / gains.min() > 1.6:
+        return image  # Strongly coloured background: correcting would distort the bands.
+    return np.clip(image.astype(np.float32) * gains, 0, 255).astype(np.uint8)
+
+
+def _part_points(mask):
+    """
+    Returns the outline points of the largest blob and any sizeable pieces
+    next to it; a band close to the background colour can split the body in two.
+    """
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return None, 0.0
+    areas = [cv2.contourArea(contour) for contour in contours]
+    largest = max(areas)
+    return np.vstack([contour for contour, area in zip(contours, areas) if area >= 0.1 * largest]), largest
+
+
+def find_body(image):
+    """
+    Returns the resistor body rotated to horizontal as a BGR array, or None.
+    The part (body and leads) is straightened along its long axis; the body
+    is then the span of columns where the part is close to its full
+    thickness, which leaves out the thin leads.
+    """
+    lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB).astype(np.float32)
+    border = np.concatenate([lab[:4].reshape(-1, 3), lab[-4:].reshape(-1, 3), lab[:, :4].reshape(-1, 3), lab[:, -4:].reshape(-1, 3)])
+    distance = np.linalg.norm(lab - np.median(border, axis=0), axis=2)
+    mask = (distance > BACKGROUND_DISTANCE).astype(np.uint8) * 255
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, np.ones((3, 3), np.uint8))
+
+    part, area = _part_points(mask)
+    if part is None or area < 0.002 * image.shape[0] * image.shape[1]:
+        return None
+    (cx, cy), (w, h), angle = cv2.minAreaRect(part)
+    if w < h:
+        w, h, angle = h, w, angle + 90
+    size = (int(w) + 2, int(h) + 2)
+    rotation = cv2.getRotationMatrix2D((cx, cy), angle, 1.0)
+    shape = (image.shape[1], image.shape[0])
+    straight = cv2.getRectSubPix(cv2.warpAffine(image, rotation, shape, borderMode=cv2.BORDER_REPLICATE), size, (cx, cy))
+    straight_mask = cv2.getRectSubPix(cv2.warpAffine(mask, rotation, shape), size, (cx, cy)) > 127
+
+    # Bands close to the background colour (white on a white desk) leave
+    # holes in the mask, but not in the span of full-thickness columns.
+    thickness = straight_mask.sum(axis=0)
+    columns = np.flatnonzero(thickness > 0.6 * np.percentile(thickness, 95))
+    if len(columns) == 0:
+        return None
+    x0, x1 = columns[0], columns[-1] + 1
+    rows = np.flatnonzero(straight_mask[:, x0:x1].mean(axis=1) > 0.5)
+    if len(rows) == 0:
+        return None
+    y0, y1 = rows[0], rows[-1] + 1
+    if x1 - x0 < 24 or y1 - y0 < 6 or (x1 - x0) / (y1 - y0) < 1.5:
+        return None
+    return straight[y0:y1, x0:x1]
+
+
+# --- 3. Band Reading ---
+
+def _runs(flags):
+    """Returns [start, end) index pairs of the True runs in a 1-D boolean array."""
+    edges = np.diff(np.concatenate(([0], flags.astype(np.int8), [0])))
+    return list(zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)))
+
+
+def read_bands(body):
+    """
+    Splits a horizontal body image into bands. Returns a list of
+    (colour_name, margin, start, end), where margin (0-1) is how much closer
+    the band is to its colour than to the next-best one.
+    """
+    height, width = body.shape[:2]
+    # The middle rows avoid the highlight and shadow along the body's edges.
+    strip = cv2.cvtColor(body[int(height * 0.3):int(height * 0.7) + 1], cv2.COLOR_BGR2LAB).astype(np.float32)
+    profile = np.median(strip, axis=0)
+    trim = max(1, int(width * 0.03))
+    profile = profile[trim:width - trim]
+
+    body_colour = np.median(profile, axis=0)
+    differs = np.linalg.norm(profile - body_colour, axis=1) > BAND_DISTANCE
+    differs = cv2.medianBlur(differs.astype(np.uint8).reshape(1, -1) * 255, 3).ravel() > 0
+
+    min_width = max(2, int(len(profile) * 0.025))
+    bands = []
+    for start, end in _runs(differs):
+        if end - start < min_width:
+            continue
+        inner = profile[start + (end - start) // 4:end - (end - start) // 4 or end]
+        colour = np.median(inner, axis=0)
+        distances = np.linalg.norm(_REFERENCE_LAB - colour, axis=1)
+        order = np.argsort(distances)
+        margin = float(1 - distances[order[0]] / max(distances[order[1]], 1e-6))
+        bands.append((_NAMES[order[0]], margin, start + trim, end + trim))
+    return bands
+
+
+def _format_ohms(ohms):
+    for limit, unit in ((1e9, "GΩ"), (1e6, "MΩ"), (1e3, "kΩ")):
+        if ohms >= limit:
+            return f"{ohms / limit:g} {unit}"
+    return f"{round(ohms, 2):g} Ω"
+
+
+def _decode(names):
+    """Decodes band colours read left to right. Returns (ohms, tolerance, standard) or None if invalid."""
+    count = len(names)
+    if count not in (3, 4, 5, 6):
+        return None
+    digit_count = 3 if count >= 5 else 2
+    digits = [BAND_COLOURS[name][1] for name in names[:digit_count]]
+    if any(digit is None for digit in digits) or digits[0] == 0:
+        return None
+    multiplier = BAND_COLOURS[names[digit_count]][2]
+    if count == 3:
+        tolerance = "±20%"
+    else:
+        tolerance = BAND_COLOURS[names[digit_count + 1]][3]
+        if tolerance is None:
+            return None
+    mantissa = int("".join(str(digit) for digit in digits))
+    standard = mantissa in (_STANDARD_3 if digit_count == 3 else _STANDARD_2)
+    return mantissa * multiplier, tolerance, standard
+
+
+def decode_resistor(image):
+    """
+    Decodes a resistor's colour bands from a BGR image. Returns a dict with
+    ohms, resistance, tolerance, bands and confidence (0-1), or None if no
+    banded body could be found.
+    """
+    scale = WORK_EDGE / max(image.shape[:2])
+    if scale < 1:
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    body = find_body(_white_balance(image))
+    if body is None:
+        return None
+    bands = read_bands(body)
+    if len(bands) < 3:
+        return None
+
+    # The tolerance band sits at one end, usually set apart by a wider gap;
+    # read both directions and keep the more plausible one. On six-band parts
+    # the temperature coefficient band comes after it, so the checks look at
+    # the tolerance band's position rather than the last band.
+    candidates = []
+    for ordered in (bands, bands[::-1]):
+        names = [name for name, _, _, _ in ordered]
+        decoded = _decode(names)
+        if decoded is None:
+            continue
+        ohms, tolerance, standard = decoded
+        score = 1.0 if standard else 0.5
+        if len(ordered) >= 4:
+            tolerance_index = 4 if len(ordered) >= 5 else 3
+            gaps = [abs(b[2] - a[3]) if ordered is bands else abs(a[2] - b[3]) for a, b in zip(ordered, ordered[1:])]
+            if gaps[tolerance_index - 1] >= max(gaps[:tolerance_index - 1]):
+                score += 0.25
+            if names[tolerance_index] in ("gold", "silver"):
+                score += 0.25
+        candidates.append((score, names, ohms, tolerance, standard))
+    if not candidates:
+        return None
+
+    candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+    score, names, ohms, tolerance, standard = candidates[0]
+    # Both directions equally plausible (and different) means we can't tell which end is which.
+    ambiguous = len(candidates) > 1 and candidates[1][0] == score and candidates[1][2] != ohms
+    margins = [margin for _, margin, _, _ in bands]
+    confidence = float(np.clip(min(margins) * 2, 0, 1)) * (1.0 if standard else 0.5) * (0.5 if ambiguous else 1.0)
+    if len(names) == 3:
+        confidence *= 0.5  # Three-band parts are rare; more often a band was missed.
+    return {
+        "ohms": ohms,
+        "resistance": _format_ohms(ohms),
+        "tolerance": tolerance,
+        "bands": names,
+        "confidence": round(confidence, 3),
+    }
+
+
+# --- 4. Fast Path ---
+
+def fingerprint():
+    """Identifies what the decoder would answer with (for the analysis cache)."""
+    if not RESISTOR_DECODER_ENABLED:
+        return None
+    return f"{RESISTOR_DECODER_MIN_CONFIDENCE}-{BACKGROUND_DISTANCE}-{BAND_DISTANCE}"
+
+
+def analyze_resistor_bands(base64_image):
+    """
+    Returns a ComponentAnalysis for a resistor whose bands decode with at
+    least RESISTOR_DECODER_MIN_CONFIDENCE, otherwise None.
+    """
+    if not RESISTOR_DECODER_ENABLED or not base64_image:
+        return None
+    try:
+        image = cv2.imdecode(np.frombuffer(base64.b64decode(base64_image), dtype=np.uint8), cv2.IMREAD_COLOR)
+    except (binascii.Error, ValueError):
+        return None
+    if image is None:
+        return None
+
+    with tracing.span("resistor_decode") as span:
+        reading = decode_resistor(image)
+        if reading is not None:
+            span.set(bands=reading["bands"], confidence=reading["confidence"])
+    if reading is None or reading["confidence"] < RESISTOR_DECODER_MIN_CONFIDENCE:
+        tracing.count("resistor_decodes", outcome="no_bands" if reading is None else "unsure")
+        return None
+
+    tracing.count("resistor_decodes", outcome="decoded")
+    bands = ", ".join(reading["bands"])
+    return ComponentAnalysis(
+        category="Resistor",
+        mounting="THT",
+        resistance=reading["resistance"],
+        tolerance=reading["tolerance"],
+        description=f"Through-hole resistor decoded locally from its colour bands ({bands}), "
+                    f"read as {reading['resistance']} {reading['tolerance']} with confidence {reading['confidence']:.2f}.",
+    )
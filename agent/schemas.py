@@ -0,0 +1,174 @@
+import re
+from typing import Literal, Optional
+
+from pydantic import BaseModel, Field, ValidationInfo, field_validator
+
+# --- 1. Structured Output Schemas ---
+# These describe what the vision model returns when it is asked for typed
+# output instead of free text: ComponentAnalysis for the single-call mode, and
+# one narrower schema per specialist analysis step, so each step's model only
+# sees the fields that apply to its category.
+
+ComponentCategory = Literal['Resistor', 'Capacitor', 'IC', 'Transistor', 'Diode', 'LED', 'PCB', 'Other']
+
+# Values models put in fields they could not read; they are stored as empty.
+_PLACEHOLDERS = {"", "-", "n/a", "na", "none", "unknown", "not visible", "not specified", "not applicable", "unreadable"}
+
+
+class _Analysis(BaseModel):
+    @field_validator("*", mode="before")
+    @classmethod
+    def _empty_placeholders(cls, value, info: ValidationInfo):
+        if info.field_name != "description" and isinstance(value, str) and value.strip().lower().rstrip(".") in _PLACEHOLDERS:
+            return None
+        return value
+
+
+class ComponentAnalysis(_Analysis):
+    """Identification and category-specific details of one electronic component."""
+    category: ComponentCategory = Field(description="The component category.")
+    mounting: Optional[str] = Field(default=None, description="'THT' or 'SMD', if it can be determined.")
+
+    # Resistors
+    resistance: Optional[str] = Field(default=None, description="Resistance with unit, e.g. '4.7 kΩ'.")
+    tolerance: Optional[str] = Field(default=None, description="Tolerance, e.g. '±5%'.")
+    power_rating: Optional[str] = Field(default=None, description="Power rating, e.g. '0.25 W'.")
+
+    # Capacitors
+    capacitance: Optional[str] = Field(default=None, description="Capacitance with unit, e.g. '100 µF'.")
+    voltage_rating: Optional[str] = Field(default=None, description="Voltage rating, e.g. '25 V'.")
+    dielectric: Optional[str] = Field(default=None, description="Type or dielectric, e.g. 'electrolytic', 'X7R ceramic'.")
+
+    # ICs and other marked parts
+    part_number: Optional[str] = Field(default=None, description="Primary part number printed on the package.")
+    manufacturer: Optional[str] = Field(default=None, description="Manufacturer, from the logo or markings.")
+    package: Optional[str] = Field(default=None, description="Package type, e.g. 'DIP-8', 'SOT-23'.")
+    secondary_markings: Optional[str] = Field(default=None, description="Date codes, lot numbers and other markings.")
+
+    description: str = Field(description="A detailed technical analysis of everything that can be inferred from the image.")
+
+
+class ResistorAnalysis(_Analysis):
+    """Details of one resistor."""
+    mounting: Optional[str] = Field(default=None, description="'THT' or 'SMD', if it can be determined.")
+    resistance: Optional[str] = Field(default=None, description="Resistance with unit, e.g. '4.7 kΩ'.")
+    tolerance: Optional[str] = Field(default=None, description="Tolerance, e.g. '±5%'.")
+    power_rating: Optional[str] = Field(default=None, description="Power rating, e.g. '0.25 W'.")
+    description: str = Field(description="A detailed technical analysis of everything that can be inferred from the image.")
+
+
+class CapacitorAnalysis(_Analysis):
+    """Details of one capacitor."""
+    mounting: Optional[str] = Field(default=None, description="'THT' or 'SMD', if it can be determined.")
+    capacitance: Optional[str] = Field(default=None, description="Capacitance with unit, e.g. '100 µF'.")
+    voltage_rating: Optional[str] = Field(default=None, description="Voltage rating, e.g. '25 V'.")
+    dielectric: Optional[str] = Field(default=None, description="Type or dielectric, e.g. 'electrolytic', 'X7R ceramic'.")
+    tolerance: Optional[str] = Field(default=None, description="Tolerance, e.g. '±20%'.")
+    description: str = Field(description="A detailed technical analysis of everything that can be inferred from the image.")
+
+
+class ICAnalysis(_Analysis):
+    """Details of one integrated circuit."""
+    part_number: Optional[str] = Field(default=None, description="Primary part number printed on the package.")
+    manufacturer: Optional[str] = Field(default=None, description="Manufacturer, from the logo or markings.")
+    package: Optional[str] = Field(default=None, description="Package type, e.g. 'DIP-8', 'SOT-23'.")
+    secondary_markings: Optional[str] = Field(default=None, description="Date codes, lot numbers and other markings.")
+    description: str = Field(description="A detailed technical analysis of everything that can be inferred from the image.")
+
+
+class GenericAnalysis(_Analysis):
+    """Details of a component that is not a resistor, capacitor or IC."""
+    category: Literal['Transistor', 'Diode', 'LED', 'PCB', 'Other'] = Field(description="The component category.")
+    mounting: Optional[str] = Field(default=None, description="'THT' or 'SMD', if it can be determined.")
+    part_number: Optional[str] = Field(default=None, description="Part number printed on the component, if any.")
+    manufacturer: Optional[str] = Field(default=None, description="Manufacturer, from the logo or markings.")
+    package: Optional[str] = Field(default=None, description="Package type, e.g. 'TO-92', 'SOD-123'.")
+    secondary_markings: Optional[str] = Field(default=None, description="Colour codes, date codes and other markings.")
+    description: str = Field(description="A detailed technical analysis of everything that can be inferred from the image.")
+
+
+# Each specialist analysis step's category and output schema. Generic
+# components report their own category.
+ANALYSIS_SCHEMAS = {
+    "resistor": ("Resistor", ResistorAnalysis),
+    "capacitor": ("Capacitor", CapacitorAnalysis),
+    "ic": ("IC", ICAnalysis),
+    "generic": (None, GenericAnalysis),
+}
+
+# The fields that must be filled in for the single-call result to stand on its own.
+# Categories not listed here only need a description.
+REQUIRED_FIELDS = {
+    "Resistor": ("resistance",),
+    "Capacitor": ("capacitance",),
+    "IC": ("part_number",),
+}
+
+FIELD_LABELS = {
+    "mounting": "Mounting",
+    "resistance": "Resistance",
+    "tolerance": "Tolerance",
+    "power_rating": "Power rating",
+    "capacitance": "Capacitance",
+    "voltage_rating": "Voltage rating",
+    "dielectric": "Type",
+    "part_number": "Part number",
+    "manufacturer": "Manufacturer",
+    "package": "Package",
+    "secondary_markings": "Secondary markings",
+}
+
+
+def to_component_analysis(step, result):
+    """Widens a specialist step's structured result into a ComponentAnalysis."""
+    category, _ = ANALYSIS_SCHEMAS[step]
+    return ComponentAnalysis(**{"category": category, **result.model_dump()})
+
+
+def schemas_fingerprint():
+    """The JSON schemas sent to the models, for the analysis cache."""
+    return {step: schema.model_json_schema() for step, (_, schema) in ANALYSIS_SCHEMAS.items()} | {
+        "combined": ComponentAnalysis.model_json_schema()}
+
+
+def missing_fields(analysis: ComponentAnalysis):
+    """Returns the required fields for the analysis' category that came back empty."""
+    return [name for name in REQUIRED_FIELDS.get(analysis.category, ()) if not getattr(analysis, name)]
+
+
+def analysis_to_text(analysis: ComponentAnalysis):
+    """Flattens a structured analysis into the plain-text form the summarizer and chat expect."""
+    lines = [f"Component type: {analysis.category}"]
+    for name, label in FIELD_LABELS.items():
+        value = getattr(analysis, name)
+        if value:
+            lines.append(f"{label}: {value}")
+    lines.append("")
+    lines.append(analysis.description)
+    return "\n".join(lines)
+
+
+# A sentence ends at ., ! or ? followed by a capital, except after "e.g." and "i.e.".
+_SENTENCE_END = re.compile(r"(?<=[.!?])(?<!e\.g\.)(?<!i\.e\.)\s+(?=[A-Z])")
+
+
+def _first_sentence(text):
+    return _SENTENCE_END.split(text.strip(), maxsplit=1)[0]
+
+
+def analysis_to_markdown(analysis: ComponentAnalysis):
+    """
+    Renders a structured analysis as the Markdown bullet list the summarizer
+    produces, without a model call. Used for every analysis that came back
+    structured; the summarizer model only sees free-text replies. The model's
+    description is cut to a one-sentence note, and left out altogether when
+    the category's required fields are filled in.
+    """
+    lines = [f"- **Component type:** {analysis.category}"]
+    for name, label in FIELD_LABELS.items():
+        value = getattr(analysis, name)
+        if value:
+            lines.append(f"- **{label}:** {value}")
+    if (analysis.category not in REQUIRED_FIELDS or missing_fields(analysis)) and analysis.description.strip():
+        lines.append(f"- **Notes:** {_first_sentence(analysis.description)}")
+    return "\n".join(lines)
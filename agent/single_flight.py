@@ -0,0 +1,123 @@
+import os
+import asyncio
+import hashlib
+import threading
+from dotenv import load_dotenv
+
+from agent import tracing
+
+# --- 1. Configuration ---
+# Concurrent requests for the same image (two operators scanning one part, a
+# double-clicked capture button) would each run the whole graph. The first
+# one to arrive runs it; identical requests arriving while it is still in
+# flight wait for it and all receive its result. Nothing is kept once the run
+# finishes; repeat scans later on are the analysis cache's job.
+
+load_dotenv()
+
+SINGLE_FLIGHT_ENABLED = os.environ.get("SINGLE_FLIGHT_ENABLED", "1") != "0"
+
+
+def image_digest(image_data):
+    """The key identical requests share: the SHA-256 of the image bytes."""
+    return hashlib.sha256(image_data).hexdigest()
+
+
+class Flight:
+    """One in-flight execution; waiters block on `done` or await a future resolved on their own loop."""
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+        self.async_waiters = []  # (loop, future)
+
+
+class SingleFlight:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flights = {}
+
+    def join(self, key):
+        """Returns (flight, is_leader). The leader must call finish(); followers call wait() or await await_result()."""
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight is None:
+                flight = self.flights[key] = Flight()
+                tracing.current_span().set(coalesced=False)
+                return flight, True
+            flight.followers += 1
+        tracing.current_span().set(coalesced=True)
+        tracing.count("analysis_coalesced")
+        return flight, False
+
+    def finish(self, key, flight, result=None, error=None):
+        """Publishes the leader's result (or exception) to every waiter and retires the flight."""
+        if error is not None and not isinstance(error, Exception):
+            # The leader was cancelled or its stream closed early; that is not the followers' doing.
+            error = RuntimeError("The identical analysis this request was waiting on was cancelled.")
+        with self.lock:
+            if self.flights.get(key) is flight:
+                del self.flights[key]
+            flight.result, flight.error = result, error
+            waiters, flight.async_waiters = flight.async_waiters, None
+        flight.done.set()
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_resolve, future, result, error)
+        if flight.followers:
+            print(f"Shared one analysis with {flight.followers} identical concurrent request(s).")
+
+    def wait(self, flight):
+        flight.done.wait()
+        return _outcome(flight.result, flight.error)
+
+    async def await_result(self, flight):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self.lock:
+            if flight.async_waiters is not None:
+                flight.async_waiters.append((loop, future))
+            else:
+                _resolve(future, flight.result, flight.error)
+        return _outcome(*await future)
+
+    def run(self, key, function):
+        """Runs `function()` unless an identical call is in flight, in which case its result is shared."""
+        flight, leader = self.join(key)
+        if not leader:
+            return self.wait(flight)
+        try:
+            result = function()
+        except BaseException as e:
+            self.finish(key, flight, error=e)
+            raise
+        self.finish(key, flight, result=result)
+        return dict(result)
+
+    async def arun(self, key, coroutine_function):
+        """Async counterpart of run."""
+        flight, leader = self.join(key)
+        if not leader:
+            return await self.await_result(flight)
+        try:
+            result = await coroutine_function()
+        except BaseException as e:
+            self.finish(key, flight, error=e)
+            raise
+        self.finish(key, flight, result=result)
+        return dict(result)
+
+
+def _resolve(future, result, error):
+    if not future.done():
+        future.set_result((result, error))
+
+
+def _outcome(result, error):
+    """Each waiter gets its own copy of the shared final state, or the leader's exception."""
+    if error is not None:
+        raise error
+    return dict(result)
+
+
+flights = SingleFlight()
@@ -0,0 +1,87 @@
+import os
+import threading
+from collections import Counter, deque
+from dotenv import load_dotenv
+
+# --- 1. Configuration ---
+# Speculative analysis (AGENT_GRAPH_MODE=speculative) starts the most likely
+# specialist analyses while the identify call is still running, keeps the
+# one the router would have picked, and drops the rest. A hit saves the
+# identify call's latency; every dropped analysis that reached the vision
+# model is an extra call. This module picks the candidates and keeps the
+# running account of both.
+
+load_dotenv()
+
+# How many specialist analyses to start alongside identification.
+SPECULATIVE_TOOLS = int(os.environ.get("SPECULATIVE_TOOLS", "1"))
+# Threads running speculative analyses for synchronous graphs.
+SPECULATION_WORKERS = int(os.environ.get("SPECULATION_WORKERS", "8"))
+# How many recent analyses the candidate ranking is based on.
+SPECULATION_HISTORY = int(os.environ.get("SPECULATION_HISTORY", "50"))
+
+# The ranking before any history exists: the most common parts on a bench.
+DEFAULT_PRIOR = ("analyze_resistor", "analyze_capacitor", "analyze_ic", "analyze_generic_component")
+
+
+class SpeculationTracker:
+    """Ranks speculative candidates from recent routing decisions and accounts for their cost and savings."""
+    def __init__(self, history=SPECULATION_HISTORY):
+        self.lock = threading.Lock()
+        self.history = deque(maxlen=history)
+        self.runs = 0
+        self.hits = 0
+        self.speculative_calls = 0
+        self.extra_calls = 0
+        self.saved_seconds = 0.0
+
+    def candidates(self, prior_tool=None, count=SPECULATIVE_TOOLS):
+        """
+        Returns up to `count` analysis tools to start early: the local
+        classifier's guess first when there is one, then the tools most
+        often picked recently, then the default order.
+        """
+        with self.lock:
+            recent = [name for name, _ in Counter(self.history).most_common()]
+        ranked = []
+        for name in ([prior_tool] if prior_tool else []) + recent + list(DEFAULT_PRIOR):
+            if name not in ranked:
+                ranked.append(name)
+        return ranked[:max(0, count)]
+
+    def record(self, chosen_tool, hit, started, extra_calls, saved_seconds):
+        """
+        Records one speculative run: the tool the router picked, whether it
+        was among those started, how many were started, how many dropped
+        ones reached the vision model, and the wall-clock time saved.
+        """
+        with self.lock:
+            if chosen_tool:
+                self.history.append(chosen_tool)
+            self.runs += 1
+            self.hits += hit
+            self.speculative_calls += started
+            self.extra_calls += extra_calls
+            self.saved_seconds += saved_seconds
+
+    def stats(self):
+        with self.lock:
+            return {
+                "runs": self.runs,
+                "hits": self.hits,
+                "hit_rate": round(self.hits / self.runs, 3) if self.runs else None,
+                "speculative_analyses": self.speculative_calls,
+                "extra_model_calls": self.extra_calls,
+                "extra_calls_per_run": round(self.extra_calls / self.runs, 3) if self.runs else None,
+                "saved_seconds": round(self.saved_seconds, 3),
+                "saved_seconds_per_run": round(self.saved_seconds / self.runs, 3) if self.runs else None,
+                "recent": dict(Counter(self.history)),
+            }
+
+
+tracker = SpeculationTracker()
+
+
+def speculation_stats():
+    """Running totals for the speculative graph mode (hits, extra model calls, time saved)."""
+    return tracker.stats()
@@ -1,14 +1,20 @@
 import os
+import re
 import base64
 from dotenv import load_dotenv
 
-# LangChain and Google Gemini Imports
-from langchain_openai import ChatOpenAI
-from langchain_google_genai import ChatGoogleGenerativeAI
+# LangChain Imports
 from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
 
+from agent import context, model_router
+from agent.phash import near_duplicate_lookup
+from agent.schemas import ANALYSIS_SCHEMAS, ComponentAnalysis, to_component_analysis
 
-# --- 1. Configuration and Model Initialization ---
+
+# --- 1. Configuration ---
+# Which model answers each step (identify, each analysis, summary, chat) is
+# decided by agent/model_router.py, from a routing table with escalation to
+# larger models when a reply fails validation.
 
 load_dotenv()
 
@@ -21,28 +27,10 @@ if not all([api_base, do_api_key, gemini_api_key, chat_model]):
     raise ValueError("One or more environment variables are missing.")
 
 
-try:
-    # Initialize Vision Model
-    vlm = ChatGoogleGenerativeAI(
-        model="gemini-1.5-flash",
-        api_key=gemini_api_key
-    )
-    
-    # And a second instance configured for structured output
-    print("Vision Model initialized successfully.")
-
-    chat_llm = ChatOpenAI(model=chat_model, 
-                          api_key=do_api_key, 
-                          base_url=api_base, 
-                          temperature=0.5)
-    print(f"Chat Model {chat_model} initialized successfully.")
-
-except Exception as e:
-    vlm, chat_llm = None, None, None
-    print(f"Error initializing models: {e}")
-
-
 # --- 2. Core Helper Functions ---
+# The image tools below take the base64-encoded JPEG directly; it is encoded
+# once per request and shared by every node through the graph state.
+
 def _image_to_base64(image_path):
     try:
         with open(image_path, "rb") as image_file:
@@ -50,23 +38,24 @@ def _image_to_base64(image_path):
     except FileNotFoundError:
         return None
 
-def _invoke_vision_model(prompt, base64_image):
-    """Invokes the vision model"""
-    if not vlm:
-        return {"error": "Vision model is not available."}
-    
-    if not base64_image:
-        return {"error": "Could not process image."}
-
-    message = HumanMessage(
+def _vision_message(prompt, base64_image):
+    """Builds the multimodal message sent to the vision model."""
+    return HumanMessage(
         content=[
             {"type": "text", "text": prompt},
             {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}},
         ]
     )
+
+def _invoke_vision_model(step, base64_image):
+    """Invokes the vision model routed for `step` with that step's prompt."""
+    if not base64_image:
+        return {"error": "Could not process image."}
+
+    message = _vision_message(PROMPTS[step], base64_image)
     try:
         print("Invoking vision model...")
-        response = vlm.invoke([message])
+        response = model_router.invoke(step, [message])
         
         # --- DEBUGGING: Print the raw response from the API ---
         # print(f"--- RAW API RESPONSE ---")
@@ -80,59 +69,138 @@ def _invoke_vision_model(prompt, base64_image):
         print(f"An API error occurred: {e}")
         return f"API_ERROR: An error occurred while contacting the vision model. Details: {e}"
 
+def _invoke_structured_vision_model(step, base64_image):
+    """Invokes the vision model with the ComponentAnalysis output schema."""
+    if not base64_image:
+        return "API_ERROR: Could not process image."
 
-# --- 4. Image Analysis Tools  ---
+    message = _vision_message(PROMPTS[step], base64_image)
+    try:
+        print("Invoking structured vision model...")
+        response = model_router.invoke(step, [message], structured_schema=ComponentAnalysis)
+        if response is None:
+            return "API_ERROR: The vision model did not return a structured result."
+        return response
+    except Exception as e:
+        print(f"An API error occurred: {e}")
+        return f"API_ERROR: An error occurred while contacting the vision model. Details: {e}"
 
-def identify_component(image_path):
-    """Identifies the general component type (returns a simple string)."""
-    base64_image = _image_to_base64(image_path)
-    prompt = "Analyze the electronic component in this image. Respond with only a single-word category from this list: 'Resistor', 'Capacitor', 'IC', 'Transistor', 'Diode', 'LED', 'PCB', 'Other'."
-    return _invoke_vision_model(prompt, base64_image)
-
-def analyze_resistor(image_path):
-    """Analyzes a resistor and returns a structured JSON object."""
-    base64_image = _image_to_base64(image_path)
-    prompt = """
-    You are an expert electronics technician. 
-    Provide a detailed analysis of the resistor in the image, covering its type (THT/SMD), resistance, tolerance, and power rating.
-    Include all the details that can be inferred from the image."""
+def _analysis_result(step, response):
+    """
+    Turns a specialist step's structured reply into a ComponentAnalysis. When
+    the reply couldn't be parsed, returns its text instead (summarized by the
+    chat model later), or None when there is no text either.
+    """
+    if response["parsed"] is not None:
+        return to_component_analysis(step, response["parsed"])
+    print(f"Structured {step} analysis could not be parsed ({response.get('parsing_error') or 'no structured reply'}); using the text reply.")
+    content = getattr(response["raw"], "content", None)
+    return content if isinstance(content, str) and content.strip() else None
 
-    return _invoke_vision_model(prompt, base64_image)
+def _invoke_analysis_model(step, base64_image):
+    """
+    Invokes the vision model for a specialist analysis with that step's output
+    schema, falling back to a free-text call if the reply is unusable.
+    """
+    if not base64_image:
+        return "API_ERROR: Could not process image."
+
+    message = _vision_message(PROMPTS[step], base64_image)
+    try:
+        print("Invoking structured vision model...")
+        response = model_router.invoke(step, [message], structured_schema=ANALYSIS_SCHEMAS[step][1], include_raw=True)
+    except Exception as e:
+        print(f"An API error occurred: {e}")
+        return f"API_ERROR: An error occurred while contacting the vision model. Details: {e}"
+    result = _analysis_result(step, response)
+    return result if result is not None else _invoke_vision_model(step, base64_image)
 
-def analyze_capacitor(image_path):
-    """Analyzes a capacitor and returns a structured JSON object."""
-    base64_image = _image_to_base64(image_path)
-    prompt = """
+async def _ainvoke_vision_model(step, base64_image):
+    """Async counterpart of _invoke_vision_model."""
+    if not base64_image:
+        return {"error": "Could not process image."}
+
+    message = _vision_message(PROMPTS[step], base64_image)
+    try:
+        print("Invoking vision model (async)...")
+        response = await model_router.ainvoke(step, [message])
+        return response.content
+    except Exception as e:
+        print(f"An API error occurred: {e}")
+        return f"API_ERROR: An error occurred while contacting the vision model. Details: {e}"
+
+async def _ainvoke_analysis_model(step, base64_image):
+    """Async counterpart of _invoke_analysis_model."""
+    if not base64_image:
+        return "API_ERROR: Could not process image."
+
+    message = _vision_message(PROMPTS[step], base64_image)
+    try:
+        print("Invoking structured vision model (async)...")
+        response = await model_router.ainvoke(step, [message], structured_schema=ANALYSIS_SCHEMAS[step][1], include_raw=True)
+    except Exception as e:
+        print(f"An API error occurred: {e}")
+        return f"API_ERROR: An error occurred while contacting the vision model. Details: {e}"
+    result = _analysis_result(step, response)
+    return result if result is not None else await _ainvoke_vision_model(step, base64_image)
+
+async def _ainvoke_structured_vision_model(step, base64_image):
+    """Async counterpart of _invoke_structured_vision_model."""
+    if not base64_image:
+        return "API_ERROR: Could not process image."
+
+    message = _vision_message(PROMPTS[step], base64_image)
+    try:
+        print("Invoking structured vision model (async)...")
+        response = await model_router.ainvoke(step, [message], structured_schema=ComponentAnalysis)
+        if response is None:
+            return "API_ERROR: The vision model did not return a structured result."
+        return response
+    except Exception as e:
+        print(f"An API error occurred: {e}")
+        return f"API_ERROR: An error occurred while contacting the vision model. Details: {e}"
+
+
+# --- 3. Prompts ---
+# Every prompt sent to a model lives here. The analysis cache fingerprints this
+# dictionary, so editing a prompt automatically invalidates cached results.
+
+PROMPTS = {
+    "identify": "Analyze the electronic component in this image. Respond with only a single-word category from this list: 'Resistor', 'Capacitor', 'IC', 'Transistor', 'Diode', 'LED', 'PCB', 'Other'.",
+    "resistor": """
+    You are an expert electronics technician. 
+    Provide a detailed analysis of the resistor in the image, covering its type (THT/SMD), resistance, tolerance, and power rating.
+    Include all the details that can be inferred from the image.""",
+    "capacitor": """
     You are an expert electronics technician. Analyze the capacitor in the image.
     Provide a detailed analysis of the capacitor in the image, covering its type (THT/SMD), capacitance value, voltage rating, and tolerance.
-    Include all the details that can be inferred from the image."""
-    return _invoke_vision_model(prompt, base64_image)
-
-def analyze_ic(image_path):
-    """Analyzes an IC and returns a structured JSON object."""
-    base64_image = _image_to_base64(image_path)
-    prompt = """
+    Include all the details that can be inferred from the image.""",
+    "ic": """
     You are an expert electronics technician. Analyze the Integrated Circuit (IC) in the image.
     Provide a detailed analysis of the Integrated Circuit (IC) in the image, covering the primary part number, manufacturer, and any secondary markings.
-    Include all the details that can be inferred from the image."""
-    return _invoke_vision_model(prompt, base64_image)
-
-def analyze_generic_component(image_path):
-    """Analyzes a generic component and returns a structured JSON object."""
-    base64_image = _image_to_base64(image_path)
-    prompt = """
+    Include all the details that can be inferred from the image.""",
+    "generic": """
     You are an expert electronics technician. Analyze the component in the image.
     Provide a detailed analysis of the component, identifying its likely type and explaining all visible markings and features.
-    """
-    return _invoke_vision_model(prompt, base64_image)
-
-
-# --- 4.RAW response Summarization Tool ---
-def summarize_analysis(analysis_text: str):
-    """Takes a long analysis and creates a concise, formatted summary using the chat model."""
-    if not chat_llm: return "Error: Chat model is not available for summarization."
-    
-    prompt = f"""
+    """,
+    "combined": """
+    You are an expert electronics technician. Identify the electronic component in the image and analyze it in one pass.
+    Set the category to one of 'Resistor', 'Capacitor', 'IC', 'Transistor', 'Diode', 'LED', 'PCB', 'Other'.
+    Fill in every field that applies to that category: type (THT/SMD), resistance, tolerance and power rating for resistors;
+    capacitance, voltage rating and dielectric for capacitors; part number, manufacturer, package and secondary markings for ICs.
+    Leave fields that do not apply or cannot be read empty. In the description, include all the details that can be inferred from the image.""",
+    "chat_summary": """
+    You are maintaining the memory of a conversation between a user and an electronics assistant about one component.
+    Update the running summary below with the new conversation turns. Keep every fact, value, part number and
+    open question the assistant may need later; drop pleasantries. Reply with the updated summary only, in under 200 words.
+
+    Running summary so far:
+    {previous_summary}
+
+    New turns:
+    {turns}
+    """,
+    "summary": """
     You are a helpful assistant. Your task is to summarize a detailed technical analysis of an electronic component into a brief, user-friendly format.
     Use Markdown with bullet points for the key specifications. Do not include recommendations or extra paragraphs.
 
@@ -142,9 +210,79 @@ def summarize_analysis(analysis_text: str):
     ---
 
     Provide the concise summary now.
-    """
+    """,
+}
+
+
+# --- 4. Image Analysis Tools  ---
+# Only identification reuses near-duplicate frames' results (agent/phash.py):
+# a perceptual hash can't tell one resistor's bands or one IC's marking from
+# another's, so the value-reading tools rely on the exact analysis cache.
+
+@near_duplicate_lookup("identify")
+def identify_component(base64_image):
+    """Identifies the general component type (returns a simple string)."""
+    return _invoke_vision_model("identify", base64_image)
+
+def analyze_resistor(base64_image):
+    """Analyzes a resistor, returning a ComponentAnalysis (or the reply text if it couldn't be parsed)."""
+    return _invoke_analysis_model("resistor", base64_image)
+
+def analyze_capacitor(base64_image):
+    """Analyzes a capacitor, returning a ComponentAnalysis (or the reply text if it couldn't be parsed)."""
+    return _invoke_analysis_model("capacitor", base64_image)
+
+def analyze_ic(base64_image):
+    """Analyzes an IC, returning a ComponentAnalysis (or the reply text if it couldn't be parsed)."""
+    return _invoke_analysis_model("ic", base64_image)
+
+def analyze_generic_component(base64_image):
+    """Analyzes a generic component, returning a ComponentAnalysis (or the reply text if it couldn't be parsed)."""
+    return _invoke_analysis_model("generic", base64_image)
+
+def identify_and_analyze_component(base64_image):
+    """Identifies and analyzes a component in a single call, returning a ComponentAnalysis."""
+    return _invoke_structured_vision_model("combined", base64_image)
+
+
+# --- 4b. Async Image Analysis Tools ---
+# Same tools as above, awaiting the model instead of blocking a thread on it.
+
+@near_duplicate_lookup("identify")
+async def aidentify_component(base64_image):
+    return await _ainvoke_vision_model("identify", base64_image)
+
+async def aanalyze_resistor(base64_image):
+    return await _ainvoke_analysis_model("resistor", base64_image)
+
+async def aanalyze_capacitor(base64_image):
+    return await _ainvoke_analysis_model("capacitor", base64_image)
+
+async def aanalyze_ic(base64_image):
+    return await _ainvoke_analysis_model("ic", base64_image)
+
+async def aanalyze_generic_component(base64_image):
+    return await _ainvoke_analysis_model("generic", base64_image)
+
+async def aidentify_and_analyze_component(base64_image):
+    return await _ainvoke_structured_vision_model("combined", base64_image)
+
+
+# --- 4.RAW response Summarization Tool ---
+def summarize_analysis(analysis_text: str):
+    """Takes a long analysis and creates a concise, formatted summary using the chat model."""
+    prompt = PROMPTS["summary"].format(analysis_text=analysis_text)
     try:
-        response = chat_llm.invoke([HumanMessage(content=prompt)])
+        response = model_router.invoke("summary", [HumanMessage(content=prompt)])
+        return response.content
+    except Exception as e:
+        return f"API_ERROR: Failed to summarize analysis. Details: {e}"
+
+async def asummarize_analysis(analysis_text: str):
+    """Async counterpart of summarize_analysis."""
+    prompt = PROMPTS["summary"].format(analysis_text=analysis_text)
+    try:
+        response = await model_router.ainvoke("summary", [HumanMessage(content=prompt)])
         return response.content
     except Exception as e:
         return f"API_ERROR: Failed to summarize analysis. Details: {e}"
@@ -152,32 +290,126 @@ def summarize_analysis(analysis_text: str):
 
 # --- 5. Chat Continuation Tool ---
 
-def continue_chat(chat_history: list):
+# Components whose follow-up questions get their own chat route ("chat:IC"),
+# recognised from the initial analysis when it doesn't state its category.
+_CHAT_CATEGORY_HINTS = (
+    ("IC", re.compile(r"\bIC\b|integrated circuit|microcontroller|op-?amp", re.IGNORECASE)),
+    ("PCB", re.compile(r"\bPCB\b|circuit board", re.IGNORECASE)),
+)
+
+def _chat_step(chat_history: list):
+    """Picks the model route for a conversation from the component it is about, e.g. 'chat:IC'."""
+    initial_analysis = next((content for role, content in chat_history if role == "ai"), "") or ""
+    match = re.search(r"Component type:\s*(\w+)", initial_analysis)
+    category = match.group(1) if match else next((name for name, hint in _CHAT_CATEGORY_HINTS if hint.search(initial_analysis)), None)
+    return f"chat:{category}" if category else "chat"
+
+def _chat_messages(chat_history: list):
     """
-    TOOL 6: Takes the existing chat history and generates the next AI response.
+    Converts our (role, content) history into the LangChain messages sent to
+    the chat model, staying within the chat context token budget.
     """
-    if not chat_llm:
-        return "Error: Chat model is not available."
-    
     # The first message from the AI is the initial, detailed analysis.
-    # We use this as the context for all future questions.
-    initial_analysis = chat_history[0][1]
+    # We send the essential slice of it as the context for all future questions.
+    initial_analysis = context.essential_analysis(chat_history)
+    _, key_specs, rolling_summary, turns = context.split_history(chat_history)
     
     # We construct a message list for the LLM
     messages = [
         SystemMessage(content=f"You are an expert electronics assistant. You have already performed an analysis of a component with the following result: '{initial_analysis}'. Now, answer the user's follow-up questions based on this analysis and your general knowledge. Keep your answers concise and helpful."),
     ]
-
-    # Add the rest of the history, converting our simple tuple format to LangChain messages
-    for role, content in chat_history[1:]:
+    if key_specs:
+        messages.append(AIMessage(content=key_specs))
+    if rolling_summary:
+        messages.append(SystemMessage(content=f"Summary of the earlier conversation: {rolling_summary}"))
+
+    # Add the most recent turns that fit the remaining budget, converting our simple tuple format to LangChain messages
+    used = sum(context.estimate_tokens(text or "") for text in (initial_analysis, key_specs, rolling_summary))
+    for role, content in context.recent_turns(turns, context.CHAT_CONTEXT_TOKENS - used):
         if role == "human":
             messages.append(HumanMessage(content=content))
         elif role == "ai":
             messages.append(AIMessage(content=content))
+    return messages
+
+def _compaction_prompt(chat_history: list):
+    previous_summary, fold, keep = context.compaction_plan(chat_history)
+    prompt = PROMPTS["chat_summary"].format(previous_summary=previous_summary or "(none yet)", turns=context.format_turns(fold))
+    return prompt, keep
+
+def compact_chat_history(chat_history: list):
+    """
+    Folds older chat turns into a rolling summary once the history outgrows the
+    token budget, so each turn costs roughly the same however long the
+    conversation runs. Returns the compacted history to store, or None when no
+    compaction was needed (or it failed, in which case the oldest turns are
+    simply left out of the request by _chat_messages).
+    """
+    if not context.needs_compaction(chat_history):
+        return None
+
+    prompt, keep = _compaction_prompt(chat_history)
+    try:
+        response = model_router.invoke("chat_summary", [HumanMessage(content=prompt)])
+    except Exception as e:
+        print(f"Could not compact chat history: {e}")
+        return None
+    return context.compacted_history(chat_history, response.content, keep)
+
+async def acompact_chat_history(chat_history: list):
+    """Async counterpart of compact_chat_history."""
+    if not context.needs_compaction(chat_history):
+        return None
+
+    prompt, keep = _compaction_prompt(chat_history)
+    try:
+        response = await model_router.ainvoke("chat_summary", [HumanMessage(content=prompt)])
+    except Exception as e:
+        print(f"Could not compact chat history: {e}")
+        return None
+    return context.compacted_history(chat_history, response.content, keep)
+
+def continue_chat(chat_history: list):
+    """
+    TOOL 6: Takes the existing chat history and generates the next AI response.
+    """
+    messages = _chat_messages(chat_history)
 
     # Invoke the model with the full conversation history
     try:
-        response = chat_llm.invoke(messages)
+        response = model_router.invoke(_chat_step(chat_history), messages)
+        return response.content
+    except Exception as e:
+        print(f"An error occurred during chat: {e}")
+        return "Sorry, I encountered an error while processing your request."
+
+def stream_chat(chat_history: list):
+    """Streaming counterpart of continue_chat: yields the AI response in chunks as they arrive."""
+    messages = _chat_messages(chat_history)
+    try:
+        for chunk in model_router.stream(_chat_step(chat_history), messages):
+            if chunk.content:
+                yield chunk.content
+    except Exception as e:
+        print(f"An error occurred during chat: {e}")
+        yield "Sorry, I encountered an error while processing your request."
+
+async def astream_chat(chat_history: list):
+    """Async counterpart of stream_chat."""
+    messages = _chat_messages(chat_history)
+    try:
+        async for chunk in model_router.astream(_chat_step(chat_history), messages):
+            if chunk.content:
+                yield chunk.content
+    except Exception as e:
+        print(f"An error occurred during chat: {e}")
+        yield "Sorry, I encountered an error while processing your request."
+
+async def acontinue_chat(chat_history: list):
+    """Async counterpart of continue_chat."""
+    messages = _chat_messages(chat_history)
+    try:
+        response = await model_router.ainvoke(_chat_step(chat_history), messages)
         return response.content
     except Exception as e:
         print(f"An error occurred during chat: {e}")
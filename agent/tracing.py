@@ -0,0 +1,232 @@
+import os
+import json
+import time
+import uuid
+import bisect
+import inspect
+import functools
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+# --- 1. Configuration ---
+# Every analysis is one trace made of nested spans: the request, each graph
+# node, each routed model call and the provider attempts under it, image
+# normalisation and JPEG encoding, and analysis cache I/O. Each finished span
+# feeds a duration histogram (exported by the servers' /metrics route in the
+# Prometheus text format, with p50/p95/p99 over recent calls) and, when
+# TRACE_FILE is set, is appended to that file as one JSON line.
+
+load_dotenv()
+
+TRACING_ENABLED = os.environ.get("TRACING_ENABLED", "1") != "0"
+# JSON-lines file finished spans are appended to; empty disables the export.
+TRACE_FILE = os.environ.get("TRACE_FILE", "")
+# Recent durations kept per span for the quantiles.
+TRACE_WINDOW = int(os.environ.get("TRACE_WINDOW", "1000"))
+
+METRIC_PREFIX = "circuitseer"
+# Histogram bucket bounds in seconds: from JPEG encodes to slow model calls.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+# --- 2. Spans ---
+
+class Span:
+    """One timed operation in a trace. `labels` become metric labels; attributes only go to the trace file."""
+    def __init__(self, name, labels, parent):
+        self.name = name
+        self.labels = labels
+        self.attributes = {}
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex[:16]
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.started_at = time.time()
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+class _NoopSpan:
+    def set(self, **attributes):
+        pass
+
+
+_current = contextvars.ContextVar("circuitseer_span", default=None)
+
+
+@contextmanager
+def span(name, **labels):
+    """
+    Times the enclosed block as a span named `name`, nested under the span
+    already open in this context (thread or task). Yields the span so callers
+    can attach attributes with span.set(...).
+    """
+    if not TRACING_ENABLED:
+        yield _NoopSpan()
+        return
+
+    current = Span(name, {key: str(value) for key, value in labels.items()}, _current.get())
+    token = _current.set(current)
+    start = time.perf_counter()
+    try:
+        yield current
+    except BaseException as e:
+        current.error = type(e).__name__
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        try:
+            _current.reset(token)
+        except ValueError:
+            pass  # A generator span resumed in another context (e.g. a streamed response).
+        _observe(current, duration)
+        if TRACE_FILE:
+            _export(current, duration)
+
+
+def traced(name, func, **labels):
+    """Wraps a function (sync or async), e.g. a graph node, so each call is a span."""
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            with span(name, **labels):
+                return await func(*args, **kwargs)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with span(name, **labels):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def current_span():
+    """The span open in this context, for adding attributes, or a no-op span outside any trace."""
+    return _current.get() or _NoopSpan()
+
+
+# --- 3. Metrics ---
+
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=TRACE_WINDOW)
+
+    def observe(self, value):
+        index = bisect.bisect_left(BUCKETS, value)
+        if index < len(BUCKETS):
+            self.buckets[index] += 1
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+
+
+_histograms = {}
+_counters = {}
+_metrics_lock = threading.Lock()
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def _observe(current, duration):
+    with _metrics_lock:
+        _histograms.setdefault(_key(current.name, current.labels), Histogram()).observe(duration)
+    if current.error:
+        count("span_errors", span=current.name, error=current.error)
+
+
+def count(name, amount=1, **labels):
+    """Adds `amount` to the counter `name` with the given labels (exported as <name>_total)."""
+    if not TRACING_ENABLED or not amount:
+        return
+    key = _key(name, {k: str(v) for k, v in labels.items()})
+    with _metrics_lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def _quantile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(pairs):
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}" if pairs else ""
+
+
+def render_metrics():
+    """Renders every span histogram, its p50/p95/p99 and every counter in the Prometheus text format."""
+    with _metrics_lock:
+        histograms = [(name, labels, list(h.buckets), h.count, h.sum, sorted(h.recent)) for (name, labels), h in sorted(_histograms.items())]
+        counters = sorted(_counters.items())
+
+    seconds = f"{METRIC_PREFIX}_span_duration_seconds"
+    lines = [f"# HELP {seconds} Duration of traced spans: graph nodes, model calls, image encoding and cache I/O.",
+             f"# TYPE {seconds} histogram"]
+    for name, labels, buckets, total, total_sum, _ in histograms:
+        pairs = (("span", name),) + labels
+        cumulative = 0
+        for bound, bucket in zip(BUCKETS, buckets):
+            cumulative += bucket
+            lines.append(f"{seconds}_bucket{_labels(pairs + (('le', repr(bound)),))} {cumulative}")
+        lines.append(f"{seconds}_bucket{_labels(pairs + (('le', '+Inf'),))} {total}")
+        lines.append(f"{seconds}_sum{_labels(pairs)} {total_sum}")
+        lines.append(f"{seconds}_count{_labels(pairs)} {total}")
+
+    latency = f"{METRIC_PREFIX}_span_latency_seconds"
+    lines += [f"# HELP {latency} p50/p95/p99 span duration over the last {TRACE_WINDOW} calls.",
+              f"# TYPE {latency} summary"]
+    for name, labels, _, total, total_sum, recent in histograms:
+        pairs = (("span", name),) + labels
+        for fraction in QUANTILES:
+            if recent:
+                lines.append(f"{latency}{_labels(pairs + (('quantile', str(fraction)),))} {_quantile(recent, fraction)}")
+        lines.append(f"{latency}_sum{_labels(pairs)} {total_sum}")
+        lines.append(f"{latency}_count{_labels(pairs)} {total}")
+
+    typed = set()
+    for (name, labels), value in counters:
+        metric = f"{METRIC_PREFIX}_{name}_total"
+        if metric not in typed:
+            typed.add(metric)
+            lines.append(f"# TYPE {metric} counter")
+        lines.append(f"{metric}{_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+# --- 4. Trace Export ---
+
+_trace_file = None
+_trace_file_lock = threading.Lock()
+
+
+def _export(current, duration):
+    global _trace_file
+    record = {
+        "trace_id": current.trace_id, "span_id": current.span_id, "parent_id": current.parent_id,
+        "name": current.name, "labels": current.labels, "start": round(current.started_at, 6),
+        "duration_ms": round(duration * 1000, 3), "attributes": current.attributes, "error": current.error,
+    }
+    line = json.dumps(record, default=str) + "\n"
+    with _trace_file_lock:
+        try:
+            if _trace_file is None:
+                directory = os.path.dirname(TRACE_FILE)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                _trace_file = open(TRACE_FILE, "a", encoding="utf-8")
+            _trace_file.write(line)
+            _trace_file.flush()
+        except OSError as e:
+            print(f"Could not write trace to {TRACE_FILE}: {e}")
@@ -1,20 +1,66 @@
+from utils import startup # Imported first so startup times are measured from launch
 import webview
 import threading
+import html
 import sys
-from server import app # Import the Flask app instance from server.py
+
+HOST, PORT = '127.0.0.1', 5000
+URL = f'http://{HOST}:{PORT}'
+
+# Shown while server.py is still importing; replaced by the real UI as soon
+# as the server accepts connections.
+LOADING_PAGE = """
+<html><body style="font-family: sans-serif; display: flex; align-items: center; justify-content: center; height: 100vh; margin: 0; color: #555;">
+<p>Starting CircuitSeer&hellip;</p>
+</body></html>
+"""
+
+# Shown instead of the UI if the server could not start.
+ERROR_PAGE = """
+<html><body style="font-family: sans-serif; display: flex; align-items: center; justify-content: center; height: 100vh; margin: 0; color: #555;">
+<div><p>CircuitSeer could not start its server.</p><pre>{error}</pre></div>
+</body></html>
+"""
 
 # --- Global variable to hold the pywebview window ---
 window = None
+server_ready = threading.Event()
+server_error = None # Set by start_server() if the server failed to start
 
 def start_server():
     """
-    Function to run the Flask server.
-    We disable Flask's reloader to prevent issues with pywebview.
+    Function to run the Flask server. Importing server.py happens here, off
+    the main thread, so the window opens without waiting for it; the agent
+    itself keeps compiling in the background after the server is up.
+    We don't use Flask's reloader, to prevent issues with pywebview.
     """
+    global server_error
     try:
-        app.run(host='127.0.0.1', port=5000, debug=False)
+        from werkzeug.serving import make_server
+        from server import app # Import the Flask app instance from server.py
+        http_server = make_server(HOST, PORT, app, threaded=True)
     except Exception as e:
         print(f"Failed to start Flask server: {e}")
+        server_error = e
+        server_ready.set() # Wakes show_ui() so it can show the error
+        return
+    startup.mark("server")
+    server_ready.set()
+    http_server.serve_forever()
+
+def show_ui():
+    """Runs once the window is up: switches it to the real UI when the server is listening."""
+    server_ready.wait()
+    if server_error is not None:
+        window.load_html(ERROR_PAGE.format(error=html.escape(f"{type(server_error).__name__}: {server_error}")))
+        return
+    window.load_url(URL)
+
+def on_loaded():
+    """Reports startup times once the UI page (not the loading page) has loaded."""
+    if server_ready.is_set() and server_error is None and "ui" not in startup.startup_stats()["ready_after_seconds"]:
+        startup.mark("ui")
+        startup.report()
 
 def on_closed():
     """
@@ -30,25 +76,25 @@ if __name__ == '__main__':
     # when the main program (the pywebview window) exits.
     server_thread = threading.Thread(target=start_server, daemon=True)
     server_thread.start()
-    print("Flask server started in a background thread.")
+    print("Flask server starting in a background thread.")
 
     # --- Create and start the pywebview window ---
     # This creates a native OS window that displays our web UI.
     try:
         window = webview.create_window(
             'CircuitSeer',
-            'http://127.0.0.1:5000', # Load the Flask server's URL
+            html=LOADING_PAGE,
             width=1200,
             height=800,
             resizable=True
         )
+        window.events.loaded += on_loaded
         window.events.closed += on_closed
         print("Starting UI window...")
-        webview.start()
+        webview.start(show_ui)
         print("CircuitSeer application has been shut down.")
 
     except Exception as e:
         print(f"Failed to create or start pywebview window: {e}")
-    
-    sys.exit()
 
+    sys.exit()
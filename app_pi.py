@@ -1,52 +1,111 @@
+from utils import startup # Imported first so startup times are measured from launch
 import threading
+import html
 import sys
-import server_pi # Import the Pi-specific server
-from utils.camera_pi import Camera # Import the Pi-specific camera class
 import os
 
 os.environ["WEBKIT_DISABLE_COMPOSITING_MODE"] = "1"
 
 import webview
 
-pi_camera = None
+HOST, PORT = '127.0.0.1', 5000
+URL = f'http://{HOST}:{PORT}'
 
-def start_server(camera_instance):
-    """Function to run the Flask server, passing in the camera object."""
+# Shown while server_pi.py is still importing; replaced by the real UI as soon
+# as the server accepts connections.
+LOADING_PAGE = """
+<html><body style="font-family: sans-serif; display: flex; align-items: center; justify-content: center; height: 100vh; margin: 0; color: #555;">
+<p>Starting CircuitSeer&hellip;</p>
+</body></html>
+"""
+
+# Shown instead of the UI if the server could not start.
+ERROR_PAGE = """
+<html><body style="font-family: sans-serif; display: flex; align-items: center; justify-content: center; height: 100vh; margin: 0; color: #555;">
+<div><p>CircuitSeer could not start its server.</p><pre>{error}</pre></div>
+</body></html>
+"""
+
+window = None
+camera_future = None
+server_ready = threading.Event()
+server_error = None # Set by start_server() if the server failed to start
+
+def start_camera():
+    """Opens the Pi camera. Runs in the background, alongside the server import and window start."""
+    from utils.camera_pi import Camera # Import the Pi-specific camera class
+    camera = Camera()
+    print("PiCamera initialized successfully.")
+    return camera
+
+def start_server():
+    """
+    Function to run the Flask server. The camera is handed over as a future:
+    routes that need it wait until it has started.
+    """
+    global server_error
     try:
-        server_pi.camera = camera_instance
-        server_pi.app.run(host='127.0.0.1', port=5000, debug=False)
+        from werkzeug.serving import make_server
+        import server_pi # Import the Pi-specific server
+        server_pi.camera_future = camera_future
+        http_server = make_server(HOST, PORT, server_pi.app, threaded=True)
     except Exception as e:
         print(f"Failed to start Flask server: {e}")
+        server_error = e
+        server_ready.set() # Wakes show_ui() so it can show the error
+        return
+    startup.mark("server")
+    server_ready.set()
+    http_server.serve_forever()
+
+def show_ui():
+    """Runs once the window is up: switches it to the real UI when the server is listening."""
+    server_ready.wait()
+    if server_error is not None:
+        window.load_html(ERROR_PAGE.format(error=html.escape(f"{type(server_error).__name__}: {server_error}")))
+        return
+    window.load_url(URL)
+
+def on_loaded():
+    """Reports startup times once the UI page (not the loading page) has loaded."""
+    if server_ready.is_set() and server_error is None and "ui" not in startup.startup_stats()["ready_after_seconds"]:
+        startup.mark("ui")
+        startup.report()
+
+def release_camera():
+    if camera_future is not None and camera_future.done() and not camera_future.exception():
+        camera_future.result().release()
 
 if __name__ == '__main__':
     try:
-        pi_camera = Camera()
-        print("PiCamera initialized successfully.")
+        # The camera, the server import (which starts compiling the agent) and
+        # the window all start at once instead of one after another.
+        camera_future = startup.in_background("camera", start_camera)
 
-        server_thread = threading.Thread(target=start_server, args=(pi_camera,), daemon=True)
+        server_thread = threading.Thread(target=start_server, daemon=True)
         server_thread.start()
-        print("Flask server (Pi version) started in a background thread.")
+        print("Flask server (Pi version) starting in a background thread.")
 
         window = webview.create_window(
             'CircuitSeer (Raspberry Pi)',
-            'http://127.0.0.1:5000', # Load the root URL, which serves index_pi.html
+            html=LOADING_PAGE,
             width=1200,
             height=800,
             resizable=True
         )
-        
+
         def on_closed():
             print("UI window closed. Releasing camera.")
-            pi_camera.release()
-        
+            release_camera()
+
+        window.events.loaded += on_loaded
         window.events.closed += on_closed
-        
-        webview.start()
+
+        webview.start(show_ui)
         print("CircuitSeer application has been shut down.")
 
     except Exception as e:
         print(f"Failed to start application: {e}")
-        if pi_camera:
-            pi_camera.release()
-    
+        release_camera()
+
     sys.exit()
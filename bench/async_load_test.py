@@ -0,0 +1,117 @@
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+
+import cv2
+import numpy as np
+
+# Compares the blocking graph against the async graph under concurrent load,
+# with every model call answered by the local stub server.
+#
+#   python -m bench.async_load_test --requests 40 --concurrency 20 --latency 0.5
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bench.stub_model_server import start_stub_server
+
+
+def _make_images(count, seed=0):
+    """Generates distinct JPEGs so no request is answered from a cache."""
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(count):
+        frame = (rng.random((240, 320, 3)) * 255).astype(np.uint8)
+        images.append(cv2.imencode('.jpg', frame)[1].tobytes())
+    return images
+
+
+def _configure_agent(base_url):
+    """Points every model route at the stub server and disables result caching."""
+    os.environ.update({
+        "DO_API_BASE": base_url,
+        "DO_API_KEY": "stub",
+        "GOOGLE_API_KEY": "stub",
+        "DO_CHAT_MODEL": "stub-chat",
+        "ANALYSIS_CACHE_ENABLED": "0",
+        "PHASH_ENABLED": "0",
+    })
+    from agent import model_router
+
+    # Every step on one stub model, without escalation or failover.
+    model_router.api_base, model_router.vision_fallback_model, model_router.chat_fallback_model = base_url, "", ""
+    model_router.set_routes({
+        step: ["do:stub-vision" if step in model_router.VISION_STEPS else "do:stub-chat"]
+        for step in model_router.DEFAULT_ROUTES
+    })
+
+
+def _report(name, wall, latencies):
+    latencies = sorted(latencies)
+    p95 = latencies[int(0.95 * (len(latencies) - 1))]
+    print(f"{name:<28} {len(latencies) / wall:7.2f} req/s   wall {wall:6.2f} s   "
+          f"p50 {statistics.median(latencies):6.2f} s   p95 {p95:6.2f} s")
+
+
+def run_sync(images):
+    """One blocking worker, as with the Flask dev server handling one request at a time."""
+    from agent.graph import create_graph
+    from agent.pipeline import run_analysis
+
+    langgraph_app = create_graph()
+    latencies = []
+    start = time.perf_counter()
+    for image in images:
+        t0 = time.perf_counter()
+        run_analysis(langgraph_app, image)
+        latencies.append(time.perf_counter() - t0)
+    return time.perf_counter() - start, latencies
+
+
+async def run_async(images, concurrency):
+    """One event loop keeping up to `concurrency` analyses in flight."""
+    from agent.graph import create_graph
+    from agent.pipeline import arun_analysis
+
+    langgraph_app = create_graph(use_async=True)
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(image):
+        async with semaphore:
+            t0 = time.perf_counter()
+            await arun_analysis(langgraph_app, image)
+            latencies.append(time.perf_counter() - t0)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(image) for image in images))
+    return time.perf_counter() - start, latencies
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load-test the sync and async analysis paths against a stub model server.")
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.5, help="Stub model latency per call, in seconds.")
+    parser.add_argument("--skip-sync", action="store_true", help="Only run the async path.")
+    args = parser.parse_args()
+
+    server, base_url = start_stub_server(latency=args.latency, jitter=args.latency / 5)
+    _configure_agent(base_url)
+    images = _make_images(args.requests)
+
+    print(f"\n--- {args.requests} analyses, ~{args.latency:.2f} s per model call ---")
+    if not args.skip_sync:
+        sync_wall, sync_latencies = run_sync(images)
+    async_wall, async_latencies = asyncio.run(run_async(images, args.concurrency))
+
+    print("\n--- Results ---")
+    if not args.skip_sync:
+        _report("sync (1 worker)", sync_wall, sync_latencies)
+    _report(f"async (concurrency {args.concurrency})", async_wall, async_latencies)
+    if not args.skip_sync:
+        print(f"Speed-up: {sync_wall / async_wall:.1f}x")
+    runs = len(images) * (1 if args.skip_sync else 2)
+    print(f"Model calls per analysis: {server.requests_received / runs:.1f}")
+    server.shutdown()
@@ -0,0 +1,101 @@
+import os
+import sys
+import time
+import argparse
+import statistics
+
+import cv2
+import numpy as np
+
+# Measures what image normalisation saves: bytes sent to the vision model and
+# end-to-end analysis latency, with preprocessing off and then on. The stub
+# model server simulates a limited upload link, so payload size shows up in
+# latency the way it does against the real API.
+#
+#   python -m bench.image_payload --images 10 --upload-mbps 10 --latency 0.3
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bench.stub_model_server import start_stub_server
+from bench.async_load_test import _configure_agent
+
+
+def _make_scene(rng, width, height, part_size):
+    """
+    Renders a webcam-like frame: a textured bench top with one resistor-like
+    part of `part_size` (width, height) pixels at a random position.
+    """
+    background = rng.normal(150, 12, (height // 8, width // 8, 3)).clip(0, 255).astype(np.uint8)
+    frame = cv2.resize(background, (width, height), interpolation=cv2.INTER_CUBIC)
+    frame = cv2.GaussianBlur(frame, (0, 0), 3)
+
+    part_w, part_h = part_size
+    x = int(rng.integers(part_w, width - 2 * part_w))
+    y = int(rng.integers(part_h, height - 2 * part_h))
+    lead_y = y + part_h // 2
+    cv2.line(frame, (x - part_w // 2, lead_y), (x + part_w + part_w // 2, lead_y), (190, 190, 190), max(1, part_h // 8))
+    cv2.rectangle(frame, (x, y), (x + part_w, y + part_h), (140, 190, 215), -1)
+    for i, colour in enumerate([(19, 69, 139), (0, 0, 0), (0, 140, 255), (32, 165, 218)]):
+        band_x = x + part_w * (2 + 2 * i) // 11
+        cv2.rectangle(frame, (band_x, y), (band_x + max(1, part_w // 14), y + part_h), colour, -1)
+    noise = rng.normal(0, 4, frame.shape)
+    return (frame + noise).clip(0, 255).astype(np.uint8)
+
+
+def _make_images(count, width, height, part_size, seed=0):
+    rng = np.random.default_rng(seed)
+    return [
+        cv2.imencode('.jpg', _make_scene(rng, width, height, part_size), [cv2.IMWRITE_JPEG_QUALITY, 95])[1].tobytes()
+        for _ in range(count)
+    ]
+
+
+def run(images, server, enabled):
+    """Analyzes every image once and returns (bytes sent per analysis, latencies)."""
+    from agent import preprocess
+    from agent.graph import create_graph
+    from agent.pipeline import run_analysis
+
+    preprocess.PREPROCESS_ENABLED = enabled
+    langgraph_app = create_graph()
+    server.reset_stats()
+    latencies = []
+    for image in images:
+        t0 = time.perf_counter()
+        run_analysis(langgraph_app, image)
+        latencies.append(time.perf_counter() - t0)
+    return server.bytes_received / len(images), latencies
+
+
+def _report(name, sent, latencies):
+    print(f"{name:<24} {sent / 1024:9.1f} KB sent/analysis   "
+          f"p50 {statistics.median(latencies):6.2f} s   max {max(latencies):6.2f} s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare model payloads and latency with and without image normalisation.")
+    parser.add_argument("--images", type=int, default=10)
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--latency", type=float, default=0.3, help="Stub model latency per call, in seconds.")
+    parser.add_argument("--upload-mbps", type=float, default=10, help="Simulated upload bandwidth in Mbit/s.")
+    args = parser.parse_args()
+
+    server, base_url = start_stub_server(latency=args.latency, jitter=0, upload_bps=args.upload_mbps * 125_000)
+    _configure_agent(base_url)
+
+    scenes = {
+        "through-hole part": (args.width // 4, args.width // 16),
+        "SMD part": (args.width // 30, args.width // 60),
+    }
+    print(f"\n--- {args.images} {args.width}x{args.height} frames per scene, "
+          f"{args.upload_mbps:g} Mbit/s upload, ~{args.latency:.2f} s per model call ---")
+    for scene, part_size in scenes.items():
+        images = _make_images(args.images, args.width, args.height, part_size)
+        print(f"\n{scene} (upload {statistics.mean(len(i) for i in images) / 1024:.1f} KB per image)")
+        before = run(images, server, enabled=False)
+        after = run(images, server, enabled=True)
+        _report("  original", *before)
+        _report("  normalised", *after)
+        print(f"  payload {before[0] / after[0]:.1f}x smaller, "
+              f"p50 latency {statistics.median(before[1]) - statistics.median(after[1]):+.2f} s saved")
+    server.shutdown()
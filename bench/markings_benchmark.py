@@ -0,0 +1,118 @@
+import os
+import sys
+import time
+import base64
+import argparse
+import statistics
+
+import cv2
+import numpy as np
+
+# Compares the local IC path (OCR plus parts index) with the detailed vision
+# call on labelled IC images: latency, how often the local path answers, and
+# how often each answer names the right part.
+#
+#   python -m bench.markings_benchmark                      # synthetic ICs, stub vision model
+#   python -m bench.markings_benchmark --scans ic_scans     # real scans named <PART>_*.jpg
+#   python -m bench.markings_benchmark --live               # real vision model (uses API quota)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bench.stub_model_server import start_stub_server
+from bench.async_load_test import _configure_agent
+
+SYNTHETIC_MARKINGS = [("NE555P", "NE555"), ("LM358N", "LM358"), ("SN74HC595N", "SN74HC595N"), ("ULN2003A", "ULN2003A"),
+                      ("ATMEGA328P", "ATMEGA328P-PU"), ("TL072CP", "TL072"), ("CD4017BE", "CD4017BE"), ("L293D", "L293D")]
+
+
+def _render_ic(marking, rng):
+    """Draws a DIP package with an etched-looking marking and a date code, slightly rotated and noisy."""
+    image = np.full((360, 640, 3), 185, np.uint8)
+    cv2.rectangle(image, (90, 100), (550, 260), (32, 30, 30), -1)
+    for x in range(120, 540, 50):
+        cv2.rectangle(image, (x, 70), (x + 18, 100), (170, 170, 175), -1)
+        cv2.rectangle(image, (x, 260), (x + 18, 290), (170, 170, 175), -1)
+    etch = int(rng.integers(120, 170))
+    cv2.putText(image, marking, (130, 175), cv2.FONT_HERSHEY_SIMPLEX, 1.3, (etch, etch, etch), 3, cv2.LINE_AA)
+    cv2.putText(image, f"{rng.integers(10, 25)}{rng.integers(10, 52)}A", (130, 230), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (etch, etch, etch), 2, cv2.LINE_AA)
+    rotation = cv2.getRotationMatrix2D((320, 180), float(rng.uniform(-4, 4)), 1.0)
+    image = cv2.warpAffine(image, rotation, (640, 360), borderValue=(185, 185, 185))
+    image = cv2.GaussianBlur(image, (3, 3), 0)
+    return (image + rng.normal(0, 6, image.shape)).clip(0, 255).astype(np.uint8)
+
+
+def load_cases(scans, count):
+    """Returns [(base64_jpeg, expected_part_number)] from labelled scans or synthetic renders."""
+    if scans:
+        cases = []
+        for filename in sorted(os.listdir(scans)):
+            with open(os.path.join(scans, filename), "rb") as f:
+                cases.append((base64.b64encode(f.read()).decode("utf-8"), filename.split("_")[0]))
+        return cases
+    rng = np.random.default_rng(0)
+    cases = []
+    for i in range(count):
+        marking, part = SYNTHETIC_MARKINGS[i % len(SYNTHETIC_MARKINGS)]
+        jpeg = cv2.imencode(".jpg", _render_ic(marking, rng))[1].tobytes()
+        cases.append((base64.b64encode(jpeg).decode("utf-8"), part))
+    return cases
+
+
+def run_local(cases):
+    from agent import markings
+    from agent.parts_db import normalize_part
+
+    latencies, answered, correct = [], 0, 0
+    for image_b64, expected in cases:
+        start = time.perf_counter()
+        result = markings.analyze_markings("analyze_ic", image_b64)
+        latencies.append(time.perf_counter() - start)
+        if result is not None:
+            answered += 1
+            correct += normalize_part(result.part_number) == normalize_part(expected)
+    return latencies, answered, correct
+
+
+def run_vision(cases):
+    from agent import tools
+    from agent.parts_db import normalize_part
+
+    # Bypass the near-duplicate index: the synthetic ICs look alike to it.
+    analyze_ic = getattr(tools.analyze_ic, "__wrapped__", tools.analyze_ic)
+    latencies, correct = [], 0
+    for image_b64, expected in cases:
+        start = time.perf_counter()
+        text = analyze_ic(image_b64)
+        latencies.append(time.perf_counter() - start)
+        correct += isinstance(text, str) and normalize_part(expected) in normalize_part(text)
+    return latencies, len(cases), correct
+
+
+def _report(name, cases, latencies, answered, correct):
+    print(f"{name:<26} p50 {statistics.median(latencies) * 1000:8.1f} ms   answered {answered}/{len(cases)}   "
+          f"correct {correct}/{answered if answered else 0}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark local OCR part lookup against the vision model.")
+    parser.add_argument("--scans", help="Folder of labelled IC images named <PART>_*.jpg.")
+    parser.add_argument("--count", type=int, default=16, help="Number of synthetic images without --scans.")
+    parser.add_argument("--live", action="store_true", help="Call the configured vision model instead of the stub.")
+    parser.add_argument("--latency", type=float, default=1.5, help="Stub vision model latency in seconds.")
+    args = parser.parse_args()
+
+    if not args.live:
+        server, base_url = start_stub_server(latency=args.latency, jitter=0)
+        _configure_agent(base_url)
+
+    from agent import markings
+    cases = load_cases(args.scans, args.count)
+    print(f"\n--- {len(cases)} IC images ({'labelled scans' if args.scans else 'synthetic'}), "
+          f"vision model {'live' if args.live else f'stubbed at {args.latency:.2f} s'} ---")
+    if markings.ocr_available():
+        _report("local OCR + parts index", cases, *run_local(cases))
+    else:
+        print("Local OCR is unavailable: install tesseract and pytesseract.")
+    vision = run_vision(cases)
+    _report("vision model", cases, *vision)
+    if not args.live:
+        print("(The stub always answers with a resistor, so vision accuracy is only meaningful with --live.)")
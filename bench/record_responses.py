@@ -0,0 +1,70 @@
+import os
+import sys
+import json
+import glob
+import argparse
+import threading
+
+# Records real model responses for the stub server to replay. Runs the agent
+# once over a folder of images (and one follow-up chat question per image)
+# against the configured providers, so it spends API quota once, and writes
+# every routed model call's step, reply and latency as one JSON line:
+#
+#   python -m bench.record_responses --images data/samples --out bench/recordings.jsonl
+#   python -m bench.stub_model_server --replay bench/recordings.jsonl
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _record_entry(step, spec, seconds, response):
+    """The replayable part of one model reply: its text or its tool call arguments."""
+    entry = {"step": step.split(":")[0], "model": spec, "latency_ms": round(seconds * 1000, 1)}
+    tool_calls = getattr(response, "tool_calls", None) or []
+    if tool_calls:
+        entry["tool_call"] = {"name": tool_calls[0]["name"], "arguments": tool_calls[0]["args"]}
+    content = getattr(response, "content", "")
+    entry["content"] = content if isinstance(content, str) else json.dumps(content)
+    return entry
+
+
+def record(image_paths, out_path, question):
+    from agent import model_router
+    from agent.graph import create_graph
+    from agent.pipeline import run_analysis
+    from agent.tools import continue_chat
+
+    lock = threading.Lock()
+    original_record = model_router._record
+
+    def recording(step, spec, seconds, response=None, error=False, escalated=False):
+        original_record(step, spec, seconds, response, error=error, escalated=escalated)
+        if response is not None and not error:
+            with lock, open(out_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(_record_entry(step, spec, seconds, response), ensure_ascii=False) + "\n")
+
+    model_router._record = recording
+    langgraph_app = create_graph()
+    for path in image_paths:
+        with open(path, "rb") as f:
+            image_data = f.read()
+        print(f"Recording {path}...")
+        final_state = run_analysis(langgraph_app, image_data)
+        if question and final_state.get("raw_analysis") and not final_state.get("error"):
+            continue_chat([("ai", final_state["raw_analysis"]), ("ai", final_state.get("analysis_result", "")), ("human", question)])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Record real model responses for the stub server's replay mode.")
+    parser.add_argument("--images", required=True, help="Folder of JPEG images to analyze.")
+    parser.add_argument("--out", default="bench/recordings.jsonl")
+    parser.add_argument("--question", default="What is this part typically used for?", help="Follow-up chat question per image (empty to skip).")
+    args = parser.parse_args()
+
+    # Fresh results only: cached analyses and near-duplicate reuse would skip the calls we want to record.
+    os.environ["ANALYSIS_CACHE_ENABLED"] = "0"
+    os.environ["PHASH_ENABLED"] = "0"
+    paths = sorted(glob.glob(os.path.join(args.images, "*.jp*g")))
+    if not paths:
+        sys.exit(f"No JPEG images found in {args.images}.")
+    record(paths, args.out, args.question)
+    print(f"Recorded responses appended to {args.out}.")
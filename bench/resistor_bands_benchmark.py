@@ -0,0 +1,126 @@
+import os
+import sys
+import time
+import base64
+import argparse
+import statistics
+
+import cv2
+import numpy as np
+
+# Measures the local colour-band decoder on labelled resistor images: how
+# often it is confident enough to answer, how often a confident answer is
+# right, and how long it takes, next to the detailed vision call it replaces.
+#
+#   python -m bench.resistor_bands_benchmark                     # synthetic resistors, stub vision model
+#   python -m bench.resistor_bands_benchmark --scans resistors   # real scans named <OHMS>_*.jpg, e.g. 4700_01.jpg
+#   python -m bench.resistor_bands_benchmark --live              # real vision model (uses API quota)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bench.stub_model_server import start_stub_server
+from bench.async_load_test import _configure_agent
+from agent import resistor_bands
+
+DIGIT_BANDS = [name for name, (_, digit, _, _) in resistor_bands.BAND_COLOURS.items() if digit is not None]
+BODY_COLOURS = {4: (120, 190, 220), 5: (180, 130, 60)}  # Beige carbon film, blue metal film
+
+
+def _render_resistor(rng, five_band):
+    """
+    Draws a resistor with leads at a random angle on a light background, with
+    a colour cast, uneven lighting, blur, noise and JPEG compression.
+    Returns (BGR image, ohms).
+    """
+    mantissa = int(rng.choice(resistor_bands.E96 if five_band else resistor_bands.E24))
+    exponent = int(rng.integers(0, 6))
+    tolerance = "brown" if five_band else str(rng.choice(["gold", "silver"]))
+    bands = [DIGIT_BANDS[int(c)] for c in str(mantissa)] + [DIGIT_BANDS[exponent], tolerance]
+
+    width, height = 640, 360
+    background = int(rng.integers(170, 240))
+    image = np.full((height, width, 3), background, np.uint8)
+    cy, length = height // 2, int(rng.integers(260, 360))
+    thickness, x0 = int(length * rng.uniform(0.28, 0.36)), width // 2 - length // 2
+    cv2.line(image, (20, cy), (width - 20, cy), (150, 150, 155), int(rng.integers(3, 6)))
+    cv2.rectangle(image, (x0, cy - thickness // 2), (x0 + length, cy + thickness // 2), BODY_COLOURS[len(bands)], -1)
+    band_width = int(length * 0.07)
+    positions = np.linspace(x0 + length * 0.12, x0 + length * 0.62, len(bands) - 1).astype(int).tolist() + [int(x0 + length * 0.83)]
+    for name, x in zip(bands, positions):
+        cv2.rectangle(image, (x, cy - thickness // 2), (x + band_width, cy + thickness // 2), resistor_bands.BAND_COLOURS[name][0], -1)
+
+    rotation = cv2.getRotationMatrix2D((width / 2, height / 2), float(rng.uniform(-30, 30)), 1.0)
+    image = cv2.warpAffine(image, rotation, (width, height), borderValue=(background,) * 3)
+    if rng.random() < 0.5:
+        image = cv2.flip(image, 1)
+    image = image * rng.uniform(0.75, 1.15, 3) * rng.uniform(0.85, 1.1)
+    image = image * np.linspace(rng.uniform(0.85, 1.0), rng.uniform(1.0, 1.12), width)[None, :, None]
+    image = cv2.GaussianBlur(image.clip(0, 255).astype(np.uint8), (5, 5), 0)
+    image = (image + rng.normal(0, 5, image.shape)).clip(0, 255).astype(np.uint8)
+    return image, mantissa * 10 ** exponent
+
+
+def load_cases(scans, count):
+    """Returns [(base64_jpeg, expected_ohms)] from labelled scans or synthetic renders."""
+    if scans:
+        cases = []
+        for filename in sorted(os.listdir(scans)):
+            with open(os.path.join(scans, filename), "rb") as f:
+                cases.append((base64.b64encode(f.read()).decode("utf-8"), float(filename.split("_")[0])))
+        return cases
+    rng = np.random.default_rng(0)
+    cases = []
+    for i in range(count):
+        image, ohms = _render_resistor(rng, five_band=i % 4 == 3)
+        jpeg = cv2.imencode(".jpg", image)[1].tobytes()
+        cases.append((base64.b64encode(jpeg).decode("utf-8"), ohms))
+    return cases
+
+
+def run_local(cases):
+    latencies, answered, correct = [], 0, 0
+    for image_b64, expected in cases:
+        image = cv2.imdecode(np.frombuffer(base64.b64decode(image_b64), dtype=np.uint8), cv2.IMREAD_COLOR)
+        start = time.perf_counter()
+        reading = resistor_bands.decode_resistor(image)
+        latencies.append(time.perf_counter() - start)
+        if reading is not None and reading["confidence"] >= resistor_bands.RESISTOR_DECODER_MIN_CONFIDENCE:
+            answered += 1
+            correct += abs(reading["ohms"] - expected) <= 1e-6 * expected
+    return latencies, answered, correct
+
+
+def run_vision(cases):
+    from agent import tools
+
+    # Bypass the near-duplicate index: the synthetic resistors look alike to it.
+    analyze_resistor = getattr(tools.analyze_resistor, "__wrapped__", tools.analyze_resistor)
+    latencies = []
+    for image_b64, _ in cases:
+        start = time.perf_counter()
+        analyze_resistor(image_b64)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the local colour-band decoder against the vision model.")
+    parser.add_argument("--scans", help="Folder of labelled resistor images named <OHMS>_*.jpg.")
+    parser.add_argument("--count", type=int, default=200, help="Number of synthetic images without --scans.")
+    parser.add_argument("--live", action="store_true", help="Call the configured vision model instead of the stub.")
+    parser.add_argument("--latency", type=float, default=1.5, help="Stub vision model latency in seconds.")
+    parser.add_argument("--vision-samples", type=int, default=5, help="Images sent to the vision model for its latency.")
+    args = parser.parse_args()
+
+    if not args.live:
+        server, base_url = start_stub_server(latency=args.latency, jitter=0)
+        _configure_agent(base_url)
+
+    cases = load_cases(args.scans, args.count)
+    print(f"\n--- {len(cases)} resistor images ({'labelled scans' if args.scans else 'synthetic'}), "
+          f"confidence threshold {resistor_bands.RESISTOR_DECODER_MIN_CONFIDENCE} ---")
+    latencies, answered, correct = run_local(cases)
+    print(f"{'colour-band decoder':<22} p50 {statistics.median(latencies) * 1000:8.1f} ms   "
+          f"p95 {np.percentile(latencies, 95) * 1000:8.1f} ms   answered {answered}/{len(cases)}   correct {correct}/{answered}")
+    vision = run_vision(cases[:args.vision_samples])
+    print(f"{'vision model':<22} p50 {statistics.median(vision) * 1000:8.1f} ms   "
+          f"({'live' if args.live else f'stubbed at {args.latency:.2f} s'}, {len(vision)} images)")
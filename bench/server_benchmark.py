@@ -0,0 +1,277 @@
+import os
+import sys
+import json
+import time
+import base64
+import socket
+import argparse
+import statistics
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+# Benchmarks the HTTP servers end to end, entirely offline: every model call
+# is answered by the stub model server (canned replies with a chosen latency
+# distribution, or recorded real responses replayed), each server variant
+# runs in its own process, and /analyze and /chat are driven at a fixed
+# concurrency. Reports requests/s, latency percentiles and the server's memory
+# growth, and can fail when results regress against a saved baseline:
+#
+#   python -m bench.server_benchmark --variants flask,async --requests 60 --concurrency 8
+#   python -m bench.server_benchmark --replay bench/recordings.jsonl --save bench/baseline.json
+#   python -m bench.server_benchmark --baseline bench/baseline.json --max-regression 0.2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from agent.model_router import VISION_STEPS
+from bench.async_load_test import _make_images
+from bench.stub_model_server import DISTRIBUTIONS, parse_step_latency, start_stub_server
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# How each variant is started; {port} is filled in.
+VARIANTS = {
+    "flask": [sys.executable, "-m", "bench.server_benchmark", "--serve", "server", "--port", "{port}"],
+    "async": [sys.executable, "-m", "hypercorn", "server_async:app", "--bind", "127.0.0.1:{port}"],
+    "pi": [sys.executable, "-m", "bench.server_benchmark", "--serve", "server_pi", "--port", "{port}"],
+}
+
+# Steps of the agent, each routed to one stub model without escalation or failover.
+TEXT_STEPS = ("summary", "chat_summary", "chat")
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def server_env(base_url):
+    """Environment pointing a server process at the stub, with caching and near-duplicate reuse off."""
+    routes = {step: ["do:stub-vision"] for step in VISION_STEPS}
+    routes.update({step: ["do:stub-chat"] for step in TEXT_STEPS})
+    return {
+        **os.environ,
+        "DO_API_BASE": base_url, "DO_API_KEY": "stub", "GOOGLE_API_KEY": "stub", "DO_CHAT_MODEL": "stub-chat",
+        "MODEL_ROUTES": json.dumps(routes), "DO_VISION_MODEL": "", "CHAT_FALLBACK_MODEL": "",
+        "ANALYSIS_CACHE_ENABLED": "0", "PHASH_ENABLED": "0", "SESSION_BACKEND": "memory",
+        "PYTHONUNBUFFERED": "1",
+    }
+
+
+def _children(pid):
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+
+
+def rss_mb(pid):
+    """
+    Resident memory in MB of a process and its descendants (hypercorn serves
+    from a worker process), read from Linux /proc; None where unavailable.
+    """
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            rss = next(int(line.split()[1]) / 1024 for line in f if line.startswith("VmRSS:"))
+    except (OSError, StopIteration):
+        return None
+    return rss + sum(rss_mb(child) or 0 for child in _children(pid))
+
+
+def start_server(variant, base_url, log_path):
+    """Starts a server variant in its own process and waits until it answers."""
+    port = _free_port()
+    command = [part.format(port=port) for part in VARIANTS[variant]]
+    log = open(log_path, "w")
+    process = subprocess.Popen(command, cwd=ROOT, env=server_env(base_url), stdout=log, stderr=subprocess.STDOUT)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"The {variant} server exited during startup; see {log_path}.")
+        try:
+            if httpx.get(f"{url}/sessions/stats", timeout=1).status_code == 200:
+                return process, url
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"The {variant} server did not start within 60 s; see {log_path}.")
+
+
+def _percentiles(latencies):
+    ordered = sorted(latencies)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+    return {"p50_ms": round(pick(0.5), 1), "p95_ms": round(pick(0.95), 1), "p99_ms": round(pick(0.99), 1),
+            "mean_ms": round(statistics.fmean(ordered) * 1000, 1)} if ordered else {}
+
+
+def drive(url, images, concurrency, chat_turns, stream):
+    """
+    Runs one analysis per image and `chat_turns` follow-up questions on each
+    resulting session, `concurrency` sessions at a time. Returns per-endpoint
+    latencies, error counts and the wall time.
+    """
+    analyze_path, chat_path = ("/analyze/stream", "/chat/stream") if stream else ("/analyze", "/chat")
+    results = {analyze_path: [], chat_path: []}
+    errors = {analyze_path: 0, chat_path: 0}
+    lock = threading.Lock()
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    with httpx.Client(base_url=url, timeout=120, limits=limits) as client:
+        def call(path, body):
+            start = time.perf_counter()
+            try:
+                response = client.post(path, json=body)
+                ok = response.status_code == 200 and "event: error" not in response.text
+                data = _final_payload(response.text) if stream else response.json()
+            except (httpx.HTTPError, ValueError):
+                ok, data = False, {}
+            with lock:
+                results[path].append(time.perf_counter() - start)
+                errors[path] += not ok
+            return data if ok else None
+
+        def session(image):
+            data = call(analyze_path, {"image": base64.b64encode(image).decode("utf-8")})
+            if not data or not data.get("session_id"):
+                return
+            for turn in range(chat_turns):
+                call(chat_path, {"session_id": data["session_id"], "message": f"Question {turn + 1}: what is it used for?"})
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(session, images))
+        wall = time.perf_counter() - start
+    return results, errors, wall
+
+
+def _final_payload(text):
+    """The data of the last server-sent event ("done") in a streamed response."""
+    data_lines = [line[6:] for line in text.splitlines() if line.startswith("data: ")]
+    return json.loads(data_lines[-1]) if data_lines else {}
+
+
+def run_variant(variant, base_url, args):
+    log_path = os.path.join(args.log_dir, f"{variant}.log")
+    process, url = start_server(variant, base_url, log_path)
+    try:
+        drive(url, _make_images(args.warmup, seed=1), min(args.concurrency, args.warmup), args.chat_turns, args.stream)
+        rss_start = rss_mb(process.pid)
+        results, errors, wall = drive(url, _make_images(args.requests, seed=2), args.concurrency, args.chat_turns, args.stream)
+        rss_end = rss_mb(process.pid)
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+    report = {"variant": variant, "wall_s": round(wall, 2), "endpoints": {},
+              "rss_start_mb": round(rss_start, 1) if rss_start else None, "rss_end_mb": round(rss_end, 1) if rss_end else None}
+    for path, latencies in results.items():
+        report["endpoints"][path] = {"requests": len(latencies), "errors": errors[path],
+                                     "rps": round(len(latencies) / wall, 2) if wall else None, **_percentiles(latencies)}
+    if rss_start and rss_end:
+        report["rss_growth_mb"] = round(rss_end - rss_start, 1)
+        report["rss_growth_kb_per_request"] = round((rss_end - rss_start) * 1024 / max(1, args.requests), 1)
+    return report
+
+
+def print_report(reports):
+    print(f"\n{'variant':<8} {'endpoint':<16} {'req':>5} {'err':>4} {'req/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}   memory")
+    for report in reports:
+        memory = (f"{report['rss_start_mb']} -> {report['rss_end_mb']} MB ({report['rss_growth_kb_per_request']:+} KB/req)"
+                  if report.get("rss_growth_mb") is not None else "n/a")
+        for path, stats in report["endpoints"].items():
+            if not stats["requests"]:
+                continue
+            print(f"{report['variant']:<8} {path:<16} {stats['requests']:>5} {stats['errors']:>4} {stats['rps']:>7} "
+                  f"{stats.get('p50_ms', ''):>8} {stats.get('p95_ms', ''):>8} {stats.get('p99_ms', ''):>8}   {memory}")
+            memory = ""
+
+
+def regressions(reports, baseline, max_regression):
+    """Compares p95 latency, throughput and errors with a saved run; returns the regressions found."""
+    found = []
+    previous = {report["variant"]: report for report in baseline}
+    for report in reports:
+        before = previous.get(report["variant"])
+        if before is None:
+            continue
+        for path, stats in report["endpoints"].items():
+            old = before["endpoints"].get(path)
+            if not old or not stats["requests"] or not old["requests"]:
+                continue
+            if stats["p95_ms"] > old["p95_ms"] * (1 + max_regression):
+                found.append(f"{report['variant']} {path}: p95 {old['p95_ms']} -> {stats['p95_ms']} ms")
+            if stats["rps"] < old["rps"] * (1 - max_regression):
+                found.append(f"{report['variant']} {path}: {old['rps']} -> {stats['rps']} req/s")
+            if stats["errors"] > old["errors"]:
+                found.append(f"{report['variant']} {path}: {old['errors']} -> {stats['errors']} errors")
+    return found
+
+
+def serve(module, port):
+    """Runs a Flask server module (server.py or server_pi.py) with threaded request handling."""
+    app = __import__(module).app
+    app.run(host="127.0.0.1", port=port, threaded=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the HTTP servers offline against the stub model server.")
+    parser.add_argument("--variants", default="flask,async", help=f"Comma-separated, from: {', '.join(VARIANTS)}.")
+    parser.add_argument("--requests", type=int, default=40, help="Analyses per variant (each one a chat session).")
+    parser.add_argument("--chat-turns", type=int, default=2, help="Follow-up /chat requests per analysis.")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=4)
+    parser.add_argument("--stream", action="store_true", help="Use /analyze/stream and /chat/stream.")
+    parser.add_argument("--latency", type=float, default=0.3, help="Mean stub model latency in seconds.")
+    parser.add_argument("--jitter", type=float, default=0.1, help="Uniform +/- jitter in seconds (the shape for lognormal).")
+    parser.add_argument("--distribution", choices=DISTRIBUTIONS, default="uniform")
+    parser.add_argument("--step-latency", action="append", metavar="STEP=SECONDS", help="Mean stub delay for one step, e.g. summary=0.2.")
+    parser.add_argument("--replay", help="Recorded responses to replay (see bench/record_responses.py).")
+    parser.add_argument("--save", help="Write the results to this JSON file.")
+    parser.add_argument("--baseline", help="A saved results file to compare against.")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Allowed relative p95/throughput regression.")
+    parser.add_argument("--log-dir", default=os.path.join(ROOT, "cache", "bench"))
+    parser.add_argument("--serve", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port)
+        sys.exit(0)
+
+    os.makedirs(args.log_dir, exist_ok=True)
+    stub, base_url = start_stub_server(latency=args.latency, jitter=args.jitter, distribution=args.distribution,
+                                       step_latency=parse_step_latency(args.step_latency), replay=args.replay)
+    reports = []
+    for variant in [v.strip() for v in args.variants.split(",") if v.strip()]:
+        if variant not in VARIANTS:
+            sys.exit(f"Unknown variant '{variant}'. Expected one of: {', '.join(VARIANTS)}.")
+        print(f"--- {variant}: {args.requests} analyses x {args.chat_turns} chat turns, concurrency {args.concurrency} ---")
+        stub.reset_stats()
+        try:
+            report = run_variant(variant, base_url, args)
+        except RuntimeError as e:
+            print(f"Skipping {variant}: {e}")
+            continue
+        report["model_calls"] = stub.requests_received
+        reports.append(report)
+
+    print_report(reports)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(reports, f, indent=2)
+        print(f"\nResults saved to {args.save}.")
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(reports, json.load(f), args.max_regression)
+        if found:
+            print("\nRegressions against the baseline:\n  " + "\n  ".join(found))
+            sys.exit(1)
+        print("\nNo regressions against the baseline.")
+    stub.shutdown()
@@ -0,0 +1,261 @@
+import json
+import math
+import time
+import random
+import argparse
+import itertools
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# A tiny OpenAI-compatible chat completions server for load testing. It answers
+# every request after a configurable delay, so the agent can be exercised at
+# realistic latencies without spending any API quota. Replies are either canned
+# (plain text, a tool call for structured output requests, or server-sent
+# events for streaming requests) or replayed from responses recorded with
+# bench/record_responses.py, together with their recorded latencies.
+
+DISTRIBUTIONS = ("constant", "uniform", "lognormal", "exponential")
+
+# Canned tool-call arguments for structured output requests, by schema name.
+STRUCTURED_REPLIES = {
+    "ResistorAnalysis": {"mounting": "THT", "resistance": "10 kΩ", "tolerance": "±5%", "power_rating": "0.25 W",
+                         "description": "Through-hole carbon film resistor. Bands: brown, black, orange, gold."},
+    "CapacitorAnalysis": {"mounting": "THT", "capacitance": "100 µF", "voltage_rating": "25 V", "dielectric": "electrolytic",
+                          "description": "Radial aluminium electrolytic capacitor with a marked negative stripe."},
+    "ICAnalysis": {"part_number": "NE555P", "manufacturer": "Texas Instruments", "package": "DIP-8",
+                   "description": "Precision timer in a plastic dual in-line package."},
+    "GenericAnalysis": {"category": "Diode", "mounting": "THT", "part_number": "1N4007", "package": "DO-41",
+                        "description": "General purpose rectifier diode with a cathode band."},
+    "ComponentAnalysis": {"category": "Resistor", "mounting": "THT", "resistance": "10 kΩ", "tolerance": "±5%",
+                          "description": "Through-hole carbon film resistor. Bands: brown, black, orange, gold."},
+}
+
+# Prompt fragments that tell the steps apart, checked in order (see PROMPTS in agent/tools.py).
+_STEP_MARKERS = (
+    ("identify", "single-word category"),
+    ("summary", "summarize a detailed technical analysis"),
+    ("chat_summary", "maintaining the memory of a conversation"),
+    ("chat", "expert electronics assistant"),
+    ("combined", "analyze it in one pass"),
+    ("resistor", "analysis of the resistor"),
+    ("capacitor", "Analyze the capacitor"),
+    ("ic", "Integrated Circuit (IC)"),
+    ("generic", "Analyze the component"),
+)
+
+
+def step_for(body):
+    """Works out which agent step a chat completions request comes from."""
+    text = json.dumps(body.get("messages", []), ensure_ascii=False)
+    return next((step for step, marker in _STEP_MARKERS if marker in text), "other")
+
+
+def _reply_for(step):
+    """Picks a plausible canned text reply for a step."""
+    if step == "identify":
+        return "Resistor"
+    if step == "summary":
+        return "- **Type:** THT resistor\n- **Resistance:** 10 kΩ\n- **Tolerance:** ±5%"
+    if step == "chat_summary":
+        return "The user is asking about a 10 kΩ through-hole resistor used as a pull-up."
+    if step == "chat":
+        return "A 10 kΩ resistor is commonly used as a pull-up resistor."
+    return "This is a through-hole carbon film resistor. Bands: brown, black, orange, gold, giving 10 kΩ ±5%, rated 0.25 W."
+
+
+def sample_latency(distribution, mean, jitter):
+    """
+    Draws one response delay in seconds: `constant` is always `mean`,
+    `uniform` is mean +/- jitter, `lognormal` has the given mean and
+    `jitter` as its shape (a long tail, like real model endpoints), and
+    `exponential` has the given mean.
+    """
+    if mean <= 0:
+        return 0.0
+    if distribution == "constant":
+        return mean
+    if distribution == "lognormal":
+        sigma = max(jitter, 1e-6)
+        return random.lognormvariate(math.log(mean) - sigma ** 2 / 2, sigma)
+    if distribution == "exponential":
+        return random.expovariate(1 / mean)
+    return max(0.0, mean + random.uniform(-jitter, jitter))
+
+
+def load_recordings(path):
+    """Reads recorded responses (one JSON object per line) into per-step round-robin iterators."""
+    by_step = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                by_step.setdefault(record["step"], []).append(record)
+    return {step: itertools.cycle(records) for step, records in by_step.items()}
+
+
+class StubModelHandler(BaseHTTPRequestHandler):
+    latency = 0.5   # Mean response delay in seconds
+    jitter = 0.1    # Uniform +/- jitter (or lognormal shape) in seconds
+    distribution = "uniform"
+    step_latency = {}  # Per-step mean delay overrides, e.g. {"summary": 0.2}
+    recordings = None  # Per-step iterators of recorded responses to replay
+    upload_bps = 0  # Simulated client upload bandwidth in bytes/s (0 = unlimited)
+    protocol_version = "HTTP/1.1"  # Keep-alive, like the real endpoints
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, body, step):
+        """Returns (content, tool_call, delay) for a request, replayed when a recording exists for its step."""
+        tools = body.get("tools") or []
+        tool_name = tools[0]["function"]["name"] if tools else None
+        recorded = next(self.recordings[step]) if self.recordings and step in self.recordings else None
+        if recorded is not None:
+            delay = recorded.get("latency_ms", 0) / 1000
+            tool_call = recorded.get("tool_call")
+            if tool_call and tool_name:
+                return None, {"name": tool_name, "arguments": tool_call["arguments"]}, delay
+            return recorded.get("content") or "", None, delay
+
+        delay = sample_latency(self.distribution, self.step_latency.get(step, self.latency), self.jitter)
+        if tool_name in STRUCTURED_REPLIES:
+            return None, {"name": tool_name, "arguments": STRUCTURED_REPLIES[tool_name]}, delay
+        return _reply_for(step), None, delay
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        self.server.record_request(length)
+        content, tool_call, delay = self._reply(body, step_for(body))
+        upload_time = length / self.upload_bps if self.upload_bps else 0.0
+        if body.get("stream"):
+            self._stream(body, content or "", tool_call, upload_time + delay)
+            return
+        time.sleep(upload_time + delay)
+
+        message = {"role": "assistant", "content": content}
+        if tool_call is not None:
+            message["tool_calls"] = [{"id": "call_stub", "type": "function",
+                                      "function": {"name": tool_call["name"], "arguments": json.dumps(tool_call["arguments"])}}]
+        completion_tokens = len((content or json.dumps(tool_call)).split())
+        payload = json.dumps({
+            "id": "stub-completion",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if tool_call else "stop"}],
+            "usage": {"prompt_tokens": 100, "completion_tokens": completion_tokens, "total_tokens": 100 + completion_tokens},
+        }).encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _stream(self, body, content, tool_call, delay):
+        """
+        Streams `content` word by word (or the tool call in one piece) as
+        server-sent events: half the delay before the first token, the rest
+        spread over the others.
+        """
+        words = [word + " " for word in content.split(" ")] or [""]
+        time.sleep(delay / 2)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def event(delta, finish_reason=None, usage=None):
+            chunk = {"id": "stub-completion", "object": "chat.completion.chunk", "created": int(time.time()),
+                     "model": body.get("model", "stub"), "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+            if usage is not None:
+                chunk["choices"], chunk["usage"] = [], usage
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        event({"role": "assistant", "content": ""})
+        if tool_call is not None:
+            time.sleep(delay / 2)
+            event({"tool_calls": [{"index": 0, "id": "call_stub", "type": "function",
+                                   "function": {"name": tool_call["name"], "arguments": json.dumps(tool_call["arguments"])}}]})
+            words = [json.dumps(tool_call)]
+        else:
+            for index, word in enumerate(words):
+                if index:
+                    time.sleep(delay / 2 / len(words))
+                event({"content": word})
+        event({}, finish_reason="tool_calls" if tool_call is not None else "stop")
+        if (body.get("stream_options") or {}).get("include_usage"):
+            event({}, usage={"prompt_tokens": 100, "completion_tokens": len(words), "total_tokens": 100 + len(words)})
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+class StubModelServer(ThreadingHTTPServer):
+    # The default backlog of 5 would make the stub itself the bottleneck under load.
+    request_queue_size = 256
+    daemon_threads = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats_lock = threading.Lock()
+        self.requests_received = 0
+        self.bytes_received = 0
+
+    def record_request(self, length):
+        with self.stats_lock:
+            self.requests_received += 1
+            self.bytes_received += length
+
+    def reset_stats(self):
+        with self.stats_lock:
+            self.requests_received = 0
+            self.bytes_received = 0
+
+
+def start_stub_server(host="127.0.0.1", port=0, latency=0.5, jitter=0.1, upload_bps=0,
+                      distribution="uniform", step_latency=None, replay=None):
+    """
+    Starts the stub server in a daemon thread and returns (server, base_url).
+    With `upload_bps` set, each request is also delayed by the time its body
+    would take to upload at that bandwidth. `replay` is a recordings file
+    whose responses (and latencies) are served for the steps it covers.
+    """
+    handler = type("ConfiguredStubModelHandler", (StubModelHandler,), {
+        "latency": latency, "jitter": jitter, "upload_bps": upload_bps, "distribution": distribution,
+        "step_latency": dict(step_latency or {}), "recordings": load_recordings(replay) if replay else None,
+    })
+    server = StubModelServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def parse_step_latency(values):
+    """Parses repeated STEP=SECONDS options into a dict."""
+    step_latency = {}
+    for value in values or []:
+        step, _, seconds = value.partition("=")
+        step_latency[step] = float(seconds)
+    return step_latency
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run an OpenAI-compatible stub model server.")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.5, help="Mean response delay in seconds.")
+    parser.add_argument("--jitter", type=float, default=0.1, help="Uniform +/- jitter in seconds (the shape for lognormal).")
+    parser.add_argument("--distribution", choices=DISTRIBUTIONS, default="uniform")
+    parser.add_argument("--step-latency", action="append", metavar="STEP=SECONDS", help="Mean delay for one step, e.g. summary=0.2.")
+    parser.add_argument("--replay", help="Recorded responses to replay (see bench/record_responses.py).")
+    parser.add_argument("--upload-mbps", type=float, default=0, help="Simulated upload bandwidth in Mbit/s (0 = unlimited).")
+    args = parser.parse_args()
+
+    server, url = start_stub_server(port=args.port, latency=args.latency, jitter=args.jitter, upload_bps=args.upload_mbps * 125_000,
+                                    distribution=args.distribution, step_latency=parse_step_latency(args.step_latency), replay=args.replay)
+    print(f"Stub model server listening on {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -1,22 +1,28 @@
 import os
-import base64
-import uuid
-from flask import Flask, request, jsonify, render_template, send_from_directory
-import traceback
+from flask import Flask, request, jsonify, Response, render_template, send_from_directory
 
-from agent.graph import create_graph
+from agent.jobs import JobQueue, wants_async
+from utils.session_store import create_session_store
+from server_common import (RequestError, SSE_HEADERS, start_agent, decode_image, submit_analysis, accepted_response,
+                           wait_for_job, find_job, cancel_job, start_batch, batch_lines, analysis_job_events,
+                           job_event_stream, prepare_chat, chat_event_stream, stats_views)
 
 app = Flask(__name__, static_folder='static', template_folder='templates')
 
-# Initialize the agent once on startup
-sessions = {}
-langgraph_app = None
+sessions = create_session_store()
 
-try:
-    langgraph_app = create_graph()
-except Exception as e:
-    print(f"FATAL: Could not create LangGraph agent on startup. Error: {e}")
-    traceback.print_exc()
+# The agent compiles in the background; requests that arrive before it is
+# ready wait for it.
+langgraph_future = start_agent()
+
+def agent_app():
+    """The compiled agent, or None if it could not be created."""
+    return langgraph_future.result()
+
+@app.errorhandler(RequestError)
+def request_error(e):
+    body, status, headers = e.response()
+    return jsonify(body), status, headers
 
 # --- Route to serve the main UI ---
 @app.route('/')
@@ -24,65 +30,86 @@ def index():
     """Serves the main index.html file."""
     return render_template('index.html')
 
+# --- Analysis Jobs ---
+def _analysis_job(job):
+    return analysis_job_events(agent_app(), *job.payload, sessions)
+
+jobs = JobQueue()
+jobs.start_threads(_analysis_job)
+
 # --- API Endpoints ---
 @app.route('/analyze', methods=['POST'])
 def analyze_image_endpoint():
-    if not langgraph_app:
-        return jsonify({"error": "Analysis agent is not available. Check server logs."}), 500
-
-    if 'image' not in request.get_json():
-        return jsonify({"error": "No image data provided in the request."}), 400
-        
-    image_data = base64.b64decode(request.get_json()['image'])
-    
-    temp_dir = "temp_images"
-    os.makedirs(temp_dir, exist_ok=True)
-    image_filename = os.path.join(temp_dir, f"{uuid.uuid4()}.jpg")
-    
-    try:
-        with open(image_filename, 'wb') as f:
-            f.write(image_data)
-
-        initial_state = {"image_path": image_filename}
-        final_state = langgraph_app.invoke(initial_state)
-        
-        raw_analysis = final_state.get("raw_analysis", "No detailed analysis was generated.")
-        summarized_analysis = final_state.get("analysis_result", "Error: No summary was generated.")
-        
-        if "API_ERROR" in summarized_analysis or "Analysis Failed" in summarized_analysis:
-            return jsonify({"error": summarized_analysis}), 500
-
-        session_id = str(uuid.uuid4())
-        sessions[session_id] = [("ai", raw_analysis)]
-        sessions[session_id].append(("ai", summarized_analysis))
-        
-        return jsonify({"analysis": summarized_analysis, "session_id": session_id})
-
-    except Exception as e:
-        print("--- UNHANDLED EXCEPTION IN /analyze ---")
-        traceback.print_exc()
-        print("------------------------------------")
-        return jsonify({"error": f"An unexpected server error occurred: {e}"}), 500
-    finally:
-        if os.path.exists(image_filename):
-            os.remove(image_filename)
+    """
+    Queues an analysis and waits for it. Clients sending "Prefer: respond-async"
+    (or "async": true) get 202 with the job ID at once instead, and follow it
+    at /jobs/<id>. Optional "priority": "high", "normal" or "low". A full queue
+    answers 429 with Retry-After.
+    """
+    data = request.get_json(silent=True) or {}
+    job = submit_analysis(jobs, decode_image(data), data)
+    body, status, headers = accepted_response(job) if wants_async(data, request.headers) else wait_for_job(job)
+    return jsonify(body), status, headers
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """A job's status, position in the queue, stages so far and, once finished, its result or error."""
+    return jsonify(jobs.describe(find_job(jobs, job_id)))
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job_endpoint(job_id):
+    """Cancels a queued or running job."""
+    return jsonify(cancel_job(jobs, find_job(jobs, job_id)))
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """Server-sent events for a job: its stages and summary tokens so far and as they happen, then "done", "error" or "cancelled"."""
+    job = find_job(jobs, job_id)
+    return Response(job_event_stream(jobs, job), mimetype='text/event-stream', headers=SSE_HEADERS)
+
+@app.route('/analyze/stream', methods=['POST'])
+def analyze_stream_endpoint():
+    """
+    Streaming version of /analyze using server-sent events: "stage" events as
+    the component is identified and analyzed, "token" events for each piece of
+    the summary, then "done" with the analysis and session_id (or "error").
+    The analysis runs as a queued job like /analyze (same "priority" and 429
+    when the queue is full); closing the stream cancels it.
+    """
+    data = request.get_json(silent=True) or {}
+    job = submit_analysis(jobs, decode_image(data), data)
+    return Response(job_event_stream(jobs, job, owner=True), mimetype='text/event-stream', headers={**SSE_HEADERS, 'X-Job-Id': job.id})
+
+@app.route('/analyze/batch', methods=['POST'])
+def analyze_batch_endpoint():
+    """
+    Analyzes a whole tray in one request. Accepts {"images": [...]} or one
+    {"image": ..., "boxes": [[x, y, w, h], ...]} and streams a JSON line per
+    component as soon as it finishes, then a final {"done": true} line. The
+    items run as queued jobs; closing the stream cancels the rest.
+    """
+    batch, boxes = start_batch(jobs, request.get_json(silent=True) or {})
+    return Response(batch_lines(batch, boxes), mimetype='application/x-ndjson')
 
 @app.route('/chat', methods=['POST'])
 def chat_endpoint():
-    data = request.get_json()
-    session_id, user_message = data.get('session_id'), data.get('message')
-    if not all([session_id, user_message]) or session_id not in sessions:
-        return jsonify({"error": "Invalid request. Missing session_id or message."}), 400
-    
-    chat_history = sessions[session_id]
-    chat_history.append(("human", user_message))
-    
+    session_id, user_message, chat_history = prepare_chat(request.get_json(silent=True) or {}, sessions)
+
     from agent.tools import continue_chat
     ai_response = continue_chat(chat_history)
-    
-    sessions[session_id].append(("ai", ai_response))
+
+    sessions.append(session_id, ("human", user_message), ("ai", ai_response))
     return jsonify({"response": ai_response})
 
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream_endpoint():
+    """Streaming version of /chat: "token" events as the reply is generated, then "done"."""
+    chat = prepare_chat(request.get_json(silent=True) or {}, sessions)
+    return Response(chat_event_stream(sessions, *chat), mimetype='text/event-stream', headers=SSE_HEADERS)
+
+for rule, view in stats_views(sessions, jobs):
+    app.add_url_rule(rule, view.__name__, view)
+
 @app.route('/shutdown', methods=['POST'])
 def shutdown():
     """Endpoint to shut down the server."""
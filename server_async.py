@@ -0,0 +1,133 @@
+import os
+import asyncio
+from quart import Quart, Response, request, jsonify, render_template
+
+from agent.jobs import JobQueue, wants_async
+from utils.session_store import create_session_store
+from server_common import (RequestError, SSE_HEADERS, start_agent, decode_image, submit_analysis, accepted_response,
+                           await_job, find_job, cancel_job, start_batch, abatch_lines, aanalysis_job_events,
+                           ajob_event_stream, aprepare_chat, achat_event_stream, stats_views)
+
+# An asyncio (ASGI) variant of server.py. The endpoints are the same, but every
+# model call is awaited instead of blocking a worker thread, so one process can
+# keep many analyses in flight at once. Run it with:
+#   hypercorn server_async:app --bind 127.0.0.1:5000
+app = Quart(__name__, static_folder='static', template_folder='templates')
+
+# Session store calls can block on SQLite, so they run in worker threads.
+sessions = create_session_store()
+
+# The agent compiles in the background; requests that arrive before it is
+# ready wait for it.
+langgraph_future = start_agent(use_async=True)
+
+async def agent_app():
+    """The compiled agent, or None if it could not be created."""
+    return await asyncio.wrap_future(langgraph_future)
+
+@app.errorhandler(RequestError)
+async def request_error(e):
+    body, status, headers = e.response()
+    return jsonify(body), status, headers
+
+# --- Route to serve the main UI ---
+@app.route('/')
+async def index():
+    """Serves the main index.html file."""
+    return await render_template('index.html')
+
+# --- Analysis Jobs ---
+async def _analysis_job(job):
+    async for event, payload in aanalysis_job_events(await agent_app(), *job.payload, sessions):
+        yield event, payload
+
+jobs = JobQueue()
+
+@app.before_serving
+async def start_job_workers():
+    """The workers are tasks on the server's event loop, so they can only start once it runs."""
+    jobs.start_tasks(_analysis_job)
+
+# --- API Endpoints ---
+@app.route('/analyze', methods=['POST'])
+async def analyze_image_endpoint():
+    """
+    Queues an analysis and waits for it. Clients sending "Prefer: respond-async"
+    (or "async": true) get 202 with the job ID at once instead, and follow it
+    at /jobs/<id>. Optional "priority": "high", "normal" or "low". A full queue
+    answers 429 with Retry-After.
+    """
+    data = await request.get_json(silent=True) or {}
+    job = submit_analysis(jobs, decode_image(data), data)
+    body, status, headers = accepted_response(job) if wants_async(data, request.headers) else await await_job(jobs, job)
+    return jsonify(body), status, headers
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+async def job_status(job_id):
+    """A job's status, position in the queue, stages so far and, once finished, its result or error."""
+    return jsonify(jobs.describe(find_job(jobs, job_id)))
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+async def cancel_job_endpoint(job_id):
+    """Cancels a queued or running job."""
+    return jsonify(cancel_job(jobs, find_job(jobs, job_id)))
+
+@app.route('/jobs/<job_id>/events')
+async def job_events(job_id):
+    """Server-sent events for a job: its stages and summary tokens so far and as they happen, then "done", "error" or "cancelled"."""
+    job = find_job(jobs, job_id)
+    return Response(ajob_event_stream(jobs, job), mimetype='text/event-stream', headers=SSE_HEADERS)
+
+@app.route('/analyze/stream', methods=['POST'])
+async def analyze_stream_endpoint():
+    """
+    Streaming version of /analyze using server-sent events: "stage" events as
+    the component is identified and analyzed, "token" events for each piece of
+    the summary, then "done" with the analysis and session_id (or "error").
+    The analysis runs as a queued job like /analyze (same "priority" and 429
+    when the queue is full); closing the stream cancels it.
+    """
+    data = await request.get_json(silent=True) or {}
+    job = submit_analysis(jobs, decode_image(data), data)
+    return Response(ajob_event_stream(jobs, job, owner=True), mimetype='text/event-stream', headers={**SSE_HEADERS, 'X-Job-Id': job.id})
+
+@app.route('/analyze/batch', methods=['POST'])
+async def analyze_batch_endpoint():
+    """
+    Analyzes a whole tray in one request. Accepts {"images": [...]} or one
+    {"image": ..., "boxes": [[x, y, w, h], ...]} and streams a JSON line per
+    component as soon as it finishes, then a final {"done": true} line. The
+    items run as queued jobs; closing the stream cancels the rest.
+    """
+    batch, boxes = start_batch(jobs, await request.get_json(silent=True) or {})
+    return abatch_lines(batch, boxes), 200, {'Content-Type': 'application/x-ndjson'}
+
+@app.route('/chat', methods=['POST'])
+async def chat_endpoint():
+    session_id, user_message, chat_history = await aprepare_chat(await request.get_json(silent=True) or {}, sessions)
+
+    from agent.tools import acontinue_chat
+    ai_response = await acontinue_chat(chat_history)
+
+    await asyncio.to_thread(sessions.append, session_id, ("human", user_message), ("ai", ai_response))
+    return jsonify({"response": ai_response})
+
+@app.route('/chat/stream', methods=['POST'])
+async def chat_stream_endpoint():
+    """Streaming version of /chat: "token" events as the reply is generated, then "done"."""
+    chat = await aprepare_chat(await request.get_json(silent=True) or {}, sessions)
+    return Response(achat_event_stream(sessions, *chat), mimetype='text/event-stream', headers=SSE_HEADERS)
+
+# Plain functions: Quart runs them in worker threads, which keeps SQLite session stats off the event loop.
+for rule, view in stats_views(sessions, jobs):
+    app.add_url_rule(rule, view.__name__, view)
+
+@app.route('/shutdown', methods=['POST'])
+async def shutdown():
+    """Endpoint to shut down the server."""
+    print("Shutdown request received. Terminating server.")
+    os._exit(0)
+
+
+if __name__ == '__main__':
+    app.run(host='127.0.0.1', port=5000)
@@ -0,0 +1,397 @@
+import json
+import asyncio
+import base64
+import binascii
+import traceback
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from agent.speculation import speculation_stats
+from agent.tracing import render_metrics
+from agent.jobs import DONE, JOB_WAIT_SECONDS, JobBatch, QueueFullError, job_response
+from utils import startup
+from utils.startup import startup_stats
+
+# The request handling shared by server.py, server_async.py and server_pi.py:
+# parsing request bodies, queueing analysis jobs, streaming their events and
+# building the response bodies. None of it depends on the web framework; each
+# server keeps only its routes and the framework glue around these functions.
+#
+# The servers import this module before they bind, so it only imports
+# lightweight modules at the top. The analysis pipeline, model router and
+# tools load LangChain, LangGraph and OpenCV; they are imported inside the
+# functions that need them, once the agent is compiling in the background.
+
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+
+def format_sse(event, data):
+    """Formats one server-sent event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class RequestError(Exception):
+    """
+    A request that can't be served. Every server registers a handler that
+    answers {"error": message, **details} with `status` and `headers`.
+    """
+    def __init__(self, message, status=400, headers=None, details=None):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.headers = headers or {}
+        self.details = details or {}
+
+    def response(self):
+        """(body, status, headers) for the framework's jsonify."""
+        return {"error": self.message, **self.details}, self.status, self.headers
+
+
+# --- 1. Agent ---
+
+def _create_agent(use_async):
+    # Imported here so the server binds (and the UI window shows) while
+    # LangGraph and LangChain are still loading.
+    from agent.graph import create_graph
+    try:
+        return create_graph(use_async=use_async)
+    except Exception as e:
+        print(f"FATAL: Could not create LangGraph agent on startup. Error: {e}")
+        traceback.print_exc()
+        return None
+
+
+def start_agent(use_async=False):
+    """
+    Compiles the agent in the background and returns a Future for it (None
+    if it could not be created); requests that arrive before it is ready wait.
+    """
+    return startup.in_background("agent", _create_agent, use_async)
+
+
+# --- 2. Analysis Requests and Jobs ---
+
+def decode_image(data):
+    """(image_bytes, image_b64) for an {"image": base64} request body."""
+    if not data.get('image'):
+        raise RequestError("No image data provided in the request.")
+    try:
+        return base64.b64decode(data['image']), data['image']
+    except (ValueError, binascii.Error) as e:
+        raise RequestError(f"Invalid image data: {e}")
+
+
+def submit_analysis(jobs, payload, data):
+    """Queues an analysis at the request's "priority"; a full queue answers 429 with Retry-After."""
+    try:
+        return jobs.submit(payload, data.get("priority", "normal"))
+    except QueueFullError as e:
+        raise RequestError(str(e), 429, {"Retry-After": str(e.retry_after)})
+    except ValueError as e:
+        raise RequestError(str(e))
+
+
+def accepted_response(job):
+    """(body, status, headers) for a job handed back to an async client instead of awaited."""
+    return {"job_id": job.id, "status_url": f"/jobs/{job.id}"}, 202, {"Location": f"/jobs/{job.id}"}
+
+
+def wait_for_job(job):
+    """
+    (body, status, headers) for a synchronous /analyze: the job's result, or
+    202 with its ID if it hasn't finished within JOB_WAIT_SECONDS (stuck
+    behind a long queue or a hung worker), so the request thread is freed.
+    """
+    try:
+        return job_response(job.future.result(JOB_WAIT_SECONDS))
+    except FutureTimeoutError:
+        return accepted_response(job)
+
+
+async def await_job(jobs, job):
+    """Async counterpart of wait_for_job. A client that disconnects while waiting cancels the job."""
+    try:
+        # Shielded: cancelling this request must not cancel the job's own future.
+        finished = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(job.future)), JOB_WAIT_SECONDS)
+    except asyncio.TimeoutError:
+        return accepted_response(job)
+    except asyncio.CancelledError:
+        jobs.cancel(job)  # The client went away
+        raise
+    return job_response(finished)
+
+
+def find_job(jobs, job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        raise RequestError("Unknown or expired job.", 404)
+    return job
+
+
+def cancel_job(jobs, job):
+    """Cancels a queued or running job and returns its status; 409 if it had already finished."""
+    if not jobs.cancel(job):
+        raise RequestError("The job has already finished.", 409, details=jobs.describe(job))
+    return jobs.describe(job)
+
+
+def _analysis_outcome(final_state):
+    """(raw_analysis, summarized_analysis, error) for a finished graph run."""
+    raw_analysis = final_state.get("raw_analysis", "No detailed analysis was generated.")
+    summarized_analysis = final_state.get("analysis_result", "Error: No summary was generated.")
+    if "API_ERROR" in summarized_analysis or "Analysis Failed" in summarized_analysis:
+        return raw_analysis, summarized_analysis, summarized_analysis
+    return raw_analysis, summarized_analysis, None
+
+
+def analysis_job_events(langgraph_app, image_data, image_b64, sessions):
+    """
+    Runs one queued analysis: its stage and token events, then "done" with
+    the /analyze response body or "error".
+    """
+    if not langgraph_app:
+        yield "error", {"error": "Analysis agent is not available. Check server logs."}
+        return
+
+    from agent.pipeline import stream_analysis
+    for event, payload in stream_analysis(langgraph_app, image_data, image_b64):
+        if event != "done":
+            yield event, payload
+            continue
+
+        raw_analysis, summarized_analysis, error = _analysis_outcome(payload)
+        if error:
+            yield "error", {"error": error}
+            return
+        session_id = sessions.create([("ai", raw_analysis), ("ai", summarized_analysis)])
+        yield "done", {"analysis": summarized_analysis, "session_id": session_id, "component_type": payload.get("component_type")}
+
+
+async def aanalysis_job_events(langgraph_app, image_data, image_b64, sessions):
+    """Async counterpart of analysis_job_events; session store calls run in worker threads."""
+    if not langgraph_app:
+        yield "error", {"error": "Analysis agent is not available. Check server logs."}
+        return
+
+    from agent.pipeline import astream_analysis
+    async for event, payload in astream_analysis(langgraph_app, image_data, image_b64):
+        if event != "done":
+            yield event, payload
+            continue
+
+        raw_analysis, summarized_analysis, error = _analysis_outcome(payload)
+        if error:
+            yield "error", {"error": error}
+            return
+        session_id = await asyncio.to_thread(sessions.create, [("ai", raw_analysis), ("ai", summarized_analysis)])
+        yield "done", {"analysis": summarized_analysis, "session_id": session_id, "component_type": payload.get("component_type")}
+
+
+def job_event_stream(jobs, job, owner=False):
+    """
+    Server-sent events for a job: the events it has published so far, then each
+    one as it happens, until "done", "error" or "cancelled". The owner's stream
+    (/analyze/stream) cancels the job if the client goes away before the end.
+    """
+    sent, finished = 0, False
+    try:
+        while not finished:
+            events, finished = job.wait_events(sent, timeout=15.0)
+            sent += len(events)
+            for event, payload in events:
+                yield format_sse(event, payload)
+            if not events and not finished:
+                yield ": keep-alive\n\n"
+    finally:
+        if owner and not finished:
+            jobs.cancel(job)
+
+
+async def ajob_event_stream(jobs, job, owner=False):
+    """Async counterpart of job_event_stream: waits on the event loop instead of holding a thread."""
+    sent, finished = 0, False
+    try:
+        while not finished:
+            events, finished = await job.await_events(sent, timeout=15.0)
+            sent += len(events)
+            for event, payload in events:
+                yield format_sse(event, payload)
+            if not events and not finished:
+                yield ": keep-alive\n\n"
+    finally:
+        if owner and not finished:
+            jobs.cancel(job)
+
+
+def start_batch(jobs, data, payload=None):
+    """
+    Validates an /analyze/batch body and queues its items as jobs (at "low"
+    priority unless the body says otherwise, so single scans go first).
+    Returns (batch, boxes); `payload` turns an (image_bytes, image_b64) pair
+    into the server's job payload. A queue too full for even the first item
+    answers 429 with Retry-After.
+    """
+    from agent.pipeline import parse_batch_request, BATCH_CONCURRENCY
+    try:
+        images, boxes = parse_batch_request(data)
+    except ValueError as e:
+        raise RequestError(str(e))
+    payloads = [payload(image) if payload else image for image in images]
+    try:
+        batch = JobBatch(jobs, payloads, data.get("priority", "low"), BATCH_CONCURRENCY).start()
+    except QueueFullError as e:
+        raise RequestError(str(e), 429, {"Retry-After": str(e.retry_after)})
+    except ValueError as e:
+        raise RequestError(str(e))
+    return batch, boxes
+
+
+def batch_item(index, job, boxes=None):
+    """The JSON line streamed back for one finished batch item."""
+    item = {"index": index}
+    if boxes is not None:
+        item["box"] = boxes[index]
+    if job.state == DONE:
+        item.update(job.result)
+    else:
+        item["error"] = job.error
+    return item
+
+
+def batch_lines(batch, boxes):
+    """
+    Streams a JSON line per item as it finishes, then {"done": true}. A client
+    that disconnects closes the stream, which cancels the items not yet run.
+    """
+    try:
+        for index, job in batch:
+            yield json.dumps(batch_item(index, job, boxes)) + "\n"
+        yield json.dumps({"done": True, "count": len(batch.payloads)}) + "\n"
+    finally:
+        batch.close()
+
+
+async def abatch_lines(batch, boxes):
+    """Async counterpart of batch_lines."""
+    try:
+        async for index, job in batch:
+            yield json.dumps(batch_item(index, job, boxes)) + "\n"
+        yield json.dumps({"done": True, "count": len(batch.payloads)}) + "\n"
+    finally:
+        batch.close()
+
+
+# --- 3. Chat ---
+
+def _chat_request(data):
+    session_id, user_message = data.get('session_id'), data.get('message')
+    if not all([session_id, user_message]):
+        raise RequestError("Invalid request. Missing session_id or message.")
+    return session_id, user_message
+
+
+def prepare_chat(data, sessions):
+    """
+    Validates a /chat body and returns (session_id, message, history), the
+    history compacted first if it has grown too long and ending with the new
+    message.
+    """
+    session_id, user_message = _chat_request(data)
+    chat_history = sessions.get(session_id)
+    if chat_history is None:
+        raise RequestError("Invalid request. Missing session_id or message.")
+
+    from agent.tools import compact_chat_history
+    compacted = compact_chat_history(chat_history)
+    if compacted is not None:
+        sessions.replace(session_id, compacted)
+        chat_history = compacted
+    chat_history.append(("human", user_message))
+    return session_id, user_message, chat_history
+
+
+async def aprepare_chat(data, sessions):
+    """Async counterpart of prepare_chat."""
+    session_id, user_message = _chat_request(data)
+    chat_history = await asyncio.to_thread(sessions.get, session_id)
+    if chat_history is None:
+        raise RequestError("Invalid request. Missing session_id or message.")
+
+    from agent.tools import acompact_chat_history
+    compacted = await acompact_chat_history(chat_history)
+    if compacted is not None:
+        await asyncio.to_thread(sessions.replace, session_id, compacted)
+        chat_history = compacted
+    chat_history.append(("human", user_message))
+    return session_id, user_message, chat_history
+
+
+def chat_event_stream(sessions, session_id, user_message, chat_history):
+    """Server-sent events for a /chat/stream reply: "token" events, then "done"; the exchange is stored at the end."""
+    from agent.tools import stream_chat
+    parts = []
+    for text in stream_chat(chat_history):
+        parts.append(text)
+        yield format_sse("token", {"text": text})
+    ai_response = "".join(parts)
+    sessions.append(session_id, ("human", user_message), ("ai", ai_response))
+    yield format_sse("done", {"response": ai_response})
+
+
+async def achat_event_stream(sessions, session_id, user_message, chat_history):
+    """Async counterpart of chat_event_stream."""
+    from agent.tools import astream_chat
+    parts = []
+    async for text in astream_chat(chat_history):
+        parts.append(text)
+        yield format_sse("token", {"text": text})
+    ai_response = "".join(parts)
+    await asyncio.to_thread(sessions.append, session_id, ("human", user_message), ("ai", ai_response))
+    yield format_sse("done", {"response": ai_response})
+
+
+# --- 4. Stats ---
+
+def stats_views(sessions, jobs):
+    """
+    (rule, view) pairs for the stats and metrics routes every server exposes.
+    The views are plain functions returning a dict (or the metrics text), so
+    Flask and Quart can both register them with add_url_rule.
+    """
+    def session_stats():
+        """Reports session counts and eviction counters."""
+        return sessions.stats()
+
+    def speculation_stats_route():
+        """Reports speculative analysis hits, extra model calls and time saved (AGENT_GRAPH_MODE=speculative)."""
+        return speculation_stats()
+
+    def model_stats():
+        """
+        Reports per-model and per-step calls, escalations, latency and estimated
+        cost, the routing table, and each provider's retries, failovers and
+        circuit breaker state.
+        """
+        from agent.model_client import model_client_stats
+        from agent.model_router import model_router_stats
+        return {**model_router_stats(), "providers": model_client_stats()}
+
+    def job_stats():
+        """Reports queued and running jobs, rejections and cancellations."""
+        return jobs.stats()
+
+    def startup_stats_route():
+        """Reports how long after launch the agent (and on the Pi, the camera) was ready."""
+        return startup_stats()
+
+    def metrics():
+        """Prometheus metrics: duration histograms and p50/p95/p99 per graph node, model call and image step, plus token and retry counters."""
+        return render_metrics(), 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
+    return [
+        ('/sessions/stats', session_stats),
+        ('/speculation/stats', speculation_stats_route),
+        ('/models/stats', model_stats),
+        ('/jobs/stats', job_stats),
+        ('/startup/stats', startup_stats_route),
+        ('/metrics', metrics),
+    ]
@@ -1,22 +1,56 @@
 import os
-import base64
+import time
 import uuid
+import base64
+import threading
+from collections import OrderedDict
 from flask import Flask, request, jsonify, Response, render_template
-import traceback
-import cv2
 
-from agent.graph import create_graph
-from utils.camera_pi import generate_frames
+from agent import tracing
+from agent.jobs import JobQueue, wants_async
+from utils.session_store import create_session_store
+from utils.camera_pi import generate_frames, encode_still, encode_thumbnail
+from server_common import (RequestError, SSE_HEADERS, start_agent, decode_image, submit_analysis, accepted_response,
+                           wait_for_job, find_job, cancel_job, start_batch, batch_lines, analysis_job_events,
+                           job_event_stream, prepare_chat, chat_event_stream, stats_views)
 
 camera = None
+# Set by app_pi.py, which starts the camera in the background; requests that
+# need the camera before it is up wait for it.
+camera_future = None
+CAMERA_START_TIMEOUT = 15.0
 app = Flask(__name__, static_folder='static', template_folder='templates')
-sessions = {}
-langgraph_app = None
+sessions = create_session_store()
+
+# Recently captured frames, held server-side so /analyze can be pointed at a
+# frame_id and the browser never handles the full-resolution JPEG at all: it
+# shows a thumbnail and sends the id back.
+captured_frames = OrderedDict()  # frame_id -> (jpeg_bytes, base64, capture_ms, thumbnail_jpeg)
+captured_frames_lock = threading.Lock()
+CAPTURED_FRAMES_MAX = 8
+
+# The agent compiles in the background; requests that arrive before it is
+# ready wait for it.
+langgraph_future = start_agent()
+
+def agent_app():
+    """The compiled agent, or None if it could not be created."""
+    return langgraph_future.result()
+
+def get_camera():
+    """The camera, once app_pi.py has started it, or None if there is none."""
+    global camera
+    if camera is None and camera_future is not None:
+        try:
+            camera = camera_future.result(CAMERA_START_TIMEOUT)
+        except Exception:
+            return None
+    return camera
 
-try:
-    langgraph_app = create_graph()
-except Exception as e:
-    print(f"FATAL: Could not create LangGraph agent. Error: {e}")
+@app.errorhandler(RequestError)
+def request_error(e):
+    body, status, headers = e.response()
+    return jsonify(body), status, headers
 
 @app.route('/')
 def index():
@@ -25,78 +59,165 @@ def index():
 
 @app.route('/video_feed')
 def video_feed():
+    camera = get_camera()
     if camera is None: return "Error: Camera not initialized.", 500
     return Response(generate_frames(camera), mimetype='multipart/x-mixed-replace; boundary=frame')
 
 @app.route('/capture_frame', methods=['POST'])
 def capture_frame():
+    """
+    Captures a full-resolution still (the preview stream keeps running) and
+    keeps it on the server. Returns a frame_id that /analyze accepts in place
+    of the image, and the URL of a thumbnail for the UI to show.
+    """
+    camera = get_camera()
     if camera is None: return jsonify({"error": "Camera not initialized."}), 500
-    frame = camera.get_frame()
+    start = time.perf_counter()
+    frame = camera.capture_still()
+    captured = time.perf_counter()
     if frame is not None:
-        _, buffer = cv2.imencode('.jpg', frame)
-        frame_base64 = base64.b64encode(buffer).decode('utf-8')
-        return jsonify({"image": frame_base64})
+        with tracing.span("jpeg_encode", source="still"):
+            jpeg_bytes = encode_still(frame)
+        if jpeg_bytes:
+            frame_base64 = base64.b64encode(jpeg_bytes).decode('utf-8')
+            timing = {"capture_ms": round((captured - start) * 1000, 1), "encode_ms": round((time.perf_counter() - captured) * 1000, 1)}
+            print(f"Captured {frame.shape[1]}x{frame.shape[0]} still: {timing['capture_ms']} ms capture, {timing['encode_ms']} ms encode.")
+            with tracing.span("jpeg_encode", source="thumbnail"):
+                thumbnail = encode_thumbnail(frame)
+            frame_id = str(uuid.uuid4())
+            with captured_frames_lock:
+                captured_frames[frame_id] = (jpeg_bytes, frame_base64, timing["capture_ms"] + timing["encode_ms"], thumbnail)
+                while len(captured_frames) > CAPTURED_FRAMES_MAX:
+                    captured_frames.popitem(last=False)
+            return jsonify({"frame_id": frame_id, "thumbnail_url": f"/captured_frames/{frame_id}/thumbnail", "timing": timing})
     return jsonify({"error": "Failed to capture frame."}), 500
 
-# The /analyze and /chat endpoints are identical to the desktop server.py
+def _captured_frame(frame_id):
+    """A frame held by /capture_frame; 410 once it has been evicted by newer captures."""
+    if not isinstance(frame_id, str):
+        raise RequestError("'frame_id' must be a string.")
+    with captured_frames_lock:
+        frame = captured_frames.get(frame_id)
+    if frame is None:
+        raise RequestError("The captured frame has expired. Please capture it again.", 410)
+    return frame
+
+@app.route('/captured_frames/<frame_id>/thumbnail')
+def captured_frame_thumbnail(frame_id):
+    """The thumbnail of a captured frame, for the UI's confirmation and analysis views."""
+    return Response(_captured_frame(frame_id)[3], mimetype='image/jpeg')
+
+@app.route('/camera/stats')
+def camera_stats():
+    """Reports the measured capture rate, dropped-frame counters and still capture latency."""
+    camera = get_camera()
+    if camera is None: return jsonify({"error": "Camera not initialized."}), 500
+    return jsonify(camera.stats())
+
+def _request_image(data):
+    """
+    Returns (image_bytes, image_b64, capture_ms) for an analysis request, taken
+    either from a previously captured frame ({"frame_id": ...}) or the uploaded
+    image ({"image": ...}). capture_ms is the time spent capturing and
+    encoding the frame, or None for uploads.
+    """
+    if data.get('frame_id') is not None:
+        return _captured_frame(data['frame_id'])[:3]
+    return (*decode_image(data), None)
+
+def _timing(capture_ms, analysis_start):
+    """Reports analysis time and, for captured frames, the capture-to-result latency."""
+    timing = {"analysis_ms": round((time.perf_counter() - analysis_start) * 1000, 1)}
+    if capture_ms is not None:
+        timing["capture_to_result_ms"] = round(capture_ms + timing["analysis_ms"], 1)
+        print(f"Capture-to-result latency: {timing['capture_to_result_ms']} ms.")
+    return timing
+
+# --- Analysis Jobs ---
+def _analysis_job(job):
+    """Runs one queued analysis, adding capture-to-result timing to its result."""
+    image_data, image_b64, capture_ms, start = job.payload
+    for event, payload in analysis_job_events(agent_app(), image_data, image_b64, sessions):
+        if event == "done":
+            payload["timing"] = _timing(capture_ms, start)
+        yield event, payload
+
+jobs = JobQueue()
+jobs.start_threads(_analysis_job)
+
+# The /analyze, /jobs and /chat endpoints are identical to the desktop server.py
 @app.route('/analyze', methods=['POST'])
 def analyze_image_endpoint():
-    if not langgraph_app:
-        return jsonify({"error": "Analysis agent is not available. Check server logs."}), 500
-
-    if 'image' not in request.get_json():
-        return jsonify({"error": "No image data provided in the request."}), 400
-        
-    image_data = base64.b64decode(request.get_json()['image'])
-    
-    temp_dir = "temp_images"
-    os.makedirs(temp_dir, exist_ok=True)
-    image_filename = os.path.join(temp_dir, f"{uuid.uuid4()}.jpg")
-    
-    try:
-        with open(image_filename, 'wb') as f:
-            f.write(image_data)
-
-        initial_state = {"image_path": image_filename}
-        final_state = langgraph_app.invoke(initial_state)
-        
-        raw_analysis = final_state.get("raw_analysis", "No detailed analysis was generated.")
-        summarized_analysis = final_state.get("analysis_result", "Error: No summary was generated.")
-        
-        if "API_ERROR" in summarized_analysis or "Analysis Failed" in summarized_analysis:
-            return jsonify({"error": summarized_analysis}), 500
-
-        session_id = str(uuid.uuid4())
-        sessions[session_id] = [("ai", raw_analysis)]
-        sessions[session_id].append(("ai", summarized_analysis))
-        
-        return jsonify({"analysis": summarized_analysis, "session_id": session_id})
-
-    except Exception as e:
-        print("--- UNHANDLED EXCEPTION IN /analyze ---")
-        traceback.print_exc()
-        print("------------------------------------")
-        return jsonify({"error": f"An unexpected server error occurred: {e}"}), 500
-    finally:
-        if os.path.exists(image_filename):
-            os.remove(image_filename)
+    """
+    Queues an analysis and waits for it. Clients sending "Prefer: respond-async"
+    (or "async": true) get 202 with the job ID at once instead, and follow it
+    at /jobs/<id>. Optional "priority": "high", "normal" or "low". A full queue
+    answers 429 with Retry-After.
+    """
+    data = request.get_json(silent=True) or {}
+    job = submit_analysis(jobs, (*_request_image(data), time.perf_counter()), data)
+    body, status, headers = accepted_response(job) if wants_async(data, request.headers) else wait_for_job(job)
+    return jsonify(body), status, headers
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """A job's status, position in the queue, stages so far and, once finished, its result or error."""
+    return jsonify(jobs.describe(find_job(jobs, job_id)))
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job_endpoint(job_id):
+    """Cancels a queued or running job."""
+    return jsonify(cancel_job(jobs, find_job(jobs, job_id)))
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """Server-sent events for a job: its stages and summary tokens so far and as they happen, then "done", "error" or "cancelled"."""
+    job = find_job(jobs, job_id)
+    return Response(job_event_stream(jobs, job), mimetype='text/event-stream', headers=SSE_HEADERS)
+
+@app.route('/analyze/stream', methods=['POST'])
+def analyze_stream_endpoint():
+    """
+    Streaming version of /analyze using server-sent events: "stage" events as
+    the component is identified and analyzed, "token" events for each piece of
+    the summary, then "done" with the analysis and session_id (or "error").
+    The analysis runs as a queued job like /analyze (same "priority" and 429
+    when the queue is full); closing the stream cancels it.
+    """
+    data = request.get_json(silent=True) or {}
+    job = submit_analysis(jobs, (*_request_image(data), time.perf_counter()), data)
+    return Response(job_event_stream(jobs, job, owner=True), mimetype='text/event-stream', headers={**SSE_HEADERS, 'X-Job-Id': job.id})
+
+@app.route('/analyze/batch', methods=['POST'])
+def analyze_batch_endpoint():
+    """
+    Analyzes a whole tray in one request. Accepts {"images": [...]} or one
+    {"image": ..., "boxes": [[x, y, w, h], ...]} and streams a JSON line per
+    component as soon as it finishes, then a final {"done": true} line. The
+    items run as queued jobs; closing the stream cancels the rest.
+    """
+    batch, boxes = start_batch(jobs, request.get_json(silent=True) or {}, payload=lambda image: (*image, None, time.perf_counter()))
+    return Response(batch_lines(batch, boxes), mimetype='application/x-ndjson')
 
 @app.route('/chat', methods=['POST'])
 def chat_endpoint():
-    data = request.get_json()
-    session_id, user_message = data.get('session_id'), data.get('message')
-    if not all([session_id, user_message]) or session_id not in sessions:
-        return jsonify({"error": "Invalid request. Missing session_id or message."}), 400
-    
-    chat_history = sessions[session_id]
-    chat_history.append(("human", user_message))
-    
+    session_id, user_message, chat_history = prepare_chat(request.get_json(silent=True) or {}, sessions)
+
     from agent.tools import continue_chat
     ai_response = continue_chat(chat_history)
-    
-    sessions[session_id].append(("ai", ai_response))
+
+    sessions.append(session_id, ("human", user_message), ("ai", ai_response))
     return jsonify({"response": ai_response})
 
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream_endpoint():
+    """Streaming version of /chat: "token" events as the reply is generated, then "done"."""
+    chat = prepare_chat(request.get_json(silent=True) or {}, sessions)
+    return Response(chat_event_stream(sessions, *chat), mimetype='text/event-stream', headers=SSE_HEADERS)
+
+for rule, view in stats_views(sessions, jobs):
+    app.add_url_rule(rule, view.__name__, view)
+
 @app.route('/shutdown', methods=['POST'])
 def shutdown():
     """Endpoint to shut down the server."""
@@ -0,0 +1,18 @@
+import os
+import sys
+
+# The tests import the agent modules directly. agent/tools.py refuses to load
+# without provider settings, so placeholders are set here; no test reaches a
+# model. The analysis cache is turned off so importing the pipeline doesn't
+# open cache/analysis_cache.sqlite3, and tests that need one build their own.
+for name, value in {
+    "DO_API_BASE": "http://127.0.0.1:9/v1",
+    "DO_API_KEY": "test",
+    "GOOGLE_API_KEY": "test",
+    "DO_CHAT_MODEL": "test-chat",
+    "ANALYSIS_CACHE_ENABLED": "0",
+    "TRACE_FILE": "",
+}.items():
+    os.environ.setdefault(name, value)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
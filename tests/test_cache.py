@@ -0,0 +1,89 @@
+import time
+
+import pytest
+
+from agent import cache, model_router
+
+
+@pytest.fixture
+def analysis_cache(tmp_path):
+    store = cache.AnalysisCache(path=str(tmp_path / "cache.sqlite3"), max_entries=3, ttl_seconds=60)
+    yield store
+    store.conn.close()
+
+
+STATE = {"component_type": "Resistor", "raw_analysis": "10 kΩ", "analysis_result": "- **Resistance:** 10 kΩ",
+         "analysis_fields": None, "session_id": "not cached"}
+
+
+def test_key_depends_on_image(analysis_cache):
+    assert analysis_cache.key_for(b"a") == analysis_cache.key_for(b"a")
+    assert analysis_cache.key_for(b"a") != analysis_cache.key_for(b"b")
+
+
+def test_key_changes_with_fingerprint(analysis_cache):
+    before = analysis_cache.key_for(b"image")
+    analysis_cache.fingerprint = "0123456789abcdef"
+    assert analysis_cache.key_for(b"image") != before
+
+
+def test_put_then_get_keeps_only_cached_fields(analysis_cache):
+    analysis_cache.put(b"image", STATE)
+    assert analysis_cache.get(b"image") == {field: STATE[field] for field in cache.CACHED_FIELDS}
+    assert analysis_cache.get(b"other image") is None
+
+
+def test_expired_entries_are_misses(analysis_cache, monkeypatch):
+    analysis_cache.put(b"image", STATE)
+    now = time.time()
+    monkeypatch.setattr(cache.time, "time", lambda: now + 61)
+    assert analysis_cache.get(b"image") is None
+    assert len(analysis_cache) == 0
+
+
+def test_least_recently_used_entries_are_evicted(analysis_cache, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(cache.time, "time", lambda: clock[0])
+    for image in (b"a", b"b", b"c"):
+        analysis_cache.put(image, STATE)
+        clock[0] += 1
+    assert analysis_cache.get(b"a") is not None  # "b" is now the least recently used
+    clock[0] += 1
+    analysis_cache.put(b"d", STATE)
+    assert len(analysis_cache) == 3
+    assert analysis_cache.get(b"b") is None
+    assert analysis_cache.get(b"a") is not None
+
+
+def test_entries_from_another_fingerprint_are_dropped_on_open(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    first = cache.AnalysisCache(path=path)
+    first.put(b"image", STATE)
+    first.conn.execute("UPDATE analyses SET fingerprint = 'stale'")
+    first.conn.commit()
+    first.conn.close()
+    second = cache.AnalysisCache(path=path)
+    assert len(second) == 0
+    second.conn.close()
+
+
+def test_fingerprint_follows_model_routes():
+    routes = dict(model_router.ROUTES)
+    before = cache.cache_fingerprint()
+    try:
+        model_router.set_routes({**routes, "summary": ["do:another-model"]})
+        assert cache.cache_fingerprint() != before
+    finally:
+        model_router.set_routes(routes)
+    assert cache.cache_fingerprint() == before
+
+
+@pytest.mark.parametrize("state, cacheable", [
+    (STATE, True),
+    ({**STATE, "error": "boom"}, False),
+    ({**STATE, "analysis_result": ""}, False),
+    ({**STATE, "raw_analysis": "API_ERROR: quota"}, False),
+    ({**STATE, "analysis_result": "Failed to process the image."}, False),
+])
+def test_is_cacheable(state, cacheable):
+    assert cache.is_cacheable(state) is cacheable
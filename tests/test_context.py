@@ -0,0 +1,54 @@
+from agent import context
+
+ANALYSIS = ("human", "x" * 4000)
+KEY_SPECS = ("ai", "- **Resistance:** 10 kΩ")
+
+
+def _turns(count, size=40):
+    return [("human" if i % 2 == 0 else "ai", f"{i:02d}" + "y" * (size - 2)) for i in range(count)]
+
+
+def test_estimate_tokens_rounds_up():
+    assert [context.estimate_tokens(text) for text in ("", "a", "abcd", "abcde")] == [0, 1, 1, 2]
+
+
+def test_split_history():
+    history = [ANALYSIS, KEY_SPECS, (context.SUMMARY_ROLE, "earlier"), *_turns(2)]
+    assert context.split_history(history) == (ANALYSIS[1], KEY_SPECS[1], "earlier", _turns(2))
+
+
+def test_short_analysis_is_sent_whole():
+    history = [("human", "short analysis"), KEY_SPECS]
+    assert context.essential_analysis(history, max_tokens=100) == "short analysis"
+
+
+def test_long_analysis_is_cut_to_budget_and_led_by_key_specs():
+    essential = context.essential_analysis([ANALYSIS, KEY_SPECS], max_tokens=100)
+    assert essential.startswith(KEY_SPECS[1])
+    assert "Details: xxx" in essential and essential.endswith(" ...")
+    assert context.estimate_tokens(essential) < 120
+
+
+def test_recent_turns_keep_the_newest_that_fit():
+    turns = _turns(6, size=40)  # 10 tokens each
+    assert context.recent_turns(turns, 25) == turns[-2:]
+    assert context.recent_turns(turns, 1000) == turns
+    # The last turn is always kept, even over budget.
+    assert context.recent_turns(turns, 0) == turns[-1:]
+
+
+def test_needs_compaction_only_past_the_budget():
+    recent = context.CHAT_RECENT_MESSAGES
+    assert not context.needs_compaction([ANALYSIS, KEY_SPECS, *_turns(recent, size=4000)], budget=100, analysis_tokens=0)
+    history = [ANALYSIS, KEY_SPECS, *_turns(recent + 2, size=40)]
+    assert not context.needs_compaction(history, budget=10_000, analysis_tokens=0)
+    assert context.needs_compaction(history, budget=50, analysis_tokens=0)
+
+
+def test_compaction_folds_all_but_the_recent_turns():
+    turns = _turns(context.CHAT_RECENT_MESSAGES + 3)
+    history = [ANALYSIS, KEY_SPECS, (context.SUMMARY_ROLE, "earlier"), *turns]
+    previous, fold, keep = context.compaction_plan(history)
+    assert previous == "earlier"
+    assert fold == turns[:3] and keep == turns[3:]
+    assert context.compacted_history(history, "newer", keep) == [ANALYSIS, KEY_SPECS, (context.SUMMARY_ROLE, "newer"), *keep]
@@ -0,0 +1,84 @@
+import pytest
+
+from agent.jobs import CANCELLED, DONE, QUEUED, RUNNING, JobQueue, QueueFullError, wants_async
+
+
+@pytest.fixture
+def queue():
+    # No workers are started: the tests take jobs themselves.
+    return JobQueue(workers=2, max_queued=3, ttl=60)
+
+
+def test_jobs_are_taken_by_priority_then_age(queue):
+    low = queue.submit("low", priority="low")
+    first = queue.submit("first")
+    high = queue.submit("high", priority="high")
+    assert [queue.position(job) for job in (high, first, low)] == [0, 1, 2]
+    assert [queue.take(0).payload for _ in range(3)] == ["high", "first", "low"]
+    assert queue.take(0) is None
+
+
+def test_unknown_priority_is_rejected(queue):
+    with pytest.raises(ValueError, match="Unknown priority"):
+        queue.submit("image", priority="urgent")
+
+
+def test_full_queue_raises_with_retry_after(queue):
+    for i in range(3):
+        queue.submit(i)
+    with pytest.raises(QueueFullError) as error:
+        queue.submit(3)
+    assert error.value.retry_after >= 1
+    assert queue.counts["rejected"] == 1
+    # Taking a job frees its slot.
+    queue.take(0)
+    queue.submit(4)
+
+
+def test_cancelling_a_queued_job_removes_it(queue):
+    keep = queue.submit("keep")
+    drop = queue.submit("drop", priority="high")
+    assert queue.cancel(drop)
+    assert drop.state == CANCELLED
+    assert drop.payload is None
+    assert drop.future.done()
+    assert drop.events[-1][0] == "cancelled"
+    assert [job for _, _, job in queue.heap] == [keep]
+    assert queue.queued == 1
+    assert queue.take(0) is keep
+    assert queue.take(0) is None
+
+
+def test_cancelling_a_running_job_stops_it_at_its_next_event(queue):
+    job = queue.submit("image")
+    assert queue.take(0) is job and job.state == RUNNING
+    assert queue.cancel(job)
+    assert job.state == RUNNING
+    assert queue._handle(job, "stage", {"stage": "identify"})
+    assert job.state == CANCELLED and queue.running == 0
+
+
+def test_finished_jobs_cannot_be_cancelled(queue):
+    job = queue.submit("image")
+    queue.take(0)
+    queue._handle(job, "done", {"analysis": "ok"})
+    assert job.state == DONE and job.result == {"analysis": "ok"}
+    assert job.future.result(0) is job
+    assert not queue.cancel(job)
+
+
+def test_position_is_none_once_running(queue):
+    job = queue.submit("image")
+    assert job.state == QUEUED and queue.position(job) == 0
+    queue.take(0)
+    assert queue.position(job) is None
+
+
+@pytest.mark.parametrize("data, headers, expected", [
+    ({}, {}, False),
+    ({"async": True}, {}, True),
+    ({}, {"Prefer": "respond-async"}, True),
+    ({}, {"Prefer": "return=minimal"}, False),
+])
+def test_wants_async(data, headers, expected):
+    assert wants_async(data, headers) is expected
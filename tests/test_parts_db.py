@@ -0,0 +1,64 @@
+import pytest
+
+from agent.parts_db import PartsDB, match_score, normalize_part
+
+PARTS_CSV = """part_number,manufacturer,category,package,description,datasheet
+NE555,Texas Instruments,IC,DIP-8,Precision timer,
+LM358,Texas Instruments,IC,DIP-8,Dual op-amp,
+ATMEGA328P,Microchip,IC,DIP-28,8-bit microcontroller,
+"""
+
+
+@pytest.fixture
+def parts(tmp_path):
+    csv_path = tmp_path / "parts.csv"
+    csv_path.write_text(PARTS_CSV, encoding="utf-8")
+    return PartsDB(path=str(tmp_path / "parts.sqlite3"), csv_path=str(csv_path))
+
+
+def test_normalize_part_folds_ocr_look_alikes():
+    assert normalize_part("ne-555 p") == "NE555P"
+    assert normalize_part("LM358") == normalize_part("LM3S8") == "1M358"
+    assert normalize_part("SN74HC00") == "5N74HC00"
+
+
+def test_exact_part_scores_one():
+    assert match_score("NE555", "NE555") == 1.0
+
+
+def test_package_suffix_scores_high():
+    assert match_score("NE555P", "NE555") >= 0.9
+    assert match_score("1M358N", "1M358") > match_score("1M358N", "1M324")
+
+
+def test_long_suffix_gets_no_bonus():
+    assert match_score("NE555PWRG4", "NE555") < 0.9
+
+
+def test_short_parts_get_no_prefix_bonus():
+    assert match_score("555XYZ", "555") < 0.9
+
+
+def test_lookup_finds_the_best_part(parts):
+    assert len(parts) == 3
+    part, score, token = parts.lookup(["TI", "NE555P", "0423"])
+    assert part["part_number"] == "NE555"
+    assert part["manufacturer"] == "Texas Instruments"
+    assert "normalized" not in part
+    assert token == "NE555P" and score >= 0.9
+
+
+def test_lookup_with_ocr_errors(parts):
+    part, _, _ = parts.lookup(["LM3S8N"])
+    assert part["part_number"] == "LM358"
+
+
+def test_lookup_without_candidates(parts):
+    assert parts.lookup(["QQ", "XYZW"]) is None
+
+
+def test_index_is_rebuilt_when_the_csv_changes(parts, tmp_path):
+    csv_path = tmp_path / "parts.csv"
+    csv_path.write_text(PARTS_CSV + "LM324,Texas Instruments,IC,DIP-14,Quad op-amp,\n", encoding="utf-8")
+    rebuilt = PartsDB(path=parts.path, csv_path=str(csv_path))
+    assert len(rebuilt) == 4
@@ -0,0 +1,50 @@
+import random
+
+from agent.phash import BKTree, NearDuplicateIndex, hamming
+
+
+def test_empty_tree_has_no_neighbour():
+    assert BKTree().nearest(0b1010, 64) is None
+
+
+def test_duplicates_are_stored_once():
+    tree = BKTree()
+    for value in (5, 5, 7, 5):
+        tree.add(value)
+    assert tree.size == 2
+
+
+def test_nearest_respects_radius():
+    tree = BKTree()
+    for value in (0b0000, 0b0111, 0b1111_0000):
+        tree.add(value)
+    assert tree.nearest(0b0001, 1) == (0b0000, 1)
+    assert tree.nearest(0b0011, 0) is None
+    assert tree.nearest(0b0011, 2) == (0b0111, 1)
+    assert tree.nearest(0b1100_0000, 1) is None
+    assert tree.nearest(0b1110_0000, 1) == (0b1111_0000, 1)
+
+
+def test_nearest_matches_a_linear_scan():
+    rng = random.Random(0)
+    values = [rng.getrandbits(64) for _ in range(500)]
+    tree = BKTree()
+    for value in values:
+        tree.add(value)
+    for _ in range(200):
+        query = rng.choice(values) ^ rng.getrandbits(64) & rng.getrandbits(64) & rng.getrandbits(64)
+        expected = min(hamming(query, value) for value in values)
+        match = tree.nearest(query, 12)
+        if expected > 12:
+            assert match is None
+        else:
+            assert match is not None and match[1] == expected == hamming(query, match[0])
+
+
+def test_index_evicts_oldest_and_rebuilds_tree():
+    index = NearDuplicateIndex(max_distance=2, max_entries=2)
+    index.add(0b0000, "first")
+    index.add(0b1111_0000, "second")
+    index.add(0b1111_1111_0000_0000, "third")
+    assert index.lookup(0b0001) is None
+    assert index.lookup(0b1111_0001) == "second"
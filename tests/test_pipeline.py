@@ -0,0 +1,76 @@
+import base64
+
+import cv2
+import numpy as np
+import pytest
+
+from agent import pipeline
+from agent.pipeline import crop_regions, parse_batch_request
+
+
+def _jpeg(width=120, height=80):
+    image = np.zeros((height, width, 3), np.uint8)
+    image[:, width // 2:] = 255
+    return cv2.imencode(".jpg", image)[1].tobytes()
+
+
+def _b64(data):
+    return base64.b64encode(data).decode("utf-8")
+
+
+def test_images_form():
+    first, second = _jpeg(), _jpeg(60, 40)
+    images, boxes = parse_batch_request({"images": [_b64(first), _b64(second)]})
+    assert boxes is None
+    assert images == [(first, _b64(first)), (second, _b64(second))]
+
+
+def test_boxes_form_crops_each_region():
+    images, boxes = parse_batch_request({"image": _b64(_jpeg()), "boxes": [[0, 0, 60, 80], [60, 0, 60, 80.5]]})
+    assert boxes == [[0, 0, 60, 80], [60, 0, 60, 80.5]]
+    assert [image_b64 for _, image_b64 in images] == [None, None]
+    crops = [cv2.imdecode(np.frombuffer(crop, np.uint8), cv2.IMREAD_COLOR) for crop, _ in images]
+    assert [crop.shape[:2] for crop in crops] == [(80, 60), (80, 60)]
+    assert crops[0].mean() < 20 and crops[1].mean() > 235
+
+
+@pytest.mark.parametrize("data, message", [
+    ([], "JSON object"),
+    ({}, "Provide either"),
+    ({"image": "abc"}, "Provide either"),
+    ({"images": []}, "empty"),
+    ({"images": "abc"}, "'images' must be a list"),
+    ({"images": ["abc", 5]}, "'images' must be a list"),
+    ({"images": [""]}, "'images' must be a list"),
+    ({"image": 5, "boxes": [[0, 0, 1, 1]]}, "'image' must be"),
+    ({"image": "abc", "boxes": "0,0,1,1"}, "'boxes' must be"),
+    ({"image": "abc", "boxes": [[0, 0, 1]]}, "'boxes' must be"),
+    ({"image": "abc", "boxes": [[0, 0, 1, None]]}, "'boxes' must be"),
+    ({"image": "abc", "boxes": [[0, 0, True, 1]]}, "'boxes' must be"),
+    ({"image": "abc", "boxes": [[0, 0, float("nan"), 1]]}, "'boxes' must be"),
+    ({"image": "abc", "boxes": []}, "empty"),
+])
+def test_malformed_bodies_raise_value_error(data, message):
+    with pytest.raises(ValueError, match=message):
+        parse_batch_request(data)
+
+
+def test_batch_size_is_limited(monkeypatch):
+    monkeypatch.setattr(pipeline, "BATCH_MAX_ITEMS", 2)
+    with pytest.raises(ValueError, match="at most 2"):
+        parse_batch_request({"images": [_b64(_jpeg())] * 3})
+
+
+def test_invalid_base64_is_a_value_error():
+    with pytest.raises(ValueError):
+        parse_batch_request({"images": ["not base64!"]})
+
+
+def test_box_outside_the_image():
+    with pytest.raises(ValueError, match="outside the image"):
+        crop_regions(_jpeg(), [[500, 500, 10, 10]])
+
+
+def test_undecodable_image():
+    with pytest.raises(ValueError, match="Could not decode"):
+        crop_regions(b"not an image", [[0, 0, 10, 10]])
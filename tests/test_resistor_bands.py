@@ -0,0 +1,72 @@
+import cv2
+import numpy as np
+import pytest
+
+from agent import resistor_bands
+from agent.resistor_bands import _decode, decode_resistor
+
+
+@pytest.mark.parametrize("names, expected", [
+    (["yellow", "violet", "orange", "gold"], (47_000, "±5%", True)),
+    (["brown", "black", "red", "silver"], (1000, "±10%", True)),
+    (["brown", "black", "black", "red", "brown"], (10_000, "±1%", True)),
+    (["brown", "black", "black", "red", "brown", "brown"], (10_000, "±1%", True)),
+    (["red", "red", "brown"], (220, "±20%", True)),
+    (["yellow", "violet", "gold", "gold"], (4.7, "±5%", True)),
+    (["brown", "yellow", "black", "gold"], (14, "±5%", False)),
+])
+def test_decode(names, expected):
+    ohms, tolerance, standard = _decode(names)
+    assert ohms == pytest.approx(expected[0])
+    assert (tolerance, standard) == expected[1:]
+
+
+@pytest.mark.parametrize("names", [
+    ["brown", "black"],                                            # too few bands
+    ["brown"] * 7,                                                 # too many
+    ["black", "brown", "red", "gold"],                             # leading zero
+    ["gold", "brown", "red", "gold"],                              # gold is no digit
+    ["yellow", "violet", "orange", "orange"],                      # orange is no tolerance
+])
+def test_decode_rejects_invalid_reads(names):
+    assert _decode(names) is None
+
+
+def _render(bands, body=(120, 190, 220)):
+    """
+    A clean resistor: body on a white background, bands evenly spaced with a
+    wider gap before the tolerance band (and a six-band part's tempco band).
+    """
+    image = np.full((240, 640, 3), 235, np.uint8)
+    cv2.line(image, (20, 120), (620, 120), (150, 150, 155), 4)
+    cv2.rectangle(image, (170, 80), (470, 160), body, -1)
+    tail = [400, 435] if len(bands) == 6 else [420]
+    positions = np.linspace(205, 340, len(bands) - len(tail)).astype(int).tolist() + tail
+    for name, x in zip(bands, positions):
+        cv2.rectangle(image, (x, 80), (x + 18, 160), resistor_bands.BAND_COLOURS[name][0], -1)
+    return image
+
+
+@pytest.mark.parametrize("bands, resistance, tolerance", [
+    (["yellow", "violet", "orange", "gold"], "47 kΩ", "±5%"),
+    (["brown", "black", "black", "red", "brown"], "10 kΩ", "±1%"),
+])
+def test_decode_resistor_reads_rendered_parts(bands, resistance, tolerance):
+    reading = decode_resistor(_render(bands))
+    assert reading is not None
+    assert (reading["resistance"], reading["tolerance"]) == (resistance, tolerance)
+    assert reading["bands"] == bands
+
+
+@pytest.mark.parametrize("bands", [
+    ["yellow", "violet", "orange", "gold"],
+    ["orange", "orange", "black", "brown", "gold", "red"],
+])
+def test_decode_resistor_reads_either_direction(bands):
+    for image in (_render(bands), cv2.flip(_render(bands), 1)):
+        reading = decode_resistor(image)
+        assert reading is not None and reading["bands"] == bands
+
+
+def test_blank_image_has_no_reading():
+    assert decode_resistor(np.full((240, 640, 3), 235, np.uint8)) is None
@@ -0,0 +1,39 @@
+import pytest
+
+from agent.schemas import ComponentAnalysis, ResistorAnalysis, analysis_to_markdown, missing_fields, to_component_analysis
+
+
+def test_placeholders_are_stored_as_empty():
+    analysis = ComponentAnalysis(category="Resistor", resistance="Unknown", tolerance=" n/a ", description="")
+    assert analysis.resistance is None and analysis.tolerance is None
+    assert missing_fields(analysis) == ["resistance"]
+
+
+def test_specialist_result_widens_to_component_analysis():
+    result = ResistorAnalysis(resistance="10 kΩ", description="A resistor.")
+    analysis = to_component_analysis("resistor", result)
+    assert analysis.category == "Resistor" and analysis.resistance == "10 kΩ"
+
+
+def test_markdown_lists_filled_fields_without_notes():
+    markdown = analysis_to_markdown(ComponentAnalysis(
+        category="Resistor", resistance="10 kΩ", tolerance="±5%", description="A carbon film resistor. Beige body."))
+    assert markdown.splitlines() == [
+        "- **Component type:** Resistor",
+        "- **Resistance:** 10 kΩ",
+        "- **Tolerance:** ±5%",
+    ]
+
+
+@pytest.mark.parametrize("analysis, note", [
+    (ComponentAnalysis(category="IC", description="Marking unreadable, e.g. a 555 timer. The package is DIP-8."),
+     "- **Notes:** Marking unreadable, e.g. a 555 timer."),
+    (ComponentAnalysis(category="Diode", description="A 1N4148 signal diode! Glass body."),
+     "- **Notes:** A 1N4148 signal diode!"),
+])
+def test_markdown_notes_are_one_sentence(analysis, note):
+    assert analysis_to_markdown(analysis).splitlines()[-1] == note
+
+
+def test_markdown_without_description_has_no_notes():
+    assert analysis_to_markdown(ComponentAnalysis(category="Other", description="")) == "- **Component type:** Other"
@@ -0,0 +1,60 @@
+import pytest
+
+from utils.session_store import MemorySessionStore, SQLiteSessionStore, _trim
+
+HEAD = [("human", "raw analysis"), ("ai", "summary shown to the user")]
+
+
+def _turns(count):
+    return [("human" if i % 2 == 0 else "ai", f"turn {i}") for i in range(count)]
+
+
+def test_short_history_is_untouched():
+    history = HEAD + _turns(2)
+    assert _trim(history, 10) == (history, 0)
+
+
+def test_oldest_turns_are_dropped_in_pairs():
+    history = HEAD + _turns(6)
+    trimmed, dropped = _trim(history, 7)
+    # One message over, but the question and its reply go together.
+    assert dropped == 2
+    assert trimmed == HEAD + _turns(6)[2:]
+
+
+def test_analysis_and_rolling_summary_are_pinned():
+    history = HEAD + [("summary", "earlier conversation")] + _turns(6)
+    trimmed, _ = _trim(history, 5)
+    assert trimmed[:3] == history[:3]
+    assert len(trimmed) == 5
+    assert trimmed[3:] == _turns(6)[4:]
+
+
+def test_unpaired_message_is_dropped_alone():
+    history = HEAD + [("ai", "welcome")] + _turns(2)
+    trimmed, dropped = _trim(history, 4)
+    assert dropped == 1
+    assert trimmed == HEAD + _turns(2)
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemorySessionStore(max_sessions=2, ttl_seconds=60, max_history=4)
+    return SQLiteSessionStore(path=str(tmp_path / "sessions.sqlite3"), max_sessions=2, ttl_seconds=60, max_history=4)
+
+
+def test_store_trims_appended_turns(store):
+    session_id = store.create(HEAD)
+    store.append(session_id, *_turns(4))
+    assert store.get(session_id) == HEAD + _turns(4)[2:]
+    assert store.stats()["trimmed_messages"] == 2
+
+
+def test_store_evicts_least_recently_used(store):
+    first = store.create(HEAD)
+    second = store.create(HEAD)
+    store.get(first)
+    third = store.create(HEAD)
+    assert store.get(second) is None
+    assert store.get(first) is not None and store.get(third) is not None
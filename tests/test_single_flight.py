@@ -0,0 +1,82 @@
+import asyncio
+import threading
+
+import pytest
+
+from agent.single_flight import SingleFlight, image_digest
+
+
+def test_image_digest_is_content_addressed():
+    assert image_digest(b"image") == image_digest(b"image")
+    assert image_digest(b"image") != image_digest(b"other")
+
+
+def test_concurrent_identical_calls_share_one_run():
+    flights = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def analysis():
+        calls.append(1)
+        release.wait(5)
+        return {"analysis": "shared"}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flights.run("key", analysis))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    while True:
+        with flights.lock:
+            flight = flights.flights.get("key")
+            if flight is not None and flight.followers == 3:
+                break
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert results == [{"analysis": "shared"}] * 4
+    # Every caller gets its own copy of the result.
+    assert len({id(result) for result in results}) == 4
+    assert flights.flights == {}
+
+
+def test_later_calls_run_again():
+    flights = SingleFlight()
+    assert flights.run("key", lambda: {"run": 1}) == {"run": 1}
+    assert flights.run("key", lambda: {"run": 2}) == {"run": 2}
+
+
+def test_followers_receive_the_leaders_error():
+    flights = SingleFlight()
+    flight, leader = flights.join("key")
+    follower, is_leader = flights.join("key")
+    assert leader and not is_leader and follower is flight
+    flights.finish("key", flight, error=ValueError("bad image"))
+    with pytest.raises(ValueError, match="bad image"):
+        flights.wait(follower)
+
+
+def test_cancelled_leader_fails_followers_with_runtime_error():
+    flights = SingleFlight()
+    flight, _ = flights.join("key")
+    follower, _ = flights.join("key")
+    flights.finish("key", flight, error=asyncio.CancelledError())
+    with pytest.raises(RuntimeError, match="cancelled"):
+        flights.wait(follower)
+
+
+def test_async_followers_share_one_run():
+    flights = SingleFlight()
+    calls = []
+
+    async def analysis():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"analysis": "shared"}
+
+    async def main():
+        return await asyncio.gather(*(flights.arun("key", analysis) for _ in range(3)))
+
+    assert asyncio.run(main()) == [{"analysis": "shared"}] * 3
+    assert len(calls) == 1
@@ -0,0 +1,163 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+
+import cv2
+import numpy as np
+
+from agent.preprocess import PROFILES, normalize_image
+from agent.local_classifier import DEFAULT_METADATA, LocalClassifier, to_input
+
+# Trains the optional on-device component classifier used by the identify
+# step (agent/local_classifier.py) and exports it to ONNX.
+#
+# Labelled scans go in one folder per category, named like the identify
+# prompt's categories:
+#   scans/Resistor/*.jpg   scans/Capacitor/*.jpg   scans/IC/*.jpg   ...
+#
+#   python train_classifier.py scans --epochs 15
+#
+# Needs torch and torchvision (training only; the Pi only needs the exported
+# model). With onnxruntime installed the model is also quantised to int8.
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+def load_scans(data_dir):
+    """
+    Returns (images, labels, label_names). Every scan goes through the same
+    crop and resize the identify step applies before classification.
+    """
+    label_names = sorted(d for d in os.listdir(data_dir) if os.path.isdir(os.path.join(data_dir, d)))
+    unknown = [name for name in label_names if name not in DEFAULT_METADATA["labels"]]
+    if unknown:
+        print(f"Warning: {', '.join(unknown)} are not categories the identify prompt uses.")
+
+    images, labels = [], []
+    for index, name in enumerate(label_names):
+        folder = os.path.join(data_dir, name)
+        for filename in sorted(os.listdir(folder)):
+            if not filename.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            with open(os.path.join(folder, filename), "rb") as f:
+                try:
+                    normalised, _ = normalize_image(f.read(), **PROFILES["identify"])
+                except ValueError:
+                    print(f"Skipping unreadable scan {filename}.")
+                    continue
+            images.append(cv2.imdecode(np.frombuffer(normalised, dtype=np.uint8), cv2.IMREAD_COLOR))
+            labels.append(index)
+        print(f"{name}: {labels.count(index)} scans")
+    return images, labels, label_names
+
+
+def augment(image, rng):
+    """Random flips, 90-degree rotations and brightness changes, as a phone or Pi camera would vary."""
+    if rng.random() < 0.5:
+        image = cv2.flip(image, 1)
+    image = np.rot90(image, rng.integers(4)).copy()
+    return cv2.convertScaleAbs(image, alpha=rng.uniform(0.8, 1.2), beta=rng.uniform(-20, 20))
+
+
+def train(images, labels, label_names, epochs, batch_size, learning_rate, val_split, input_size):
+    import torch
+    import torchvision
+
+    rng = np.random.default_rng(0)
+    order = list(range(len(images)))
+    random.Random(0).shuffle(order)
+    val_count = max(1, int(len(order) * val_split))
+    val_idx, train_idx = order[:val_count], order[val_count:]
+
+    def batch(indices, training):
+        blobs = [to_input(augment(images[i], rng) if training else images[i], input_size) for i in indices]
+        return torch.from_numpy(np.concatenate(blobs)), torch.tensor([labels[i] for i in indices])
+
+    model = torchvision.models.mobilenet_v3_small(weights=torchvision.models.MobileNet_V3_Small_Weights.DEFAULT)
+    model.classifier[-1] = torch.nn.Linear(model.classifier[-1].in_features, len(label_names))
+    optimizer = torch.optim.AdamW(model.parameters(), lr=learning_rate)
+    loss_fn = torch.nn.CrossEntropyLoss()
+
+    for epoch in range(epochs):
+        model.train()
+        random.Random(epoch).shuffle(train_idx)
+        total_loss = 0.0
+        for start in range(0, len(train_idx), batch_size):
+            inputs, targets = batch(train_idx[start:start + batch_size], training=True)
+            optimizer.zero_grad()
+            loss = loss_fn(model(inputs), targets)
+            loss.backward()
+            optimizer.step()
+            total_loss += loss.item() * len(targets)
+
+        model.eval()
+        with torch.no_grad():
+            inputs, targets = batch(val_idx, training=False)
+            accuracy = (model(inputs).argmax(dim=1) == targets).float().mean().item()
+        print(f"Epoch {epoch + 1}/{epochs}: loss {total_loss / len(train_idx):.4f}, validation accuracy {accuracy:.3f}")
+    return model, accuracy, val_idx
+
+
+def export(model, output, input_size, quantize):
+    """Exports the model to ONNX, quantised to int8 when onnxruntime is available."""
+    import torch
+
+    directory = os.path.dirname(output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    float_path = output if not quantize else os.path.splitext(output)[0] + ".fp32.onnx"
+    model.eval()
+    torch.onnx.export(model, torch.zeros(1, 3, input_size, input_size), float_path,
+                      input_names=["input"], output_names=["logits"], opset_version=13)
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(float_path, output, weight_type=QuantType.QUInt8)
+        print(f"Quantised model: {os.path.getsize(float_path) / 1e6:.1f} MB -> {os.path.getsize(output) / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train and export the local component classifier.")
+    parser.add_argument("data_dir", help="Folder with one sub-folder of labelled scans per category.")
+    parser.add_argument("--output", default=os.path.join("models", "component_classifier.onnx"))
+    parser.add_argument("--epochs", type=int, default=15)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--learning-rate", type=float, default=1e-3)
+    parser.add_argument("--val-split", type=float, default=0.15)
+    parser.add_argument("--input-size", type=int, default=DEFAULT_METADATA["input_size"])
+    parser.add_argument("--no-quantize", action="store_true", help="Export a float model (needed for the OpenCV backend).")
+    args = parser.parse_args()
+
+    try:
+        import torch  # noqa: F401
+        import torchvision  # noqa: F401
+    except ImportError:
+        sys.exit("Training needs torch and torchvision: pip install torch torchvision")
+    quantize = not args.no_quantize
+    if quantize:
+        try:
+            import onnxruntime  # noqa: F401
+        except ImportError:
+            print("onnxruntime is not installed; exporting a float model.")
+            quantize = False
+
+    images, labels, label_names = load_scans(args.data_dir)
+    if len(label_names) < 2 or len(images) < 10:
+        sys.exit("Need at least two categories and ten scans to train.")
+
+    model, accuracy, val_idx = train(images, labels, label_names, args.epochs, args.batch_size,
+                                     args.learning_rate, args.val_split, args.input_size)
+    export(model, args.output, args.input_size, quantize)
+    with open(os.path.splitext(args.output)[0] + ".json", "w") as f:
+        json.dump({**DEFAULT_METADATA, "labels": label_names, "input_size": args.input_size,
+                   "validation_accuracy": round(accuracy, 4)}, f, indent=2)
+
+    # Check the exported model the way the app will run it.
+    classifier = LocalClassifier(args.output)
+    start = time.perf_counter()
+    correct = sum(classifier.predict(images[i])[0] == label_names[labels[i]] for i in val_idx)
+    per_image = (time.perf_counter() - start) * 1000 / len(val_idx)
+    print(f"Exported {args.output}: validation accuracy {correct / len(val_idx):.3f}, "
+          f"{per_image:.1f} ms per image ({classifier.backend}).")
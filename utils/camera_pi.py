@@ -1,52 +1,345 @@
+import os
 import cv2
 import threading
 import time
-from picamera2 import Picamera2
+from collections import deque
+import numpy as np
+from dotenv import load_dotenv
+from picamera2 import Picamera2, MappedArray
+
+try:
+    # libjpeg-turbo bindings that picamera2 itself uses for JPEG output.
+    import simplejpeg
+except ImportError:
+    simplejpeg = None
+
+# --- Configuration ---
+# Preview frames come from the ISP's low-resolution stream; stills for
+# analysis are taken from the full-resolution main stream of the same
+# running pipeline, so a capture never reconfigures or restarts the camera.
+
+load_dotenv()
+
+# Still size as WIDTHxHEIGHT; empty means the sensor's full resolution. A
+# smaller size lets the sensor run a faster mode, which keeps preview smoother.
+CAMERA_STILL_SIZE = os.environ.get("CAMERA_STILL_SIZE", "")
+CAMERA_STILL_QUALITY = int(os.environ.get("CAMERA_STILL_QUALITY", "90"))
+# JPEG encoder for stills: "simplejpeg" (when installed) or "cv2".
+CAMERA_STILL_ENCODER = os.environ.get("CAMERA_STILL_ENCODER", "simplejpeg" if simplejpeg else "cv2")
+# Width of the thumbnail the UI shows for a capture; the full still stays on the server.
+CAMERA_THUMBNAIL_WIDTH = int(os.environ.get("CAMERA_THUMBNAIL_WIDTH", "640"))
+# Buffers the camera allocates. Each holds a full-resolution RGB main frame
+# (about 36 MB at 12 MP), and the capture loop only ever holds one at a time,
+# so a few are enough; picamera2's video default of 6 wastes memory on a Pi.
+CAMERA_BUFFER_COUNT = int(os.environ.get("CAMERA_BUFFER_COUNT", "3"))
+# Time the sensor's exposure and white balance need to settle after start.
+# The preview runs meanwhile; only stills wait for it.
+CAMERA_WARMUP_SECONDS = float(os.environ.get("CAMERA_WARMUP_SECONDS", "2.0"))
+
+
+def encode_still(frame, quality=CAMERA_STILL_QUALITY, encoder=CAMERA_STILL_ENCODER):
+    """JPEG-encodes a BGR still with the configured encoder and returns the bytes."""
+    if encoder == "simplejpeg" and simplejpeg is not None:
+        return simplejpeg.encode_jpeg(np.ascontiguousarray(frame), quality=quality, colorspace='BGR')
+    ret, jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return jpeg.tobytes() if ret else None
+
+
+def encode_thumbnail(frame, width=CAMERA_THUMBNAIL_WIDTH):
+    """JPEG-encodes a downscaled copy of a BGR still for display."""
+    if frame.shape[1] > width:
+        height = max(1, round(frame.shape[0] * width / frame.shape[1]))
+        frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+    return encode_still(frame, quality=80)
+
+
+class FrameBroadcaster:
+    """
+    Shares the latest JPEG-encoded frame with every /video_feed client.
+
+    The camera thread publishes each frame once, tagged with an increasing
+    sequence number; clients block on a condition until the sequence moves
+    past the last one they sent. Encoding cost therefore does not grow with
+    the number of viewers, and no client is ever sent the same frame twice
+    (a slow client simply skips to the newest frame).
+    """
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.jpeg = None
+        self.sequence = 0
+        self.viewers = 0
+        self.closed = False
+
+    def publish(self, jpeg):
+        with self.condition:
+            self.jpeg = jpeg
+            self.sequence += 1
+            self.condition.notify_all()
+
+    def wait_for_frame(self, last_sequence, timeout=1.0):
+        """
+        Waits until a frame newer than last_sequence is published and returns
+        (sequence, jpeg). Returns (last_sequence, None) on timeout or close.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.sequence != last_sequence or self.closed, timeout)
+            if self.closed or self.sequence == last_sequence:
+                return last_sequence, None
+            return self.sequence, self.jpeg
+
+    def add_viewer(self):
+        with self.condition:
+            self.viewers += 1
+
+    def remove_viewer(self):
+        with self.condition:
+            self.viewers -= 1
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class FrameRef:
+    """
+    A read-only view of one frame in the camera's ring buffer. The slot is
+    not overwritten until the reference is released, so consumers can encode
+    or analyze the frame without copying it. Use as a context manager, or
+    call release() when done.
+    """
+    def __init__(self, ring, index, sequence):
+        self.ring = ring
+        self.index = index
+        self.sequence = sequence
+        self.array = ring.slots[index].view()
+        self.array.flags.writeable = False
+
+    def release(self):
+        if self.ring is not None:
+            self.ring.release(self.index)
+            self.ring = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class FrameRing:
+    """
+    A preallocated ring of frame buffers shared by the capture thread and its
+    readers. The capture thread writes into a slot nobody holds a reference
+    to, then publishes it as the latest frame; readers take reference-counted
+    views of the latest slot. When every other slot is still held, the new
+    frame is dropped rather than overwriting a frame in use.
+    """
+    def __init__(self, shape, size=4):
+        self.slots = [np.empty(shape, dtype=np.uint8) for _ in range(size)]
+        self.refs = [0] * size
+        self.lock = threading.Lock()
+        self.latest = None
+        self.sequence = 0
+
+    def reserve(self):
+        """Returns the index of a free slot for the next frame, or None if all are held."""
+        with self.lock:
+            for index in range(len(self.slots)):
+                if index != self.latest and self.refs[index] == 0:
+                    return index
+            return None
+
+    def publish(self, index):
+        with self.lock:
+            self.latest = index
+            self.sequence += 1
+
+    def acquire(self):
+        """Returns a FrameRef for the latest frame, or None before the first frame."""
+        with self.lock:
+            if self.latest is None:
+                return None
+            self.refs[self.latest] += 1
+            return FrameRef(self, self.latest, self.sequence)
+
+    def release(self, index):
+        with self.lock:
+            self.refs[index] -= 1
+
 
 class Camera:
     """
     A class to manage the Raspberry Pi camera using the picamera2 library.
     It captures frames in a background thread for a smooth video stream.
+
+    The thread is paced by the camera itself: capture_request() blocks until
+    the sensor delivers the next frame. Its low-resolution stream is
+    converted straight out of the camera's buffer into a preallocated
+    FrameRing for the preview; the full-resolution main stream is only read
+    when capture_still() asks for it.
     """
+    SIZE = (640, 480)  # Preview size; the width must be a multiple of 64 (YUV420 stride)
+    RING_SIZE = 4
+
     def __init__(self):
         self.picam2 = Picamera2()
-        # Configure the camera for video streaming
-        config = self.picam2.create_preview_configuration(main={"size": (640, 480),"format": "RGB888"})
+        # Configure a full-resolution main stream for stills and a lores stream for the preview
+        if CAMERA_STILL_SIZE:
+            still_size = tuple(int(v) for v in CAMERA_STILL_SIZE.lower().split("x"))
+        else:
+            still_size = tuple(self.picam2.sensor_resolution)
+        config = self.picam2.create_video_configuration(
+            main={"size": still_size, "format": "RGB888"},
+            lores={"size": self.SIZE, "format": "YUV420"},
+            buffer_count=CAMERA_BUFFER_COUNT,
+        )
         self.picam2.configure(config)
-        
+        self.still_size = still_size
+
         self.picam2.start()
-        # Allow the camera to warm up
-        time.sleep(2.0)
-        
-        self.frame = None
-        self.lock = threading.Lock()
+        # Warm-up doesn't block start: the preview shows the first (still settling) frames at once.
+        self.warm_at = time.monotonic() + CAMERA_WARMUP_SECONDS
+
+        width, height = self.SIZE
+        self.ring = FrameRing((height, width, 3), self.RING_SIZE)
         self.is_running = True
-        
+        self.broadcaster = FrameBroadcaster()
+
+        # Capture statistics, reported by stats().
+        self.stats_lock = threading.Lock()
+        self.frame_times = deque(maxlen=60)
+        self.frames_captured = 0
+        self.frames_dropped = 0      # Frames the sensor produced that the loop never saw
+        self.frames_ring_full = 0    # Frames discarded because every ring slot was held
+        self.last_sensor_timestamp = None
+        self.still_latencies = deque(maxlen=50)
+
+        # Pending capture_still() calls, served from the next frame.
+        self.still_lock = threading.Lock()
+        self.still_waiters = []
+
         # Start a background thread to continuously read frames
         self.thread = threading.Thread(target=self._update, daemon=True)
         self.thread.start()
-        print("Raspberry Pi camera thread started using picamera2.")
+        print(f"Raspberry Pi camera thread started using picamera2 (preview {self.SIZE[0]}x{self.SIZE[1]}, stills {still_size[0]}x{still_size[1]}).")
 
     def _update(self):
-        """Internal method to read frames from the camera."""
+        """Internal method to read frames from the camera as the sensor produces them."""
         while self.is_running:
-            # capture_array() returns a NumPy array, which is compatible with OpenCV
-            frame_array = self.picam2.capture_array()
-            with self.lock:
-                self.frame = frame_array
-            time.sleep(0.03) # Limit to ~30 fps
+            request = self.picam2.capture_request()
+            try:
+                metadata = request.get_metadata()
+                index = self.ring.reserve()
+                if index is not None:
+                    with MappedArray(request, "lores") as mapped:
+                        cv2.cvtColor(mapped.array, cv2.COLOR_YUV420p2BGR, dst=self.ring.slots[index])
+                with self.still_lock:
+                    waiters, self.still_waiters = self.still_waiters, []
+                if waiters:
+                    # Copy the full-resolution frame out so the buffer goes back
+                    # to the camera at once; encoding happens in the caller's thread.
+                    still = request.make_array("main")
+                    still.flags.writeable = False
+                    for waiter in waiters:
+                        waiter["frame"] = still
+                        waiter["event"].set()
+            finally:
+                request.release()
+
+            self._record_frame(metadata, dropped_by_ring=index is None)
+            if index is None:
+                continue
+            self.ring.publish(index)
+
+            # Encode once for all viewers, and not at all while nobody is watching.
+            # The slot can't be overwritten here: only this thread writes to the ring.
+            if self.broadcaster.viewers > 0:
+                ret, jpeg = cv2.imencode('.jpg', self.ring.slots[index])
+                if ret:
+                    self.broadcaster.publish(jpeg.tobytes())
+
+    def _record_frame(self, metadata, dropped_by_ring):
+        """Updates the FPS window and counts frames lost between sensor timestamps."""
+        timestamp = metadata.get("SensorTimestamp")  # nanoseconds
+        frame_duration = metadata.get("FrameDuration")  # microseconds
+        with self.stats_lock:
+            self.frame_times.append(time.monotonic())
+            self.frames_captured += 1
+            if dropped_by_ring:
+                self.frames_ring_full += 1
+            if timestamp and frame_duration and self.last_sensor_timestamp:
+                gap = (timestamp - self.last_sensor_timestamp) / 1000
+                self.frames_dropped += max(0, round(gap / frame_duration) - 1)
+            self.last_sensor_timestamp = timestamp
+
+    def stats(self):
+        """Returns the measured capture rate and frame counters."""
+        with self.stats_lock:
+            times = self.frame_times
+            fps = (len(times) - 1) / (times[-1] - times[0]) if len(times) > 1 and times[-1] > times[0] else 0.0
+            return {
+                "fps": round(fps, 1),
+                "frames_captured": self.frames_captured,
+                "frames_dropped": self.frames_dropped,
+                "frames_ring_full": self.frames_ring_full,
+                "viewers": self.broadcaster.viewers,
+                "still_size": list(self.still_size),
+                "still_capture_ms_p50": round(float(np.median(self.still_latencies)), 1) if self.still_latencies else None,
+            }
+
+    def capture_still(self, timeout=2.0):
+        """
+        Returns the next full-resolution frame as a read-only BGR array, or
+        None if the camera does not deliver one within `timeout` seconds. The
+        preview keeps running; only the frame that serves the request pays for
+        the full-resolution copy. Stills requested right after start wait for
+        the camera to finish warming up.
+        """
+        warming = self.warm_at - time.monotonic()
+        if warming > 0:
+            time.sleep(warming)
+        start = time.perf_counter()
+        waiter = {"event": threading.Event(), "frame": None}
+        with self.still_lock:
+            self.still_waiters.append(waiter)
+        if not waiter["event"].wait(timeout):
+            with self.still_lock:
+                if waiter in self.still_waiters:
+                    self.still_waiters.remove(waiter)
+            return None
+        with self.stats_lock:
+            self.still_latencies.append((time.perf_counter() - start) * 1000)
+        return waiter["frame"]
+
+    def capture_still_jpeg(self, timeout=2.0):
+        """Captures a full-resolution still and returns it JPEG-encoded, or None."""
+        frame = self.capture_still(timeout)
+        return encode_still(frame) if frame is not None else None
+
+    def acquire_frame(self):
+        """
+        Returns a read-only FrameRef to the latest frame without copying it, or
+        None if no frame has been captured yet. Release it promptly (ideally
+        with a `with` block): a held frame pins one slot of the ring.
+        """
+        return self.ring.acquire()
 
     def get_frame(self):
-        """Returns the latest captured frame as a NumPy array."""
-        with self.lock:
-            return self.frame.copy() if self.frame is not None else None
+        """Returns a private copy of the latest captured frame as a NumPy array."""
+        frame = self.acquire_frame()
+        if frame is None:
+            return None
+        with frame:
+            return frame.array.copy()
 
     def get_jpeg_frame(self):
         """Encodes the latest frame as a JPEG image."""
-        frame = self.get_frame()
+        frame = self.acquire_frame()
         if frame is not None:
-            # We still use cv2 here for its highly efficient JPEG encoding
-            ret, jpeg = cv2.imencode('.jpg', frame)
+            with frame:
+                # We still use cv2 here for its highly efficient JPEG encoding
+                ret, jpeg = cv2.imencode('.jpg', frame.array)
             if ret:
                 return jpeg.tobytes()
         return None
@@ -54,16 +347,26 @@ class Camera:
     def release(self):
         """Releases the camera resources."""
         self.is_running = False
+        self.broadcaster.close()
         self.thread.join() # Wait for the thread to finish
         self.picam2.stop()
         print("Camera released.")
 
 # --- Generator function for streaming ---
 def generate_frames(camera):
-    """A generator function that yields JPEG-encoded frames for video streaming."""
-    while True:
-        frame_bytes = camera.get_jpeg_frame()
-        if frame_bytes:
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-        time.sleep(0.03)
+    """
+    A generator that yields each new JPEG frame for video streaming. It
+    blocks until the camera publishes a frame instead of polling, and shares
+    the single encoded copy with every other viewer.
+    """
+    broadcaster = camera.broadcaster
+    broadcaster.add_viewer()
+    try:
+        sequence = 0
+        while camera.is_running:
+            sequence, frame_bytes = broadcaster.wait_for_frame(sequence)
+            if frame_bytes:
+                yield (b'--frame\r\n'
+                       b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+    finally:
+        broadcaster.remove_viewer()
@@ -0,0 +1,258 @@
+import os
+import time
+import uuid
+import sqlite3
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+# --- 1. Configuration ---
+# Chat sessions hold the raw analysis plus every turn, so they are bounded in
+# count, age and length. The SQLite backend lets several worker processes
+# (e.g. `gunicorn -w 4 server:app`) share sessions and survive restarts.
+
+load_dotenv()
+
+SESSION_BACKEND = os.environ.get("SESSION_BACKEND", "memory")
+SESSION_DB_PATH = os.environ.get("SESSION_DB_PATH", os.path.join("cache", "sessions.sqlite3"))
+SESSION_MAX_SESSIONS = int(os.environ.get("SESSION_MAX_SESSIONS", "1000"))
+SESSION_TTL_SECONDS = float(os.environ.get("SESSION_TTL_SECONDS", str(6 * 3600)))
+# Messages kept per session. The analysis the chat is grounded on is always
+# kept; the oldest turns after it are dropped.
+SESSION_MAX_HISTORY = int(os.environ.get("SESSION_MAX_HISTORY", "50"))
+
+
+def _trim(history, max_history):
+    """
+    Drops the oldest chat turns until the history fits max_history messages.
+    The raw analysis, the summary shown to the user and the rolling
+    conversation summary (role "summary", see agent/context.py) are pinned.
+    A question and the reply after it are dropped together, so neither is
+    left behind without the other.
+    """
+    if len(history) <= max_history:
+        return history, 0
+    pinned = [i for i, (role, _) in enumerate(history) if i < 2 or role == "summary"]
+    droppable = [i for i in range(len(history)) if i not in pinned]
+    excess = len(history) - max_history
+    dropped = set()
+    position = 0
+    while len(dropped) < excess and position < len(droppable):
+        index = droppable[position]
+        dropped.add(index)
+        position += 1
+        if (history[index][0] == "human" and position < len(droppable) and droppable[position] == index + 1
+                and history[index + 1][0] == "ai"):
+            dropped.add(index + 1)
+            position += 1
+    return [message for i, message in enumerate(history) if i not in dropped], len(dropped)
+
+
+class MemorySessionStore:
+    """
+    An in-process session store with least-recently-used eviction and a TTL.
+    Fast, but private to one process and lost on restart.
+    """
+    def __init__(self, max_sessions=SESSION_MAX_SESSIONS, ttl_seconds=SESSION_TTL_SECONDS, max_history=SESSION_MAX_HISTORY):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.max_history = max_history
+        self.sessions = OrderedDict()  # session_id -> (history, last_access)
+        self.lock = threading.Lock()
+        self.counters = {"created": 0, "evicted_lru": 0, "expired": 0, "trimmed_messages": 0}
+
+    def create(self, history):
+        """Stores a new session and returns its id."""
+        session_id = str(uuid.uuid4())
+        history, dropped = _trim(list(history), self.max_history)
+        with self.lock:
+            self._expire()
+            self.sessions[session_id] = (history, time.time())
+            self.counters["created"] += 1
+            self.counters["trimmed_messages"] += dropped
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+                self.counters["evicted_lru"] += 1
+        return session_id
+
+    def get(self, session_id):
+        """Returns a copy of the session's history, or None if it is unknown or expired."""
+        with self.lock:
+            entry = self.sessions.get(session_id)
+            if entry is None:
+                return None
+            history, last_access = entry
+            if time.time() - last_access > self.ttl_seconds:
+                del self.sessions[session_id]
+                self.counters["expired"] += 1
+                return None
+            self.sessions[session_id] = (history, time.time())
+            self.sessions.move_to_end(session_id)
+            return list(history)
+
+    def append(self, session_id, *messages):
+        """Appends (role, content) messages to a session, trimming it to max_history."""
+        self.replace(session_id, None, messages)
+
+    def replace(self, session_id, history, extra=()):
+        """Replaces a session's history (or extends it when history is None)."""
+        with self.lock:
+            self._expire()
+            entry = self.sessions.get(session_id)
+            if entry is None:
+                return
+            history = list(entry[0] if history is None else history) + list(extra)
+            history, dropped = _trim(history, self.max_history)
+            self.sessions[session_id] = (history, time.time())
+            self.sessions.move_to_end(session_id)
+            self.counters["trimmed_messages"] += dropped
+
+    def _expire(self):
+        """Drops sessions idle past the TTL. Called on every write; the oldest are at the front."""
+        cutoff = time.time() - self.ttl_seconds
+        while self.sessions:
+            session_id, (_, last_access) = next(iter(self.sessions.items()))
+            if last_access >= cutoff:
+                break
+            del self.sessions[session_id]
+            self.counters["expired"] += 1
+
+    def stats(self):
+        with self.lock:
+            return {"backend": "memory", "sessions": len(self.sessions), **self.counters}
+
+
+class SQLiteSessionStore:
+    """
+    A session store in a SQLite database in WAL mode, shared by every worker
+    process pointing at the same file. Expired sessions are deleted on every
+    write, and the least recently used ones above max_sessions whenever a
+    session is created.
+    Eviction counters are per process; the session count is global.
+    """
+    def __init__(self, path=SESSION_DB_PATH, max_sessions=SESSION_MAX_SESSIONS, ttl_seconds=SESSION_TTL_SECONDS, max_history=SESSION_MAX_HISTORY):
+        self.path = path
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.max_history = max_history
+        self.local = threading.local()
+        self.counter_lock = threading.Lock()
+        self.counters = {"created": 0, "evicted_lru": 0, "expired": 0, "trimmed_messages": 0}
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(
+            """CREATE TABLE IF NOT EXISTS sessions (
+                   id TEXT PRIMARY KEY,
+                   last_access REAL NOT NULL
+               );
+               CREATE TABLE IF NOT EXISTS messages (
+                   session_id TEXT NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,
+                   seq INTEGER NOT NULL,
+                   role TEXT NOT NULL,
+                   content TEXT NOT NULL,
+                   PRIMARY KEY (session_id, seq)
+               );
+               CREATE INDEX IF NOT EXISTS idx_sessions_last_access ON sessions(last_access);"""
+        )
+
+    def _conn(self):
+        """One connection per thread; SQLite serialises writers across threads and processes."""
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA foreign_keys=ON")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def _count(self, name, amount=1):
+        if amount:
+            with self.counter_lock:
+                self.counters[name] += amount
+
+    def _write_history(self, conn, session_id, history):
+        conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+        conn.executemany(
+            "INSERT INTO messages (session_id, seq, role, content) VALUES (?, ?, ?, ?)",
+            [(session_id, seq, role, content) for seq, (role, content) in enumerate(history)],
+        )
+
+    def _read_history(self, conn, session_id):
+        rows = conn.execute("SELECT role, content FROM messages WHERE session_id = ? ORDER BY seq", (session_id,)).fetchall()
+        return [(role, content) for role, content in rows]
+
+    def _expire(self, conn, now):
+        return conn.execute("DELETE FROM sessions WHERE last_access < ?", (now - self.ttl_seconds,)).rowcount
+
+    def create(self, history):
+        session_id = str(uuid.uuid4())
+        history, dropped = _trim(list(history), self.max_history)
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute("INSERT INTO sessions (id, last_access) VALUES (?, ?)", (session_id, now))
+            self._write_history(conn, session_id, history)
+            expired = self._expire(conn, now)
+            evicted = conn.execute(
+                "DELETE FROM sessions WHERE id IN (SELECT id FROM sessions ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_sessions,),
+            ).rowcount
+        self._count("created")
+        self._count("trimmed_messages", dropped)
+        self._count("expired", expired)
+        self._count("evicted_lru", evicted)
+        return session_id
+
+    def get(self, session_id):
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            row = conn.execute("SELECT last_access FROM sessions WHERE id = ?", (session_id,)).fetchone()
+            if row is None:
+                return None
+            if now - row[0] > self.ttl_seconds:
+                conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+                self._count("expired")
+                return None
+            conn.execute("UPDATE sessions SET last_access = ? WHERE id = ?", (now, session_id))
+            return self._read_history(conn, session_id)
+
+    def append(self, session_id, *messages):
+        self.replace(session_id, None, messages)
+
+    def replace(self, session_id, history, extra=()):
+        conn = self._conn()
+        with conn:
+            # BEGIN IMMEDIATE takes the write lock up front so concurrent appends can't interleave.
+            conn.execute("BEGIN IMMEDIATE")
+            if conn.execute("SELECT 1 FROM sessions WHERE id = ?", (session_id,)).fetchone() is None:
+                return
+            if history is None:
+                history = self._read_history(conn, session_id)
+            history, dropped = _trim(list(history) + list(extra), self.max_history)
+            self._write_history(conn, session_id, history)
+            now = time.time()
+            conn.execute("UPDATE sessions SET last_access = ? WHERE id = ?", (now, session_id))
+            expired = self._expire(conn, now)
+        self._count("trimmed_messages", dropped)
+        self._count("expired", expired)
+
+    def stats(self):
+        count = self._conn().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        with self.counter_lock:
+            return {"backend": "sqlite", "sessions": count, **self.counters}
+
+
+def create_session_store(backend=SESSION_BACKEND):
+    """Builds the session store selected by SESSION_BACKEND ('memory' or 'sqlite')."""
+    if backend == "sqlite":
+        print(f"Using SQLite session store at {SESSION_DB_PATH}.")
+        return SQLiteSessionStore()
+    if backend != "memory":
+        raise ValueError(f"Unknown session backend '{backend}'. Expected 'memory' or 'sqlite'.")
+    return MemorySessionStore()
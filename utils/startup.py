@@ -0,0 +1,65 @@
+import time
+import threading
+import traceback
+from concurrent.futures import Future
+
+# --- Startup Timing ---
+# app.py and app_pi.py import this module before anything else, so times are
+# measured from launch. Slow pieces (compiling the agent, which imports
+# LangChain and LangGraph, and starting the camera) run in background threads
+# while the server binds and the window opens; each one's finish is recorded
+# here and reported at /startup/stats.
+
+_started = time.perf_counter()
+_marks = {}
+_pending = set()
+_lock = threading.Lock()
+
+
+def mark(name):
+    """Records that `name` is ready, in seconds since launch. Only the first mark of a name counts."""
+    elapsed = round(time.perf_counter() - _started, 3)
+    with _lock:
+        if name in _marks:
+            return _marks[name]
+        _marks[name] = elapsed
+        _pending.discard(name)
+    print(f"Startup: {name} ready after {elapsed:.2f} s.")
+    return elapsed
+
+
+def in_background(name, function, *args):
+    """Runs function(*args) in a daemon thread and returns a Future for its result."""
+    future = Future()
+    with _lock:
+        _pending.add(name)
+
+    def run():
+        try:
+            result = function(*args)
+        except Exception as e:
+            print(f"Startup: {name} failed: {e}")
+            traceback.print_exc()
+            with _lock:
+                _pending.discard(name)
+            future.set_exception(e)
+            return
+        mark(name)
+        future.set_result(result)
+
+    threading.Thread(target=run, name=f"startup-{name}", daemon=True).start()
+    return future
+
+
+def startup_stats():
+    """Seconds from launch until each piece was ready, and what is still starting."""
+    with _lock:
+        return {"ready_after_seconds": dict(_marks), "pending": sorted(_pending)}
+
+
+def report():
+    """Prints one line with every startup time recorded so far."""
+    stats = startup_stats()
+    ready = ", ".join(f"{name} {seconds:.2f} s" for name, seconds in sorted(stats["ready_after_seconds"].items(), key=lambda item: item[1]))
+    pending = f"; still starting: {', '.join(stats['pending'])}" if stats["pending"] else ""
+    print(f"Startup report: {ready}{pending}.")